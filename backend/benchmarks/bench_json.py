@@ -0,0 +1,104 @@
+"""
+Бенчмарк сериализации и сжатия ответов API.
+
+Для ответов рекомендаций (20 фильмов с описаниями и скорами NumPy) и страниц
+похожих фильмов разного размера замеряет время кодирования стандартным json
+(через DefaultJSONProvider Flask) и orjson (fast_json), а также размер ответа
+без сжатия, с gzip и с brotli (если установлен).
+
+    python bench_json.py --sizes 20 200 1000 --output json.json
+"""
+import argparse
+import gzip
+import json
+import platform
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+sys.path.append(str(ROOT_DIR / "lib" / "api"))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import compression
+import fast_json
+from bench_recommendations import git_commit, measure
+from synthetic import movie_rows
+
+
+def similar_movies_page(size, seed):
+    """Страница похожих фильмов в формате fields=full."""
+    return [
+        {
+            'id': i + 1, 'user_id': 1, 'movie_id': i + 1, 'title': title, 'date_x': date_x,
+            'score': score, 'genre': genre, 'overview': overview, 'crew': crew,
+            'orig_title': title, 'status': 'Released', 'orig_lang': 'English',
+            'budget_x': budget, 'revenue': revenue, 'country': 'AU',
+            'added_at': '2024-01-01T00:00:00.000000Z',
+        }
+        for i, (title, date_x, score, genre, overview, crew, budget, revenue)
+        in enumerate(movie_rows(size, seed))
+    ]
+
+
+def recommendations(size, seed):
+    """Ответ рекомендаций: скоры - скаляры NumPy, как их отдает score_candidates."""
+    scores = np.random.default_rng(seed).random(size, dtype=np.float32)
+    return [
+        {'id': movie['id'], 'title': movie['title'], 'overview': movie['overview'],
+         'genre': movie['genre'], 'score': movie['score'], 'similarity_score': scores[i],
+         'matched_actors': []}
+        for i, movie in enumerate(similar_movies_page(size, seed))
+    ]
+
+
+def bench_payload(payload, repeats):
+    stdlib = DefaultJSONProvider(Flask(__name__))
+    result = {}
+    # Стандартный json не знает NumPy - скоры приводятся к float заранее, как раньше в коде
+    plain_payload = json.loads(fast_json.dumps(payload))
+    result['stdlib_encode'], body = measure(
+        lambda: stdlib.dumps(plain_payload, separators=(',', ':')).encode('utf-8'), repeats)
+    result['orjson_encode'], body = measure(lambda: fast_json.dumps(payload), repeats)
+    result['gzip_compress'], gzipped = measure(
+        lambda: gzip.compress(body, compresslevel=compression.GZIP_LEVEL), repeats)
+    sizes = {'raw': len(body), 'gzip': len(gzipped)}
+    if compression.brotli is not None:
+        result['br_compress'], brotlied = measure(lambda: compression.compress(body, 'br'), repeats)
+        sizes['br'] = len(brotlied)
+    return {'timings': result, 'bytes': sizes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк JSON-сериализации и сжатия")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 200, 1000],
+                        help="Размеры страниц похожих фильмов")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'orjson': fast_json.orjson is not None,
+        'brotli': compression.brotli is not None,
+        'recommendations': bench_payload(recommendations(20, args.seed), args.repeats),
+        'similar_movies': {
+            str(size): bench_payload(similar_movies_page(size, args.seed), args.repeats)
+            for size in args.sizes
+        },
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+Бенчмарк горячего пути /api/ml/recommendations.
+
+Для каждого размера каталога генерирует синтетическую БД, отдельно замеряет
+этапы рекомендаций (фильтр по жанру, словарь актеров, фильтр по актерам,
+кодирование, скоринг, top-k, MMR, кластеры вкусов с полнотой относительно полного
+поиска) и end-to-end запрос через тестовый клиент Flask;
+с --shards N дополнительно замеряет scatter-gather поиск по N процессам-шардам. Если MMR
+добавляет больше --mmr-budget-ms к top-k, скрипт завершается с кодом 1. По умолчанию
+используется энкодер-заглушка 'hashing', так что модель не скачивается.
+
+    python bench_recommendations.py --sizes 10000 100000 1000000 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+sys.path.append(str(ROOT_DIR / "lib" / "api"))
+sys.path.append(str(ROOT_DIR / "backend" / "database"))
+
+from synthetic import ACTORS, GENRES, generate_catalog
+
+
+def measure(fn, repeats):
+    """Запускает fn repeats раз, возвращает (статистика в мс, последний результат)."""
+    timings = []
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    stats = {
+        'min_ms': round(timings[0], 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+    }
+    return stats, result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_shards(db_path, conn, args, genre, model_name, target_embeddings, weights, blend_weights):
+    """Scatter-gather по args.shards процессам-шардам (сравнимо с scoring + blend + top_k)."""
+    import multiprocessing
+    from shards import ShardedSearch, shard_ranges, _serve
+
+    with tempfile.TemporaryDirectory() as socket_dir:
+        processes, addresses = [], []
+        for shard, id_range in enumerate(shard_ranges(conn, args.shards)):
+            address = str(Path(socket_dir) / f"shard-{shard}.sock")
+            process = multiprocessing.Process(target=_serve, args=(str(db_path), address, id_range), daemon=True)
+            process.start()
+            processes.append(process)
+            addresses.append(address)
+        search = ShardedSearch(addresses, timeout=30)
+        try:
+            def query():
+                return search.search(target_embeddings, weights, blend_weights, genre, None, 20, model_name)
+
+            # Ждем сокеты и первую загрузку каталога шардами
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    query()
+                    break
+                except Exception:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.1)
+            timing, result = measure(query, args.repeats)
+            if result.failed:
+                raise RuntimeError(f"shards failed: {result.failed}")
+            return timing
+        finally:
+            search.close()
+            for process in processes:
+                process.terminate()
+                process.join()
+
+
+def bench_catalog(app_module, size, args):
+    import db
+    from embedding_store import EmbeddingStore
+    from recommender import (
+        fetch_user_history, fetch_genre_candidates,
+        target_weights, score_candidates, score_weights, blend_scores,
+    )
+    from topk import top_k
+    from diversity import mmr, DEFAULT_LAMBDA, DEFAULT_POOL_SIZE
+    from gazetteer import ActorIndex, catalog_version
+    from catalog import Catalog, CatalogIndex
+    from clusters import ClusterIndex, evaluate, taste_vector
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "bench.db"
+        conn = sqlite3.connect(db_path)
+        db.migrate(conn)
+        generate_catalog(conn, size, users=args.users, history=args.history, seed=args.seed)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+
+        genre = GENRES[0]
+        actors = ACTORS[:2]
+        description = f"A story about a secret mission with {actors[0]} and {actors[1]}"
+        model = app_module.model
+        store = EmbeddingStore(model)
+        stages = {}
+
+        stages['user_history'], (liked_ids, liked_overviews) = measure(
+            lambda: fetch_user_history(cursor, 1), args.repeats)
+        # Кандидаты из SQLite (до колоночного каталога) и из каталога в памяти
+        stages['genre_filter_sql'], _ = measure(
+            lambda: fetch_genre_candidates(cursor, genre), args.repeats)
+        stages['load_catalog'], catalog = measure(
+            lambda: Catalog.load(conn, catalog_version(conn)), args.repeats)
+        stages['genre_filter'], rows = measure(
+            lambda: catalog.genre_candidates(genre), args.repeats)
+        # Словарь актеров строится один раз на версию каталога, дальше читается из actor_gazetteer
+        actor_index = ActorIndex()
+        stages['build_gazetteer'], _ = measure(
+            lambda: actor_index.rebuild(conn, catalog_version(conn)), 1)
+        stages['load_gazetteer'], gazetteer = measure(
+            lambda: actor_index.load(conn, catalog_version(conn)), args.repeats)
+        stages['actor_match'], actor_ids = measure(
+            lambda: gazetteer.movies_for(gazetteer.find(description)), args.repeats)
+        stages['genre_filter_actors'], actor_rows = measure(
+            lambda: catalog.genre_candidates(genre, catalog.rows_for_ids(actor_ids)), args.repeats)
+
+        target_texts = [description] + liked_overviews
+        overviews = [catalog.text('overview', row) for row in rows]
+        candidate_ids = catalog.ids[rows].tolist()
+        stages['encode_targets'], _ = measure(
+            lambda: model.encode(target_texts), args.repeats)
+        # Кодирование всех кандидатов (холодный movie_embeddings) и чтение готовых векторов
+        stages['encode_candidates'], _ = measure(
+            lambda: model.encode(overviews), args.repeats)
+        store.get(conn, candidate_ids + liked_ids)
+        stages['load_embeddings'], movie_embeddings = measure(
+            lambda: store.get(conn, candidate_ids), args.repeats)
+        # Те же векторы из снимка каталога, как в запросе; снимок с векторами строится в фоне
+        stages['load_catalog_embeddings'], snapshot = measure(
+            lambda: Catalog.load(conn, catalog_version(conn), model=store.encoder.name), 1)
+        stages['snapshot_embeddings'], _ = measure(
+            lambda: snapshot.embeddings_for(rows, lambda ids: store.get(conn, ids)), args.repeats)
+        target_embeddings = np.vstack([model.encode(target_texts), store.get(conn, liked_ids)])
+
+        weights = target_weights(len(liked_overviews) + len(liked_ids))
+        stages['scoring'], scores = measure(
+            lambda: score_candidates(target_embeddings, movie_embeddings, weights), args.repeats)
+        blend_weights = score_weights()
+        stages['blend'], scores = measure(
+            lambda: blend_scores(
+                scores, [], catalog.features_for(rows), blend_weights),
+            args.repeats)
+        stages['top_k'], _ = measure(lambda: top_k(scores, 20), args.repeats)
+        stages['mmr'], _ = measure(
+            lambda: mmr(movie_embeddings, scores, 20, DEFAULT_LAMBDA, DEFAULT_POOL_SIZE), args.repeats)
+        # Кластеры вкусов: обучение по всем профилям, отбор кандидатов по индексу (пулы и
+        # списки ближайших к описанию) без векторов жанра, затем векторы и скоринг только по ним
+        catalog_index, cluster_index = CatalogIndex(store), ClusterIndex()
+        stages['build_clusters'], _ = measure(
+            lambda: cluster_index.update(conn, store, catalog_index), 1)
+        clusters = cluster_index.get(conn)
+        stages['taste_clusters'], cluster_rows = measure(
+            lambda: clusters.restrict(
+                catalog, rows, taste_vector(target_embeddings[1:]), min_size=20, query=target_embeddings[0]),
+            args.repeats)
+        stages['scoring_clustered'], _ = measure(
+            lambda: score_candidates(
+                target_embeddings, snapshot.embeddings_for(cluster_rows, lambda ids: store.get(conn, ids)), weights),
+            args.repeats)
+        user_ids = [row[0] for row in conn.execute("SELECT user_id FROM user_profile_version LIMIT 50")]
+        # Полнота на смеси запросов как в API: описание (описания фильмов жанра и текст
+        # end-to-end запроса) плюс история пользователя
+        descriptions = ["A story about a secret mission"] + \
+            [catalog.text('overview', row) for row in rows[::max(len(rows) // 49, 1)][:49]]
+        cluster_report = evaluate(conn, clusters, catalog_index.get(conn), store, user_ids, genre, descriptions)
+        if args.shards:
+            stages['shard_search'] = bench_shards(
+                db_path, conn, args, genre, model.name, target_embeddings, weights, blend_weights)
+        conn.close()
+
+        app_module.app.config['DATABASE'] = db_path
+        client = app_module.app.test_client()
+        for name, text in (('end_to_end', "A story about a secret mission"),
+                           ('end_to_end_actors', description)):
+            payload = {'user_id': 1, 'description': text, 'genres': genre}
+            with contextlib.redirect_stdout(sys.stderr):
+                stages[name], response = measure(
+                    lambda: client.post('/api/ml/recommendations', json=payload), args.repeats)
+            if response.status_code != 200:
+                raise RuntimeError(f"{name}: HTTP {response.status_code} {response.get_data(as_text=True)}")
+
+    # MMR заменяет top_k, поэтому добавленная задержка - разница медиан
+    mmr_added_ms = round(stages['mmr']['median_ms'] - stages['top_k']['median_ms'], 3)
+    return {
+        'catalog_size': size,
+        'mmr_added_ms': mmr_added_ms,
+        'mmr_within_budget': mmr_added_ms <= args.mmr_budget_ms,
+        'genre_candidates': len(rows),
+        'actor_candidates': len(actor_rows),
+        'catalog_mb': round(catalog.nbytes / 2 ** 20, 2),
+        'cluster_candidates': len(cluster_rows),
+        'cluster_recall_at_20': cluster_report['recall_at_k'],
+        'cluster_candidate_fraction': cluster_report['candidate_fraction'],
+        'history_size': len(liked_ids) + len(liked_overviews),
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк рекомендаций")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--history', type=int, default=20)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--encoder', default='hashing',
+                        help="ENCODER_BACKEND приложения: hashing, onnx или torch")
+    parser.add_argument('--mmr-budget-ms', type=float, default=10.0,
+                        help="Допустимая добавленная задержка MMR; при превышении код выхода 1")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="Число процессов-шардов для замера шардированного поиска (0 - не замерять)")
+    parser.add_argument('--output', help="Файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    os.environ['ENCODER_BACKEND'] = args.encoder
+    os.environ['RECOMMENDATION_CACHE'] = 'none'
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as app_module
+    app_module.app.config['SEND_TELEGRAM_NOTIFICATIONS'] = False
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'encoder': args.encoder,
+        'repeats': args.repeats,
+        'seed': args.seed,
+        'results': [bench_catalog(app_module, size, args) for size in args.sizes],
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+    if not all(result['mmr_within_budget'] for result in report['results']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
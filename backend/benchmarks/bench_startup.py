@@ -0,0 +1,129 @@
+"""
+Профиль холодного старта: время импорта API и админ-скриптов.
+
+Для каждой точки входа в отдельном процессе замеряет время `import <модуль>`
+(медиана по --repeats запускам), разбор `python -X importtime` по пакетам
+верхнего уровня и самые тяжелые модули, а также проверяет, что при импорте
+не загружены ML-зависимости (torch, sentence_transformers, scikit-learn,
+onnxruntime) - они нужны только при первой рекомендации. Если точка входа
+медленнее --budget-ms или тянет тяжелые модули, скрипт завершается с кодом 1.
+
+    python bench_startup.py --targets app db --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from bench_recommendations import git_commit
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+
+# Точка входа -> каталог, из которого она импортируется
+TARGETS = {
+    'app': ROOT_DIR / "lib" / "api",
+    'db': ROOT_DIR / "backend" / "database",
+    'embedding_store': ROOT_DIR / "backend" / "services",
+}
+HEAVY_MODULES = ('torch', 'sentence_transformers', 'sklearn', 'scipy', 'onnxruntime', 'transformers')
+# Бюджет холодного импорта API без ML-зависимостей, включая старт интерпретатора
+DEFAULT_BUDGET_MS = 400
+
+
+def run_python(target, code, *flags):
+    env = dict(os.environ, ENCODER_BACKEND=os.environ.get('ENCODER_BACKEND', 'hashing'))
+    return subprocess.run(
+        [sys.executable, *flags, '-c', code], cwd=TARGETS[target], env=env,
+        capture_output=True, text=True, check=True,
+    )
+
+
+def wall_time_ms(target, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run_python(target, f'import {target}')
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'min_ms': round(min(timings), 1), 'median_ms': round(statistics.median(timings), 1)}
+
+
+def parse_importtime(stderr):
+    """Строки `import time: self | cumulative | name` -> [(модуль, self мкс, cumulative мкс)]."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def import_profile(target, top):
+    modules = parse_importtime(run_python(target, f'import {target}', '-X', 'importtime').stderr)
+    packages = defaultdict(int)
+    for name, self_us, _ in modules:
+        packages[name.split('.')[0]] += self_us
+    return {
+        'total_ms': round(next(c for n, _, c in modules if n == target) / 1000, 1),
+        'packages_ms': {
+            name: round(us / 1000, 1)
+            for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        },
+        'slowest_modules_ms': {
+            name: round(cumulative_us / 1000, 1)
+            for name, _, cumulative_us in sorted(modules, key=lambda m: -m[2])[:top]
+        },
+    }
+
+
+def heavy_modules_loaded(target):
+    code = (f'import sys, json, {target}; '
+            f'print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))')
+    return json.loads(run_python(target, code).stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профиль времени старта и импортов")
+    parser.add_argument('--targets', nargs='+', default=['app', 'db'], choices=sorted(TARGETS))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help="Сколько пакетов и модулей показывать")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help="Допустимая медиана холодного импорта")
+    parser.add_argument('--output', help="Файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.targets:
+        wall = wall_time_ms(target, args.repeats)
+        heavy = heavy_modules_loaded(target)
+        results[target] = {
+            'wall': wall,
+            'importtime': import_profile(target, args.top),
+            'heavy_modules': heavy,
+            'within_budget': wall['median_ms'] <= args.budget_ms and not heavy,
+        }
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'budget_ms': args.budget_ms,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+    if not all(result['within_budget'] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""
+Нагрузочный тест API (lib/api/app.py).
+
+Поднимает приложение локально на синтетическом каталоге с энкодером-заглушкой
+'hashing' и заглушкой Telegram Bot API, затем воспроизводит смесь трафика:
+логин, добавление/удаление/список похожих фильмов, отзывы и ML-рекомендации.
+Отчет - пропускная способность, доля ошибок и перцентили задержки по эндпоинтам.
+
+    python loadtest.py --concurrency 200 --duration 60 --rate 500 --output load.json
+    python loadtest.py --url http://localhost:5000 --concurrency 50   # внешний сервер
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+ROOT_DIR = Path(__file__).parent.parent.parent
+sys.path.append(str(ROOT_DIR / "lib" / "api"))
+sys.path.append(str(ROOT_DIR / "backend" / "database"))
+
+from synthetic import GENRES, WORDS, ACTORS, generate_catalog, random_overview
+
+# Доли операций в смеси трафика
+TRAFFIC_MIX = {
+    'login': 10,
+    'similar_add': 15,
+    'similar_delete': 10,
+    'similar_list': 25,
+    'feedback': 5,
+    'recommendations': 35,
+}
+
+PASSWORD = 'loadtest-password'
+
+
+class TelegramStub:
+    """Локальная заглушка Telegram Bot API: принимает sendMessage и считает вызовы."""
+
+    def __init__(self):
+        self.messages = 0
+        lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with lock:
+                    stub.messages += 1
+                body = b'{"ok": true, "result": {}}'
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextlib.contextmanager
+def local_app(args, telegram_url):
+    """Запускает приложение в этом процессе на временной синтетической БД."""
+    from werkzeug.serving import make_server
+    import db
+
+    os.environ['ENCODER_BACKEND'] = 'hashing'
+    os.environ['TELEGRAM_API_URL'] = telegram_url
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as app_module
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = Path(tmp_dir) / "loadtest.db"
+        conn = sqlite3.connect(db_path)
+        db.migrate(conn)
+        generate_catalog(conn, args.catalog_size, users=0, seed=args.seed)
+        conn.close()
+
+        app_module.app.config['DATABASE'] = db_path
+        app_module.app.config['SEND_TELEGRAM_NOTIFICATIONS'] = True
+        server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f'http://127.0.0.1:{server.server_port}'
+        finally:
+            server.shutdown()
+
+
+class LoadClient:
+    """Выполняет операции смеси трафика от имени случайных пользователей."""
+
+    def __init__(self, base_url, users, seed):
+        self.base_url = base_url.rstrip('/')
+        self.users = users
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+
+    def _user(self):
+        return self.rng.choice(self.users)
+
+    def _movie(self):
+        return {
+            'title': f"Liked movie {self.rng.randint(1, 10 ** 6)}",
+            'date_x': '2010-01-01',
+            'score': round(self.rng.uniform(10, 90), 1),
+            'genre': ', '.join(self.rng.sample(GENRES, 2)),
+            'overview': random_overview(self.rng),
+            'crew': json.dumps({'Actors': ', '.join(self.rng.sample(ACTORS, 3))}),
+        }
+
+    def login(self):
+        user = self._user()
+        return self.session.post(f"{self.base_url}/api/login",
+                                 json={'login': user['login'], 'password': PASSWORD})
+
+    def similar_add(self):
+        user = self._user()
+        return self.session.post(f"{self.base_url}/api/users/{user['user_id']}/similar_movies",
+                                 json=self._movie())
+
+    def similar_list(self):
+        user = self._user()
+        return self.session.get(f"{self.base_url}/api/users/{user['user_id']}/similar_movies")
+
+    def similar_delete(self):
+        user = self._user()
+        movies = self.session.get(
+            f"{self.base_url}/api/users/{user['user_id']}/similar_movies").json()
+        if not movies:
+            return self.similar_add()
+        movie_id = self.rng.choice(movies)['id']
+        return self.session.delete(
+            f"{self.base_url}/api/users/{user['user_id']}/similar_movies/{movie_id}")
+
+    def feedback(self):
+        user = self._user()
+        return self.session.post(f"{self.base_url}/api/feedback", json={
+            'user_id': user['user_id'],
+            'grade': self.rng.randint(1, 5),
+            'text': 'load test feedback',
+        })
+
+    def recommendations(self):
+        user = self._user()
+        description = ' '.join(self.rng.choices(WORDS, k=8))
+        if self.rng.random() < 0.3:
+            description += f" with {self.rng.choice(ACTORS)}"
+        return self.session.post(f"{self.base_url}/api/ml/recommendations", json={
+            'user_id': user['user_id'],
+            'description': description,
+            'genres': self.rng.choice(GENRES),
+        })
+
+
+def create_users(base_url, count, history, seed):
+    """Регистрирует пользователей через API и наполняет их историю."""
+    session = requests.Session()
+    rng = random.Random(seed)
+    users = []
+    for i in range(count):
+        login = f"load_user_{i}_{seed}"
+        session.post(f"{base_url}/api/users",
+                     json={'login': login, 'password': PASSWORD, 'email': f"{login}@example.com"})
+        response = session.post(f"{base_url}/api/login", json={'login': login, 'password': PASSWORD})
+        response.raise_for_status()
+        users.append({'user_id': response.json()['user_id'], 'login': login})
+
+    client = LoadClient(base_url, users, rng.random())
+    for user in users:
+        client.users = [user]
+        for _ in range(history):
+            client.similar_add()
+    client.users = users
+    return users
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(base_url, users, args):
+    """Гоняет смесь трафика; возвращает {операция: [(задержка, статус или None)]}."""
+    operations = list(TRAFFIC_MIX)
+    weights = [TRAFFIC_MIX[op] for op in operations]
+    results = defaultdict(list)
+    results_lock = threading.Lock()
+    ticket = itertools.count()
+    ticket_lock = threading.Lock()
+    start = time.perf_counter()
+    deadline = start + args.duration
+
+    def worker(worker_id):
+        client = LoadClient(base_url, users, args.seed * 100003 + worker_id)
+        while True:
+            with ticket_lock:
+                n = next(ticket)
+            if args.requests and n >= args.requests:
+                return
+            if args.rate:
+                # Открытая модель нагрузки: n-й запрос стартует не раньше n / rate
+                delay = start + n / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            if time.perf_counter() >= deadline:
+                return
+
+            operation = client.rng.choices(operations, weights)[0]
+            request_start = time.perf_counter()
+            try:
+                status = getattr(client, operation)().status_code
+            except requests.RequestException:
+                status = None
+            latency = time.perf_counter() - request_start
+            with results_lock:
+                results[operation].append((latency, status))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def build_report(results, elapsed, args):
+    endpoints = {}
+    total = errors_total = 0
+    for operation in TRAFFIC_MIX:
+        samples = results.get(operation, [])
+        latencies = sorted(round(latency * 1000, 3) for latency, _ in samples)
+        statuses = defaultdict(int)
+        for _, status in samples:
+            statuses[str(status)] += 1
+        errors = sum(1 for _, status in samples if status is None or status >= 500)
+        total += len(samples)
+        errors_total += errors
+        endpoints[operation] = {
+            'requests': len(samples),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'errors': errors,
+            'error_rate': round(errors / len(samples), 4) if samples else 0.0,
+            'statuses': dict(statuses),
+            'latency_ms': {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1] if latencies else None,
+            },
+        }
+    return {
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        'duration_s': round(elapsed, 3),
+        'requests': total,
+        'throughput_rps': round(total / elapsed, 2),
+        'error_rate': round(errors_total / total, 4) if total else 0.0,
+        'endpoints': endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API Movie Helper")
+    parser.add_argument('--url', help="Адрес уже запущенного API (по умолчанию поднимается локально)")
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--rate', type=float, help="Запросов в секунду суммарно (по умолчанию без ограничения)")
+    parser.add_argument('--duration', type=float, default=30, help="Длительность, секунд")
+    parser.add_argument('--requests', type=int, help="Остановиться после стольких запросов")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--history', type=int, default=10)
+    parser.add_argument('--catalog-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Файл для JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    with TelegramStub() as telegram:
+        app_context = contextlib.nullcontext(args.url) if args.url else local_app(args, telegram.url)
+        with app_context as base_url:
+            users = create_users(base_url, args.users, args.history, args.seed)
+            results, elapsed = run_load(base_url, users, args)
+        report = build_report(results, elapsed, args)
+        report['telegram_messages'] = telegram.messages
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Генерация синтетического каталога фильмов и историй пользователей.
+
+Данные детерминированы по seed, поэтому результаты бенчмарков можно
+сравнивать между коммитами.
+"""
+import json
+import random
+
+GENRES = [
+    'Drama', 'Comedy', 'Action', 'Thriller', 'Horror', 'Romance', 'Sci-Fi',
+    'Adventure', 'Animation', 'Crime', 'Fantasy', 'Mystery', 'Family',
+    'Documentary', 'History', 'War', 'Music', 'Western',
+]
+
+WORDS = (
+    "story young man woman family war space love secret city world life "
+    "death friend journey mystery hero villain crime detective police ship "
+    "planet future past time dream power battle school town island night "
+    "killer ghost house team mission escape truth revenge king queen army "
+    "robot alien ocean mountain desert forest road music band dance heist "
+    "money bank prison soldier doctor lawyer reporter scientist artist child "
+    "father mother brother sister daughter son wedding holiday summer winter"
+).split()
+
+FIRST_NAMES = (
+    "Tom Anna Chris Emma James Olivia Robert Sophia Michael Isabella David "
+    "Mia Daniel Charlotte Matthew Amelia Andrew Harper Joseph Evelyn Ryan "
+    "Abigail Kevin Emily Brian Elizabeth George Sofia Edward Avery Henry"
+).split()
+
+LAST_NAMES = (
+    "Hardy Stone Pratt Watson Franco Wilde Pine Hathaway Reeves Johansson "
+    "Clooney Bullock Damon Blunt Gosling Stewart Evans Larson Holland Zendaya "
+    "Cumberbatch Robbie Driver Ronan Murphy Pugh Chalamet Kidman Fassbender"
+).split()
+
+ACTORS = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+
+
+def random_overview(rng, min_words=15, max_words=40):
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    return ' '.join(words).capitalize() + '.'
+
+
+def movie_rows(size, seed=0):
+    """Строки для INSERT INTO movies (title, date_x, score, genre, overview, crew, budget_x, revenue)."""
+    rng = random.Random(seed)
+    for i in range(size):
+        genres = rng.sample(GENRES, rng.randint(1, 3))
+        actors = rng.sample(ACTORS, 3)
+        yield (
+            f"Movie {i}",
+            f"{rng.randint(1950, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            round(rng.uniform(10, 90), 1),
+            ', '.join(genres),
+            random_overview(rng),
+            json.dumps({'Actors': ', '.join(actors)}),
+            round(rng.uniform(1e5, 3e8), 2),
+            round(rng.uniform(0, 2e9), 2),
+        )
+
+
+def generate_catalog(conn, size, users=100, history=20, seed=0, batch_size=10000):
+    """
+    Заполняет movies синтетическим каталогом из size фильмов и создает users
+    пользователей, у каждого по history похожих фильмов из каталога.
+    """
+    rows = movie_rows(size, seed)
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        conn.executemany(
+            """INSERT INTO movies
+            (title, date_x, score, genre, overview, crew, budget_x, revenue)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            batch
+        )
+
+    rng = random.Random(seed + 1)
+    for user_id in range(1, users + 1):
+        conn.execute(
+            "INSERT INTO users (user_id, login, email, password) VALUES (?, ?, ?, ?)",
+            (user_id, f"user{user_id}", f"user{user_id}@example.com", 'synthetic')
+        )
+        movie_ids = [rng.randint(1, size) for _ in range(history)]
+        conn.executemany(
+            """INSERT INTO similar_movies (user_id, movie_id, title)
+            SELECT ?, id, title FROM movies WHERE id = ?""",
+            [(user_id, movie_id) for movie_id in movie_ids]
+        )
+    conn.commit()
@@ -0,0 +1,192 @@
+"""
+Снимки базы без остановки сервиса через SQLite backup API.
+
+snapshot копирует базу по pages страниц за шаг с паузой sleep между шагами:
+блокировка чтения держится только на время шага, так что запись в users,
+feedback и similar_movies ждет не дольше одного шага. Если базу меняет другое
+соединение, SQLite начинает копирование заново; после max_restarts таких
+перезапусков попытка прерывается и через retry_delay секунд начинается новая
+(всего attempts попыток). Копирования одним шагом, которое держало бы
+блокировку все время, нет. Снимок пишется во временный файл и появляется под
+своим именем только целиком и после PRAGMA quick_check.
+
+restore так же по шагам разворачивает снимок в новую базу (по умолчанию
+отказывается перезаписывать существующую) и применяет миграции, так что
+новый узел поднимается из снимка любой старой версии схемы.
+
+    python backup.py snapshot --output snapshots/movies.db
+    python backup.py restore snapshots/movies.db --database /srv/movies.db
+"""
+import argparse
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from db import DB_PATH, migrate
+
+PAGES = 256
+SLEEP = 0.05
+MAX_RESTARTS = 5
+ATTEMPTS = 3
+RETRY_DELAY = 5.0
+
+
+class SnapshotError(Exception):
+    """Снимок не создан или не прошел проверку."""
+
+
+class SnapshotBusy(SnapshotError):
+    """База менялась слишком часто: копирование перезапускалось больше max_restarts раз."""
+
+
+def _copy(source, target, pages, sleep, max_restarts, progress):
+    """Копирует source в target по шагам; возвращает число перезапусков, после max_restarts - SnapshotBusy."""
+    restarts = 0
+    last_remaining = None
+
+    def on_step(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # Успешный шаг без уменьшения остатка - другое соединение изменило базу
+        # и SQLite начал копирование заново
+        if status == sqlite3.SQLITE_OK and last_remaining is not None and remaining >= last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise SnapshotBusy(f"Database changed during {restarts} copy attempts")
+        last_remaining = remaining
+        if progress is not None:
+            progress(remaining, total)
+
+    source.backup(target, pages=pages, progress=on_step, sleep=sleep)
+    return restarts
+
+
+def _schema_version(conn):
+    # db.schema_version создает schema_migrations, а снимок менять нельзя
+    try:
+        return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+def _discard(path):
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        Path(str(path) + suffix).unlink(missing_ok=True)
+
+
+def snapshot(database, output, pages=PAGES, sleep=SLEEP, max_restarts=MAX_RESTARTS, progress=None,
+             attempts=ATTEMPTS, retry_delay=RETRY_DELAY):
+    """
+    Снимок базы database (путь) в файл output.
+
+    progress(remaining, total) вызывается после каждого шага. Возвращает
+    {'path', 'bytes', 'schema_version', 'restarts', 'attempts', 'seconds'};
+    если все attempts попыток прервались из-за записи в базу - SnapshotBusy.
+    """
+    started = time.perf_counter()
+    for attempt in range(1, attempts + 1):
+        try:
+            result = _snapshot_once(database, output, pages, sleep, max_restarts, progress)
+        except SnapshotBusy:
+            if attempt == attempts:
+                raise
+            time.sleep(retry_delay)
+            continue
+        result.update(attempts=attempt, seconds=round(time.perf_counter() - started, 3))
+        return result
+
+
+def _snapshot_once(database, output, pages, sleep, max_restarts, progress):
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    partial = output.with_name(output.name + '.part')
+    _discard(partial)
+    source = sqlite3.connect(database)
+    target = sqlite3.connect(partial)
+    try:
+        restarts = _copy(source, target, pages, sleep, max_restarts, progress)
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != 'ok':
+            raise SnapshotError(f"Snapshot failed quick_check: {check}")
+        version = _schema_version(target)
+    except BaseException:
+        target.close()
+        _discard(partial)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(partial, output)
+    return {
+        'path': str(output),
+        'bytes': output.stat().st_size,
+        'schema_version': version,
+        'restarts': restarts,
+    }
+
+
+def restore(snapshot_path, database, pages=PAGES, sleep=0, force=False, progress=None):
+    """
+    Разворачивает снимок в базу database и применяет миграции.
+
+    Существующую базу перезаписывает только с force=True (сервис с ней должен
+    быть остановлен). Возвращает {'path', 'schema_version', 'seconds'}.
+    """
+    database = Path(database)
+    if database.exists() and database.stat().st_size and not force:
+        raise SnapshotError(f"{database} already exists")
+    started = time.perf_counter()
+    source = sqlite3.connect(f"file:{Path(snapshot_path).resolve()}?mode=ro", uri=True)
+    try:
+        check = source.execute("PRAGMA quick_check").fetchone()[0]
+        if check != 'ok':
+            raise SnapshotError(f"Snapshot failed quick_check: {check}")
+        database.parent.mkdir(parents=True, exist_ok=True)
+        partial = database.with_name(database.name + '.part')
+        _discard(partial)
+        target = sqlite3.connect(partial)
+        try:
+            # Снимок никто не меняет, перезапусков не бывает
+            _copy(source, target, pages, sleep, 0, progress)
+            version = migrate(target)
+        except BaseException:
+            target.close()
+            _discard(partial)
+            raise
+        target.close()
+    finally:
+        source.close()
+    _discard(database)
+    os.replace(partial, database)
+    return {'path': str(database), 'schema_version': version,
+            'seconds': round(time.perf_counter() - started, 3)}
+
+
+def main():
+    import json
+
+    parser = argparse.ArgumentParser(description="Снимки базы через SQLite backup API")
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('snapshot', help="Снимок работающей базы")
+    create.add_argument('--database', default=DB_PATH)
+    create.add_argument('--output', required=True)
+    create.add_argument('--pages', type=int, default=PAGES, help="Страниц за шаг")
+    create.add_argument('--sleep', type=float, default=SLEEP, help="Пауза между шагами, секунды")
+    create.add_argument('--attempts', type=int, default=ATTEMPTS,
+                        help="Попыток, если база меняется во время копирования")
+    load = commands.add_parser('restore', help="Развернуть снимок в новую базу")
+    load.add_argument('snapshot')
+    load.add_argument('--database', default=DB_PATH)
+    load.add_argument('--pages', type=int, default=PAGES * 16)
+    load.add_argument('--force', action='store_true', help="Перезаписать существующую базу")
+    args = parser.parse_args()
+
+    if args.command == 'snapshot':
+        result = snapshot(args.database, args.output, args.pages, args.sleep, attempts=args.attempts)
+    else:
+        result = restore(args.snapshot, args.database, args.pages, force=args.force)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,11 @@ import sqlite3
 import csv
 from pathlib import Path
 
-def init_db():
-    db_path = Path(__file__).parent / "movies.db"
-    conn = sqlite3.connect(db_path)
-    
+DB_PATH = Path(__file__).parent / "movies.db"
+
+
+def create_schema(conn):
+    """Создает таблицы приложения, если их еще нет."""
     conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -60,7 +61,12 @@ def init_db():
         country TEXT
     )
     """)
-    
+
+
+def init_db():
+    conn = sqlite3.connect(DB_PATH)
+    migrate(conn)
+
     # Проверяем, есть ли уже данные в таблице movies
     if not conn.execute("SELECT COUNT(*) FROM movies").fetchone()[0]:
         csv_path = Path(__file__).parent.parent / "data" / "imdb_movies.csv"
@@ -92,30 +98,290 @@ def init_db():
     conn.close()
 
 
-def add_email_column():
-    db_path = Path(__file__).parent / "movies.db"
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Проверяем, существует ли уже колонка email
-    cursor.execute("PRAGMA table_info(users)")
-    columns = cursor.fetchall()
-    column_names = [column[1] for column in columns]
-    
+def _add_email_column(conn):
+    # Старые базы создавались без колонки email
+    column_names = [column[1] for column in conn.execute("PRAGMA table_info(users)")]
     if 'email' not in column_names:
-        # Добавляем колонку email, если её ещё нет
-        cursor.execute("ALTER TABLE users ADD COLUMN email TEXT UNIQUE")
-        print("Колонка email успешно добавлена")
-    else:
-        print("Колонка email уже существует")
-    
+        # SQLite не умеет ADD COLUMN ... UNIQUE, поэтому уникальность - через индекс
+        conn.execute("ALTER TABLE users ADD COLUMN email TEXT")
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)")
+
+
+def _add_user_scoped_indexes(conn):
+    # similar_movies читается только в рамках пользователя: список, рекомендации, удаление.
+    # (user_id, id) покрывает фильтр по user_id и keyset-пагинацию по id.
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_similar_movies_user_id
+    ON similar_movies (user_id, id)
+    """)
+
+
+# Колонки описания фильма, общие для movies и similar_movies
+MOVIE_COLUMNS = ('title', 'date_x', 'score', 'genre', 'overview', 'crew', 'orig_title',
+                 'status', 'orig_lang', 'budget_x', 'revenue', 'country')
+
+
+def _create_user_similar_movies_view(conn, own_columns):
+    # Поля фильма берутся из каталога, если есть ссылка, иначе из самой строки лайка
+    columns = ',\n        '.join(
+        [f"COALESCE(m.{name}, s.{name}) AS {name}" for name in MOVIE_COLUMNS]
+        + [f"s.{name} AS {name}" for name in own_columns]
+    )
+    conn.execute("DROP VIEW IF EXISTS user_similar_movies")
+    conn.execute(f"""
+    CREATE VIEW user_similar_movies AS
+    SELECT
+        s.id AS id,
+        s.user_id AS user_id,
+        {columns}
+    FROM similar_movies s
+    LEFT JOIN movies m ON m.id = s.movie_id
+    """)
+
+
+def _link_similar_movies_to_catalog(conn):
+    # Лайк фильма из каталога хранит только ссылку movie_id, данные берутся из movies.
+    # Старые строки с полной копией продолжают работать через COALESCE во view.
+    conn.execute("ALTER TABLE similar_movies ADD COLUMN movie_id INTEGER REFERENCES movies (id)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS movie_embeddings (
+        movie_id INTEGER PRIMARY KEY REFERENCES movies (id),
+        model TEXT NOT NULL,
+        embedding BLOB NOT NULL
+    )
+    """)
+    _create_user_similar_movies_view(conn, ('movie_id',))
+
+
+def _add_omdb_cache(conn):
+    # Кэш ответов OMDb API: ключ - нормализованные параметры запроса
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS omdb_cache (
+        key TEXT PRIMARY KEY,
+        body TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+
+
+def _add_movies_imdb_id(conn):
+    # Фильмы из OMDb дедуплицируются по imdbID; у фильмов из CSV он пустой
+    conn.execute("ALTER TABLE movies ADD COLUMN imdb_id TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_movies_imdb_id ON movies (imdb_id)")
+
+
+def _add_similar_movies_added_at(conn):
+    # Время добавления лайка для инкрементальной синхронизации клиента (?since=).
+    # SQLite не разрешает ADD COLUMN с DEFAULT CURRENT_TIMESTAMP, значение задается при вставке.
+    conn.execute("ALTER TABLE similar_movies ADD COLUMN added_at TEXT")
+    _create_user_similar_movies_view(conn, ('movie_id', 'added_at'))
+
+
+def _add_movie_features(conn):
+    # Нормированные числовые признаки для ранжирования (см. services/features.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS movie_features (
+        movie_id INTEGER PRIMARY KEY REFERENCES movies (id),
+        rating REAL NOT NULL,
+        recency REAL NOT NULL,
+        popularity REAL NOT NULL
+    )
+    """)
+
+
+def _add_catalog_version(conn):
+    # Версия каталога - случайный токен, который меняется при любом изменении movies
+    # (в том числе в обход API). По ней кэши, построенные по всему каталогу
+    # (словарь актеров services/gazetteer.py), понимают, что устарели.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version TEXT NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR REPLACE INTO catalog_version (id, version) VALUES (1, lower(hex(randomblob(8))))")
+    for event in ('INSERT', 'DELETE', 'UPDATE'):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS movies_catalog_version_{event.lower()}
+        AFTER {event} ON movies
+        BEGIN
+            UPDATE catalog_version SET version = lower(hex(randomblob(8)));
+        END
+        """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS actor_gazetteer (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        catalog_version TEXT NOT NULL,
+        format TEXT NOT NULL,
+        data BLOB NOT NULL
+    )
+    """)
+
+
+def _add_user_feeds(conn):
+    # Версия профиля вкуса - токен на пользователя, меняется при любом изменении его
+    # similar_movies; вместе с catalog_version определяет, устарела ли лента (services/feeds.py)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_profile_version (
+        user_id INTEGER PRIMARY KEY,
+        version TEXT NOT NULL
+    )
+    """)
+    conn.execute("""
+    INSERT OR IGNORE INTO user_profile_version (user_id, version)
+    SELECT user_id, lower(hex(randomblob(8))) FROM (SELECT DISTINCT user_id FROM similar_movies)
+    """)
+    for event, row in (('INSERT', 'NEW'), ('DELETE', 'OLD'), ('UPDATE', 'NEW')):
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS similar_movies_profile_version_{event.lower()}
+        AFTER {event} ON similar_movies
+        BEGIN
+            INSERT INTO user_profile_version (user_id, version)
+            VALUES ({row}.user_id, lower(hex(randomblob(8))))
+            ON CONFLICT (user_id) DO UPDATE SET version = excluded.version;
+        END
+        """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_feeds (
+        user_id INTEGER PRIMARY KEY,
+        profile_version TEXT NOT NULL,
+        catalog_version TEXT NOT NULL,
+        items TEXT NOT NULL,
+        refreshed_at TEXT NOT NULL
+    )
+    """)
+
+
+def _add_taste_clusters(conn):
+    # Кластеры вкусов пользователей и пулы кандидатов центроидов (services/clusters.py).
+    # revision меняется при каждой записи - по ней процессы API перечитывают кластеры;
+    # user_taste_clusters помнит, какая версия профиля уже учтена в центроидах
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS taste_clusters (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        model TEXT NOT NULL,
+        catalog_version TEXT NOT NULL,
+        revision TEXT NOT NULL,
+        data BLOB NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS user_taste_clusters (
+        user_id INTEGER PRIMARY KEY,
+        profile_version TEXT NOT NULL,
+        cluster INTEGER NOT NULL
+    )
+    """)
+
+
+def _add_feed_scheduler_tables(conn):
+    # Аренда фоновой задачи (services/feeds.py): в каждом процессе API есть планировщик
+    # лент, но работает только тот, кто держит аренду; остальные подхватывают ее, если
+    # владелец не продлил ее до expires_at (процесс упал или остановлен).
+    # feed_requests - запросы на пересчет лент из процессов, которые аренду не держат
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scheduler_leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS feed_requests (
+        user_id INTEGER PRIMARY KEY
+    )
+    """)
+
+
+def _key_movie_embeddings_by_model(conn):
+    # Векторы разных энкодеров (torch, onnx-fp32/int8, hashing) хранятся рядом и не
+    # затирают друг друга; model идет первым - снимок каталога читает векторы одной
+    # модели диапазоном movie_id по ключу
+    conn.execute("""
+    CREATE TABLE movie_embeddings_by_model (
+        movie_id INTEGER NOT NULL REFERENCES movies (id),
+        model TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        PRIMARY KEY (model, movie_id)
+    )
+    """)
+    conn.execute("""
+    INSERT INTO movie_embeddings_by_model (movie_id, model, embedding)
+    SELECT movie_id, model, embedding FROM movie_embeddings
+    """)
+    conn.execute("DROP TABLE movie_embeddings")
+    conn.execute("ALTER TABLE movie_embeddings_by_model RENAME TO movie_embeddings")
+
+
+# Версионированные миграции схемы: (версия, описание, функция).
+# Новые миграции добавляются только в конец списка.
+MIGRATIONS = [
+    (1, "users.email column", _add_email_column),
+    (2, "indexes on user-scoped tables", _add_user_scoped_indexes),
+    (3, "similar_movies.movie_id, movie_embeddings, user_similar_movies view",
+     _link_similar_movies_to_catalog),
+    (4, "omdb_cache table", _add_omdb_cache),
+    (5, "movies.imdb_id unique key", _add_movies_imdb_id),
+    (6, "similar_movies.added_at", _add_similar_movies_added_at),
+    (7, "movie_features table", _add_movie_features),
+    (8, "catalog_version triggers, actor_gazetteer table", _add_catalog_version),
+    (9, "user_profile_version triggers, user_feeds table", _add_user_feeds),
+    (10, "taste_clusters, user_taste_clusters tables", _add_taste_clusters),
+    (11, "scheduler_leases, feed_requests tables", _add_feed_scheduler_tables),
+    (12, "movie_embeddings keyed by (model, movie_id)", _key_movie_embeddings_by_model),
+]
+LATEST_SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    """Номер последней примененной миграции (0 для новой базы)."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Создает недостающие таблицы и применяет непримененные миграции.
+
+    Каждая миграция выполняется в своей транзакции BEGIN IMMEDIATE, так что
+    параллельный запуск из нескольких процессов безопасен, а повторный - ничего не делает.
+    Возвращает итоговую версию схемы.
+    """
+    create_schema(conn)
     conn.commit()
-    conn.close()
+    version = schema_version(conn)
+
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Другой процесс мог успеть применить миграцию, пока мы ждали блокировку
+            if schema_version(conn) >= number:
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES (?, ?)",
+                (number, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = number
+
+    return schema_version(conn)
 
 
 def drop_users_table():
-    db_path = Path(__file__).parent / "movies.db"
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(DB_PATH)
     conn.execute("DROP TABLE IF EXISTS users")
     conn.commit()
     conn.close()
@@ -0,0 +1,173 @@
+import unittest
+import sqlite3
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import backup
+import db
+
+
+def query_plan(conn, sql, params=()):
+    return ' | '.join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_migrate_records_version(self):
+        """Все миграции применяются и записываются в schema_migrations"""
+        version = db.migrate(self.conn)
+
+        self.assertEqual(version, db.MIGRATIONS[-1][0])
+        applied = [row[0] for row in self.conn.execute("SELECT version FROM schema_migrations ORDER BY version")]
+        self.assertEqual(applied, [number for number, _, _ in db.MIGRATIONS])
+
+    def test_migrate_is_idempotent(self):
+        """Повторный запуск ничего не меняет"""
+        db.migrate(self.conn)
+        db.migrate(self.conn)
+
+        count = self.conn.execute("SELECT COUNT(*) FROM schema_migrations").fetchone()[0]
+        self.assertEqual(count, len(db.MIGRATIONS))
+
+    def test_legacy_users_table_gets_email(self):
+        """Старая таблица users без email получает колонку с уникальным индексом"""
+        self.conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY AUTOINCREMENT, login TEXT UNIQUE, password TEXT)")
+        self.conn.execute("INSERT INTO users (login, password) VALUES ('old_user', 'x')")
+        self.conn.commit()
+
+        db.migrate(self.conn)
+
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(users)")]
+        self.assertIn('email', columns)
+        self.conn.execute("UPDATE users SET email = 'a@b.c'")
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.conn.execute("INSERT INTO users (login, email) VALUES ('new_user', 'a@b.c')")
+
+    def test_embeddings_of_different_models_coexist(self):
+        """Векторы сохраняются после миграции ключа, и модели не затирают друг друга"""
+        with mock.patch.object(db, 'MIGRATIONS', db.MIGRATIONS[:11]):
+            db.migrate(self.conn)
+        self.conn.execute("INSERT INTO movies (id, title) VALUES (1, 'Alien')")
+        self.conn.execute("INSERT INTO movie_embeddings (movie_id, model, embedding) VALUES (1, 'torch', x'00')")
+        self.conn.commit()
+
+        db.migrate(self.conn)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO movie_embeddings (movie_id, model, embedding) VALUES (1, 'onnx-int8', x'01')")
+
+        rows = self.conn.execute("SELECT model, embedding FROM movie_embeddings ORDER BY model").fetchall()
+        self.assertEqual(rows, [('onnx-int8', b'\x01'), ('torch', b'\x00')])
+        plan = query_plan(self.conn, """
+            SELECT movie_id, embedding FROM movie_embeddings WHERE model = ? ORDER BY movie_id
+        """, ('torch',))
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class TestUserScopedIndexes(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        db.migrate(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_similar_movies_by_user_uses_index(self):
+        plan = query_plan(self.conn, "SELECT * FROM similar_movies WHERE user_id = ?", (1,))
+        self.assertIn("USING INDEX idx_similar_movies_user_id", plan)
+        self.assertNotIn("SCAN similar_movies", plan)
+
+    def test_recommendation_history_uses_index(self):
+        plan = query_plan(self.conn, """
+            SELECT overview FROM similar_movies
+            WHERE user_id = ? AND overview IS NOT NULL AND overview != ''
+        """, (1,))
+        self.assertIn("USING INDEX idx_similar_movies_user_id", plan)
+
+    def test_keyset_order_needs_no_sort(self):
+        plan = query_plan(self.conn,
+                          "SELECT id FROM similar_movies WHERE user_id = ? AND id > ? ORDER BY id LIMIT 50",
+                          (1, 0))
+        self.assertIn("USING COVERING INDEX idx_similar_movies_user_id", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_similar_movies_view_page_uses_index(self):
+        plan = query_plan(self.conn, """
+            SELECT id, title, score FROM user_similar_movies
+            WHERE user_id = ? AND id > ? ORDER BY id LIMIT 50
+        """, (1, 0))
+        self.assertIn("USING INDEX idx_similar_movies_user_id", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+class TestBackup(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.database = self.dir / "movies.db"
+        conn = sqlite3.connect(self.database)
+        db.migrate(conn)
+        conn.executemany("INSERT INTO movies (title, overview) VALUES (?, ?)",
+                         [(f"Movie {i}", "x" * 500) for i in range(2000)])
+        conn.commit()
+        conn.close()
+
+    def test_snapshot_and_restore(self):
+        """Снимок по шагам восстанавливается в новую базу с теми же данными"""
+        steps = []
+        result = backup.snapshot(self.database, self.dir / "snap.db", pages=16, sleep=0,
+                                 progress=lambda remaining, total: steps.append(remaining))
+        self.assertGreater(len(steps), 1)
+        self.assertEqual(result['schema_version'], db.LATEST_SCHEMA_VERSION)
+        self.assertFalse((self.dir / "snap.db.part").exists())
+
+        restored = backup.restore(self.dir / "snap.db", self.dir / "node" / "movies.db", pages=64)
+        conn = sqlite3.connect(restored['path'])
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM movies").fetchone()[0], 2000)
+        conn.close()
+        with self.assertRaises(backup.SnapshotError):
+            backup.restore(self.dir / "snap.db", restored['path'])
+
+    def test_concurrent_writes_restart_copy_in_steps(self):
+        """Запись другим соединением перезапускает пошаговое копирование; снимок содержит все записи"""
+        writer = sqlite3.connect(self.database)
+        self.addCleanup(writer.close)
+        writes = []
+
+        def write(remaining, total):
+            # Пишем на первых шагах, потом база затихает и копирование доходит до конца
+            if len(writes) < 2:
+                writer.execute("INSERT INTO users (password) VALUES ('x')")
+                writer.commit()
+                writes.append(remaining)
+
+        result = backup.snapshot(self.database, self.dir / "snap.db", pages=16, sleep=0, progress=write)
+        self.assertEqual(result['restarts'], 2)
+        conn = sqlite3.connect(self.dir / "snap.db")
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0], 2)
+        conn.close()
+
+    def test_busy_database_aborts_instead_of_locking(self):
+        """Если база меняется на каждом шаге, попытки прерываются, а не копируют все одним шагом"""
+        writer = sqlite3.connect(self.database)
+        self.addCleanup(writer.close)
+
+        def write(remaining, total):
+            writer.execute("INSERT INTO users (password) VALUES ('x')")
+            writer.commit()
+
+        with self.assertRaises(backup.SnapshotBusy):
+            backup.snapshot(self.database, self.dir / "snap.db", pages=16, sleep=0, max_restarts=1,
+                            progress=write, attempts=2, retry_delay=0)
+        self.assertFalse((self.dir / "snap.db").exists())
+        self.assertFalse((self.dir / "snap.db.part").exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
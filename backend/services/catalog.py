@@ -0,0 +1,253 @@
+"""
+Каталог фильмов в памяти процесса в виде набора колонок (struct of arrays).
+
+Рекомендации читают из каталога только несколько полей, а сортируют тысячи
+кандидатов, поэтому каталог загружается один раз на версию (catalog_version)
+и хранится колонками:
+- id, score и признаки ранжирования - массивы NumPy, строка каталога = индекс
+  (признаки, которых еще нет в movie_features, считаются при загрузке);
+- title, overview, genre - UTF-8 в одном буфере на колонку со смещениями,
+  строка декодируется только для попавших в ответ фильмов;
+- для каждого жанра - отсортированный массив строк с непустым описанием;
+- матрица эмбеддингов описаний для модели энкодера: сохраненные читаются при
+  загрузке, недостающие дополняются при первом обращении.
+
+Фильтрация, скоринг и сборка ответа идут по индексам строк без SQLite и без
+Python-объектов на каждого кандидата. CatalogIndex перестраивает снимок в
+фоне (versioned.VersionedIndex): пока новый не готов, запросы читают старый.
+"""
+import logging
+import threading
+
+import numpy as np
+
+from features import FEATURE_NAMES, movie_features
+from gazetteer import catalog_version
+from versioned import VersionedIndex
+
+logger = logging.getLogger(__name__)
+
+TEXT_COLUMNS = ('title', 'overview', 'genre')
+# Поля movies, из которых считаются признаки (кроме score)
+FEATURE_SOURCE_COLUMNS = ('date_x', 'budget_x', 'revenue')
+
+
+class _TextColumn:
+    """Строки одной колонки: общий UTF-8 буфер и смещения (n + 1)."""
+
+    def __init__(self, values):
+        encoded = [value.encode('utf-8') if value else b'' for value in values]
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=self.offsets[1:])
+        self.buffer = b''.join(encoded)
+
+    def __getitem__(self, row):
+        return self.buffer[self.offsets[row]:self.offsets[row + 1]].decode('utf-8')
+
+    @property
+    def nbytes(self):
+        return len(self.buffer) + self.offsets.nbytes
+
+
+def genre_names(genre):
+    # В CSV жанры разделены ",\\xa0", strip() убирает и неразрывный пробел
+    return {name.strip() for name in genre.split(',') if name.strip()} if genre else set()
+
+
+class Catalog:
+    """Снимок movies для одной версии каталога; меняется только дополнение векторов."""
+
+    def __init__(self, ids, scores, features, texts, genre_rows, version=None,
+                 model=None, embeddings=None, has_embedding=None):
+        self.ids = ids
+        self.scores = scores
+        self.features = features
+        self.texts = texts
+        self.genre_rows = genre_rows
+        self.version = version
+        # Векторы модели model (строка матрицы = строка каталога); без модели - None
+        self.model = model
+        self.embeddings = embeddings
+        self.has_embedding = has_embedding
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, conn, version=None, id_range=(None, None), model=None):
+        """
+        Снимок movies; id_range - (min_id, max_id) для части каталога (шарда), None - без границы.
+
+        С model в снимок читаются сохраненные в movie_embeddings векторы этой модели.
+        """
+        min_id, max_id = id_range
+        rows = conn.execute(f"""
+            SELECT m.id, m.score, {', '.join(f'f.{name}' for name in FEATURE_NAMES)},
+                   {', '.join(f'm.{name}' for name in FEATURE_SOURCE_COLUMNS + TEXT_COLUMNS)}
+            FROM movies m
+            LEFT JOIN movie_features f ON f.movie_id = m.id
+            WHERE (?1 IS NULL OR m.id >= ?1) AND (?2 IS NULL OR m.id < ?2)
+            ORDER BY m.id
+        """, (min_id, max_id)).fetchall()
+        sources_start = 2 + len(FEATURE_NAMES)
+        texts_start = sources_start + len(FEATURE_SOURCE_COLUMNS)
+        columns = list(zip(*rows)) if rows else [()] * (texts_start + len(TEXT_COLUMNS))
+        ids = np.array(columns[0], dtype=np.int64)
+        # NULL -> NaN: для score это "нет оценки"
+        scores = np.array(columns[1], dtype=np.float64)
+        features = np.array(list(zip(*columns[2:sources_start])), dtype=np.float32) \
+            .reshape(len(ids), len(FEATURE_NAMES))
+        # Фильмы без строки в movie_features (например, из CSV без backfill) получают
+        # признаки здесь, в памяти: запрос рекомендаций не пишет в базу
+        for row in np.flatnonzero(np.isnan(features).any(axis=1)):
+            features[row] = movie_features(rows[row][1], *rows[row][sources_start:texts_start])
+        text_values = dict(zip(TEXT_COLUMNS, columns[texts_start:]))
+
+        # Рекомендуются только фильмы с описанием
+        genre_rows = {}
+        for row, (genre, overview) in enumerate(zip(text_values['genre'], text_values['overview'])):
+            if overview:
+                for name in genre_names(genre):
+                    genre_rows.setdefault(name, []).append(row)
+        genre_rows = {name: np.array(rows, dtype=np.int64) for name, rows in genre_rows.items()}
+
+        texts = {name: _TextColumn(values) for name, values in text_values.items()}
+        embeddings = has_embedding = None
+        if model is not None:
+            embeddings, has_embedding = _load_embeddings(conn, ids, model, id_range)
+        return cls(ids, scores, features, texts, genre_rows, version, model, embeddings, has_embedding)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return (self.ids.nbytes + self.scores.nbytes + self.features.nbytes
+                + sum(column.nbytes for column in self.texts.values())
+                + sum(rows.nbytes for rows in self.genre_rows.values())
+                + (self.embeddings.nbytes + self.has_embedding.nbytes if self.embeddings is not None else 0))
+
+    def rows_for_ids(self, movie_ids):
+        """Строки каталога для id фильмов (отсутствующие id пропускаются), по возрастанию."""
+        movie_ids = np.fromiter(movie_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, movie_ids)
+        rows = rows[rows < len(self.ids)]
+        return np.unique(rows[np.isin(self.ids[rows], movie_ids)])
+
+    def rows_of(self, movie_ids):
+        """Строки для movie_ids в том же порядке; для id, которых нет в каталоге, -1."""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        rows = np.searchsorted(self.ids, movie_ids)
+        found = rows < len(self.ids)
+        found[found] = self.ids[rows[found]] == movie_ids[found]
+        return np.where(found, rows, -1)
+
+    def genre_candidates(self, genre, rows=None):
+        """
+        Строки фильмов с описанием, в жанрах которых есть genre (как LIKE '%genre%').
+
+        rows ограничивает выборку этими строками (например, фильмами актеров).
+        """
+        query = genre.lower()
+        matching = [self.genre_rows[name] for name in self.genre_rows if query in name.lower()]
+        candidates = np.unique(np.concatenate(matching)) if matching else np.zeros(0, dtype=np.int64)
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        return candidates
+
+    def features_for(self, rows):
+        """Признаки строк (n, len(FEATURE_NAMES))."""
+        return self.features[rows]
+
+    def embeddings_for(self, rows, compute_missing):
+        """
+        Векторы строк (n, dim) из снимка.
+
+        Отсутствующие в нем берутся через compute_missing(id фильмов) и
+        запоминаются в снимке: каждый фильм читается из базы (или кодируется)
+        один раз на снимок, а не на каждом запросе.
+        """
+        if self.embeddings is None:
+            vectors = np.asarray(compute_missing(self.ids[rows].tolist()), dtype=np.float32)
+            self._add_embeddings(rows, vectors)
+            return vectors
+        embeddings = self.embeddings[rows]
+        missing = ~self.has_embedding[rows]
+        if missing.any():
+            vectors = np.asarray(compute_missing(self.ids[rows[missing]].tolist()), dtype=np.float32)
+            embeddings[missing] = vectors
+            self._add_embeddings(rows[missing], vectors)
+        return embeddings
+
+    def _add_embeddings(self, rows, vectors):
+        if not len(rows):
+            return
+        with self._lock:
+            if self.embeddings is None:
+                # Маска раньше матрицы: читатель, увидевший матрицу, видит и маску
+                self.has_embedding = np.zeros(len(self.ids), dtype=bool)
+                self.embeddings = np.zeros((len(self.ids), vectors.shape[1]), dtype=np.float32)
+            self.embeddings[rows] = vectors
+            self.has_embedding[rows] = True
+
+    def text(self, column, row):
+        return self.texts[column][row]
+
+    def score(self, row):
+        value = self.scores[row]
+        return None if np.isnan(value) else float(value)
+
+
+class CatalogIndex(VersionedIndex):
+    """
+    Catalog для текущей версии каталога.
+
+    С embedding_store в снимок входят векторы модели его энкодера. С connect
+    (фабрика соединений) после изменения каталога снимок перестраивается в
+    фоне, а до готовности отдается предыдущий.
+    """
+
+    def __init__(self, embedding_store=None, connect=None):
+        super().__init__(connect)
+        self.embedding_store = embedding_store
+
+    def _model(self):
+        if self.embedding_store is None:
+            return None
+        try:
+            return self.embedding_store.encoder.name
+        except Exception as e:
+            # Имя модели отдает воркер инференса; пока он недоступен, снимок строится без векторов
+            logger.warning("Catalog snapshot without embeddings: %s", e)
+            return None
+
+    def version(self, conn):
+        return catalog_version(conn)
+
+    def is_fresh(self, catalog, version):
+        # Снимок без векторов перестраивается, как только имя модели становится известно
+        return catalog.version == version and (
+            catalog.model is not None or self.embedding_store is None or self._model() is None)
+
+    def build(self, conn, version):
+        return Catalog.load(conn, version, model=self._model())
+
+
+def _load_embeddings(conn, ids, model, id_range):
+    """Матрица векторов (len(ids), dim) и маска строк, для которых вектор сохранен."""
+    min_id, max_id = id_range
+    rows = conn.execute("""
+        SELECT movie_id, embedding FROM movie_embeddings
+        WHERE model = ?1 AND (?2 IS NULL OR movie_id >= ?2) AND (?3 IS NULL OR movie_id < ?3)
+        ORDER BY movie_id
+    """, (model, min_id, max_id)).fetchall()
+    has_embedding = np.zeros(len(ids), dtype=bool)
+    if not rows:
+        return None, has_embedding
+    movie_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    positions = np.searchsorted(ids, movie_ids)
+    known = positions < len(ids)
+    known[known] = ids[positions[known]] == movie_ids[known]
+    vectors = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+    embeddings = np.zeros((len(ids), vectors.shape[1]), dtype=np.float32)
+    embeddings[positions[known]] = vectors[known]
+    has_embedding[positions[known]] = True
+    return embeddings, has_embedding
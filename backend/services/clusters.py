@@ -0,0 +1,387 @@
+"""
+Кластеры вкусов пользователей и общие пулы кандидатов.
+
+Вектор вкуса пользователя - нормированное среднее эмбеддингов его
+similar_movies. Векторы кластеризуются сферическим mini-batch k-means
+(Sculley, 2010) на NumPy, и для каждого центроида заранее отбирается пул
+из pool_size ближайших фильмов каталога. Пулы ничего не знают об описании
+запроса, поэтому рядом хранится второй индекс - инвертированные списки
+(IVF): фильмы каталога, разбитые тем же k-means на n_lists списков по
+ближайшему центроиду.
+
+В /api/ml/recommendations (если включено TASTE_CLUSTER_PROBES) кандидаты
+жанра ограничиваются пулами n_probe ближайших к вкусу пользователя
+центроидов, списками n_query_probe ближайших к описанию центроидов и
+фильмами новее кластеризации. Все это - id из индекса, так что векторы
+читаются и полный скоринг по описанию и всей истории идет по сотням
+фильмов вместо всего жанра.
+
+ClusterIndex.update учитывает изменения инкрементально: профили, версия
+которых (user_profile_version) изменилась, сдвигают центроиды через
+partial_fit, и пересчитываются пулы только затронутых кластеров (все и
+списки - если изменился каталог). Кластеры, пулы и списки хранятся в
+taste_clusters.
+
+Построить и оценить полноту относительно полного поиска на запросах из
+описания и вкуса пользователя (описания - из файла, по одному в строке, или
+описания случайных фильмов жанра):
+    python clusters.py --database backend/database/movies.db --encoder onnx --evaluate 200 --queries queries.txt
+"""
+import argparse
+import io
+import threading
+
+import numpy as np
+
+from encoders import l2_normalize
+from recommender import fetch_user_history, score_candidates, target_weights
+from topk import top_k
+
+N_CLUSTERS = 32
+POOL_SIZE = 300
+N_PROBE = 2
+# Инвертированные списки фильмов для поиска по описанию: сколько списков и сколько
+# ближайших к описанию просматривается
+N_LISTS = 64
+N_QUERY_PROBE = 4
+BATCH_SIZE = 256
+ITERATIONS = 100
+
+
+def taste_vector(embeddings):
+    """Нормированное среднее нормированных эмбеддингов понравившихся фильмов."""
+    return l2_normalize(l2_normalize(np.asarray(embeddings, dtype=np.float32)).mean(axis=0, keepdims=True))[0]
+
+
+def user_history_embeddings(conn, embedding_store, user_id):
+    """Эмбеддинги похожих фильмов пользователя или None, если их нет."""
+    movie_ids, overviews = fetch_user_history(conn.cursor(), user_id)
+    embeddings = []
+    if movie_ids:
+        embeddings.append(embedding_store.get(conn, movie_ids))
+    if overviews:
+        embeddings.append(embedding_store.encoder.encode(overviews))
+    return np.vstack(embeddings) if embeddings else None
+
+
+def user_taste(conn, embedding_store, user_id):
+    """Вектор вкуса пользователя или None, если похожих фильмов нет."""
+    embeddings = user_history_embeddings(conn, embedding_store, user_id)
+    return taste_vector(embeddings) if embeddings is not None else None
+
+
+class MiniBatchKMeans:
+    """Сферический mini-batch k-means: векторы и центроиды нормированы, близость - скалярное произведение."""
+
+    def __init__(self, centers, counts):
+        self.centers = centers
+        self.counts = counts
+
+    @classmethod
+    def fit(cls, vectors, n_clusters=N_CLUSTERS, batch_size=BATCH_SIZE, iterations=ITERATIONS, seed=0):
+        rng = np.random.default_rng(seed)
+        vectors = l2_normalize(np.asarray(vectors, dtype=np.float32))
+        # k-means++: следующий центр выбирается с вероятностью, пропорциональной удаленности
+        # (расстояние до ближайшего центра обновляется по одному новому центру - O(k·n), а не O(k²·n))
+        centers = [vectors[rng.integers(len(vectors))]]
+        distance = np.clip(1 - vectors @ centers[0], 0, None)
+        for _ in range(1, min(n_clusters, len(vectors))):
+            total = distance.sum()
+            centers.append(vectors[rng.choice(len(vectors), p=distance / total if total > 0 else None)])
+            distance = np.minimum(distance, np.clip(1 - vectors @ centers[-1], 0, None))
+        model = cls(np.array(centers, dtype=np.float32), np.zeros(len(centers), dtype=np.int64))
+        for _ in range(iterations):
+            model.partial_fit(vectors[rng.choice(len(vectors), min(batch_size, len(vectors)), replace=False)])
+        return model
+
+    def predict(self, vectors, n=1):
+        """Индексы n ближайших центроидов для каждого вектора, (len(vectors), n)."""
+        similarities = l2_normalize(np.asarray(vectors, dtype=np.float32)) @ self.centers.T
+        return np.argsort(-similarities, axis=1, kind='stable')[:, :n]
+
+    def partial_fit(self, vectors):
+        """Сдвигает ближайшие центроиды к vectors с шагом 1/число назначений; возвращает назначения."""
+        vectors = l2_normalize(np.asarray(vectors, dtype=np.float32))
+        assigned = self.predict(vectors)[:, 0]
+        for vector, cluster in zip(vectors, assigned):
+            self.counts[cluster] += 1
+            rate = 1.0 / self.counts[cluster]
+            self.centers[cluster] = (1 - rate) * self.centers[cluster] + rate * vector
+        self.centers = l2_normalize(self.centers)
+        return assigned
+
+
+class MovieLists:
+    """Инвертированные списки: id фильмов каталога, сгруппированные по ближайшему центроиду."""
+
+    def __init__(self, kmeans, ids, offsets):
+        self.kmeans = kmeans
+        # Фильмы списка i - ids[offsets[i]:offsets[i + 1]]
+        self.ids = ids
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, movie_ids, movie_embeddings, n_lists=N_LISTS):
+        vectors = l2_normalize(np.asarray(movie_embeddings, dtype=np.float32))
+        kmeans = MiniBatchKMeans.fit(vectors, n_lists)
+        assigned = np.argmax(vectors @ kmeans.centers.T, axis=1)
+        order = np.argsort(assigned, kind='stable')
+        offsets = np.searchsorted(assigned[order], np.arange(len(kmeans.centers) + 1))
+        return cls(kmeans, np.asarray(movie_ids, dtype=np.int64)[order], offsets)
+
+    def candidate_ids(self, query, n_probe=N_QUERY_PROBE):
+        """id фильмов из n_probe списков, ближайших к вектору query."""
+        lists = self.kmeans.predict(query[np.newaxis], n_probe)[0]
+        return np.concatenate([self.ids[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+
+class TasteClusters:
+    """Центроиды вкусов, пулы id фильмов по центроидам (-1 - пустое место) и списки фильмов."""
+
+    def __init__(self, kmeans, pools, max_movie_id, model, catalog_version=None, revision=None,
+                 movie_lists=None):
+        self.kmeans = kmeans
+        self.pools = pools
+        self.max_movie_id = max_movie_id
+        self.model = model
+        self.catalog_version = catalog_version
+        self.revision = revision
+        self.movie_lists = movie_lists
+
+    def build_pools(self, movie_ids, movie_embeddings, clusters=None, pool_size=POOL_SIZE):
+        """Пересчитывает пулы кластеров clusters (None - всех) по фильмам каталога."""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        clusters = np.arange(len(self.kmeans.centers)) if clusters is None else np.asarray(sorted(clusters))
+        if self.pools is None or self.pools.shape[1] != pool_size:
+            self.pools = np.full((len(self.kmeans.centers), pool_size), -1, dtype=np.int64)
+            clusters = np.arange(len(self.kmeans.centers))
+        similarities = l2_normalize(np.asarray(movie_embeddings, dtype=np.float32)) @ self.kmeans.centers[clusters].T
+        for column, cluster in enumerate(clusters):
+            best = movie_ids[top_k(similarities[:, column], pool_size)]
+            self.pools[cluster] = -1
+            self.pools[cluster, :len(best)] = best
+        self.max_movie_id = int(movie_ids.max()) if len(movie_ids) else 0
+
+    def candidate_ids(self, taste, n_probe=N_PROBE):
+        ids = self.pools[self.kmeans.predict(taste[np.newaxis], n_probe)[0]].ravel()
+        return np.unique(ids[ids >= 0])
+
+    def restrict(self, catalog, rows, taste, n_probe=N_PROBE, min_size=1, query=None, n_query_probe=N_QUERY_PROBE):
+        """
+        Строки rows из пулов n_probe ближайших к taste кластеров, списков n_query_probe
+        ближайших к query (вектор описания запроса) центроидов и фильмы новее кластеризации.
+
+        Векторы rows не нужны. Если таких строк меньше min_size, возвращаются все rows.
+        """
+        candidate_ids = self.candidate_ids(taste, n_probe)
+        if query is not None and n_query_probe and self.movie_lists is not None:
+            candidate_ids = np.union1d(candidate_ids, self.movie_lists.candidate_ids(query, n_query_probe))
+        pool_rows = catalog.rows_of(candidate_ids)
+        fresh = rows[catalog.ids[rows] > self.max_movie_id]
+        restricted = np.union1d(np.intersect1d(rows, pool_rows[pool_rows >= 0]), fresh)
+        return restricted if len(restricted) >= min_size else rows
+
+    def dumps(self):
+        buffer = io.BytesIO()
+        lists = {}
+        if self.movie_lists is not None:
+            lists = {'list_centers': self.movie_lists.kmeans.centers, 'list_counts': self.movie_lists.kmeans.counts,
+                     'list_ids': self.movie_lists.ids, 'list_offsets': self.movie_lists.offsets}
+        np.savez(buffer, centers=self.kmeans.centers, counts=self.kmeans.counts, pools=self.pools,
+                 max_movie_id=np.int64(self.max_movie_id), **lists)
+        return buffer.getvalue()
+
+    @classmethod
+    def loads(cls, data, model, catalog_version=None, revision=None):
+        arrays = np.load(io.BytesIO(data))
+        movie_lists = None
+        if 'list_centers' in arrays:
+            movie_lists = MovieLists(MiniBatchKMeans(arrays['list_centers'], arrays['list_counts']),
+                                     arrays['list_ids'], arrays['list_offsets'])
+        return cls(MiniBatchKMeans(arrays['centers'], arrays['counts']), arrays['pools'],
+                   int(arrays['max_movie_id']), model, catalog_version, revision, movie_lists)
+
+
+class ClusterIndex:
+    """TasteClusters из taste_clusters; перечитываются, когда меняется revision."""
+
+    def __init__(self, n_clusters=N_CLUSTERS, pool_size=POOL_SIZE, n_lists=N_LISTS):
+        self.n_clusters = n_clusters
+        self.pool_size = pool_size
+        self.n_lists = n_lists
+        self._clusters = None
+        self._lock = threading.Lock()
+
+    def get(self, conn):
+        """Текущие кластеры или None, если они еще не построены."""
+        row = conn.execute("SELECT revision FROM taste_clusters").fetchone()
+        if row is None:
+            return None
+        clusters = self._clusters
+        if clusters is not None and clusters.revision == row[0]:
+            return clusters
+        with self._lock:
+            row = conn.execute(
+                "SELECT model, catalog_version, revision, data FROM taste_clusters"
+            ).fetchone()
+            if self._clusters is None or self._clusters.revision != row[2]:
+                self._clusters = TasteClusters.loads(row[3], row[0], row[1], row[2])
+            return self._clusters
+
+    def update(self, conn, embedding_store, catalog_index):
+        """
+        Учитывает изменившиеся профили и каталог; без кластеров (или при смене модели) обучает заново.
+
+        Возвращает число учтенных профилей.
+        """
+        # Пулы строятся по снимку каталога и помечаются его версией (он может отставать от базы)
+        catalog = catalog_index.get(conn)
+        version = catalog.version
+        model = embedding_store.encoder.name
+        clusters = self.get(conn)
+        rebuild = clusters is None or clusters.model != model
+        # Версии профилей читаются до расчета векторов, чтобы не пропустить изменения
+        changed = conn.execute(f"""
+            SELECT p.user_id, p.version FROM user_profile_version p
+            LEFT JOIN user_taste_clusters u ON u.user_id = p.user_id
+            {'' if rebuild else 'WHERE u.user_id IS NULL OR u.profile_version != p.version'}
+        """).fetchall()
+        # Пулы и списки пересчитываются целиком при смене каталога или размера пулов
+        rebuild_pools = rebuild or clusters.catalog_version != version \
+            or clusters.pools.shape[1] != self.pool_size or clusters.movie_lists is None
+        if not changed and not rebuild_pools:
+            return 0
+
+        tastes = {}
+        for user_id, _ in changed:
+            taste = user_taste(conn, embedding_store, user_id)
+            if taste is not None:
+                tastes[user_id] = taste
+        if rebuild:
+            if not tastes:
+                return 0
+            clusters = TasteClusters(MiniBatchKMeans.fit(list(tastes.values()), self.n_clusters),
+                                     None, 0, model)
+            touched = None
+        else:
+            clusters = TasteClusters(
+                MiniBatchKMeans(clusters.kmeans.centers.copy(), clusters.kmeans.counts.copy()),
+                clusters.pools.copy(), clusters.max_movie_id, model, movie_lists=clusters.movie_lists)
+            touched = set()
+            if tastes:
+                touched.update(clusters.kmeans.partial_fit(list(tastes.values())).tolist())
+            if rebuild_pools:
+                touched = None
+        assigned = dict(zip(tastes, clusters.kmeans.predict(list(tastes.values()))[:, 0].tolist())) \
+            if tastes else {}
+
+        if touched is None or touched:
+            rows = np.unique(np.concatenate(list(catalog.genre_rows.values()))) \
+                if catalog.genre_rows else np.zeros(0, dtype=np.int64)
+            movie_ids = catalog.ids[rows].tolist()
+            if movie_ids:
+                embeddings = catalog.embeddings_for(rows, lambda ids: embedding_store.get(conn, ids))
+                clusters.build_pools(movie_ids, embeddings, touched, self.pool_size)
+                if touched is None:
+                    clusters.movie_lists = MovieLists.build(movie_ids, embeddings, self.n_lists)
+            elif clusters.pools is None:
+                clusters.pools = np.full((len(clusters.kmeans.centers), self.pool_size), -1, dtype=np.int64)
+
+        conn.execute(
+            """INSERT OR REPLACE INTO taste_clusters (id, model, catalog_version, revision, data)
+            VALUES (1, ?, ?, lower(hex(randomblob(8))), ?)""",
+            (model, version, clusters.dumps())
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO user_taste_clusters (user_id, profile_version, cluster) VALUES (?, ?, ?)",
+            [(user_id, profile, assigned.get(user_id, -1)) for user_id, profile in changed]
+        )
+        conn.commit()
+        return len(changed)
+
+
+def evaluate(conn, clusters, catalog, embedding_store, user_ids, genre, descriptions, k=20,
+             n_probe=N_PROBE, n_query_probe=N_QUERY_PROBE):
+    """
+    Полнота top-k по пулам и спискам относительно полного поиска по жанру.
+
+    Запрос - как в рекомендациях: описание (descriptions[i % len] для i-го
+    пользователя) и все похожие фильмы пользователя с весами target_weights.
+    Возвращает {'recall_at_k', 'candidate_fraction', 'users'}.
+    """
+    rows = catalog.genre_candidates(genre)
+    embeddings = catalog.embeddings_for(rows, lambda ids: embedding_store.get(conn, ids))
+    queries = np.asarray(embedding_store.encoder.encode(list(descriptions)), dtype=np.float32)
+    recalls, fractions = [], []
+    for user_id in user_ids:
+        history = user_history_embeddings(conn, embedding_store, user_id)
+        if history is None:
+            continue
+        targets = np.vstack([queries[len(recalls) % len(queries)][np.newaxis], history])
+        scores = score_candidates(targets, embeddings, target_weights(len(history)))
+        full = set(catalog.ids[rows[top_k(scores, k)]].tolist())
+        restricted = clusters.restrict(catalog, rows, taste_vector(history), n_probe,
+                                       query=targets[0], n_query_probe=n_query_probe)
+        positions = np.searchsorted(rows, restricted)
+        found = set(catalog.ids[restricted[top_k(scores[positions], k)]].tolist())
+        recalls.append(len(full & found) / max(len(full), 1))
+        fractions.append(len(restricted) / max(len(rows), 1))
+    return {
+        'recall_at_k': round(float(np.mean(recalls)), 4) if recalls else None,
+        'candidate_fraction': round(float(np.mean(fractions)), 4) if fractions else None,
+        'users': len(recalls),
+    }
+
+
+if __name__ == "__main__":
+    import json
+    import random
+    import sqlite3
+    import sys
+    from pathlib import Path
+
+    sys.path.append(str(Path(__file__).parent.parent / "database"))
+    from db import DB_PATH, migrate
+    from catalog import CatalogIndex
+    from embedding_store import EmbeddingStore
+    from encoders import create_encoder
+
+    parser = argparse.ArgumentParser(description="Кластеры вкусов пользователей и пулы кандидатов")
+    parser.add_argument('--database', default=DB_PATH)
+    parser.add_argument('--encoder', default='torch')
+    parser.add_argument('--onnx-model-dir')
+    parser.add_argument('--clusters', type=int, default=N_CLUSTERS)
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE)
+    parser.add_argument('--probes', type=int, default=N_PROBE)
+    parser.add_argument('--lists', type=int, default=N_LISTS, help="Списков фильмов для поиска по описанию")
+    parser.add_argument('--query-probes', type=int, default=N_QUERY_PROBE,
+                        help="Ближайших к описанию списков в дополнение к пулам")
+    parser.add_argument('--rebuild', action='store_true', help="Обучить заново вместо инкрементального обновления")
+    parser.add_argument('--evaluate', type=int, default=0, help="Оценить полноту на N пользователях")
+    parser.add_argument('--genre', default='Drama')
+    parser.add_argument('--queries', help="Файл с описаниями запросов, по одному в строке")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    migrate(conn)
+    if args.rebuild:
+        conn.execute("DELETE FROM taste_clusters")
+        conn.execute("DELETE FROM user_taste_clusters")
+    store = EmbeddingStore(create_encoder({'ENCODER_BACKEND': args.encoder, 'ONNX_MODEL_DIR': args.onnx_model_dir}))
+    catalog_index = CatalogIndex(store)
+    index = ClusterIndex(args.clusters, args.pool_size, args.lists)
+    print(f"{index.update(conn, store, catalog_index)} profiles updated")
+    if args.evaluate:
+        users = [row[0] for row in conn.execute(
+            "SELECT user_id FROM user_profile_version ORDER BY user_id LIMIT ?", (args.evaluate,))]
+        catalog = catalog_index.get(conn)
+        if args.queries:
+            descriptions = [line.strip() for line in Path(args.queries).read_text().splitlines() if line.strip()]
+        else:
+            rows = catalog.genre_candidates(args.genre)
+            sample = random.Random(0).sample(range(len(rows)), min(len(rows), args.evaluate))
+            descriptions = [catalog.text('overview', rows[i]) for i in sample]
+        report = evaluate(conn, index.get(conn), catalog, store, users, args.genre, descriptions,
+                          n_probe=args.probes, n_query_probe=args.query_probes)
+        print(json.dumps(report))
+    conn.close()
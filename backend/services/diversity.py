@@ -0,0 +1,53 @@
+"""
+Переранжирование top-k с учетом разнообразия (Maximal Marginal Relevance).
+
+Из пула лучших по скору кандидатов жадно выбираются k фильмов: на каждом
+шаге берется кандидат с максимальным
+    lambda * релевантность - (1 - lambda) * max сходство с уже выбранными.
+Сходства считаются один раз матрицей пула по уже посчитанным эмбеддингам
+кандидатов, сам жадный цикл - k векторных шагов по пулу.
+"""
+import numpy as np
+
+from topk import top_k
+
+DEFAULT_LAMBDA = 0.7
+DEFAULT_POOL_SIZE = 200
+
+
+def mmr(embeddings, scores, k, lambda_=DEFAULT_LAMBDA, pool_size=DEFAULT_POOL_SIZE):
+    """
+    Индексы k кандидатов в порядке MMR.
+
+    embeddings - (n, d) эмбеддинги кандидатов, scores - (n,) итоговые скоры.
+    Скоры внутри пула приводятся к [0, 1], чтобы lambda не зависела от
+    масштаба весов ранжирования. lambda_=1 дает обычный top-k.
+    """
+    pool = top_k(scores, max(k, pool_size))
+    if len(pool) <= 1 or k <= 1:
+        return pool[:k]
+
+    relevance = np.asarray(scores, dtype=np.float32)[pool]
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+
+    vectors = np.asarray(embeddings, dtype=np.float32)[pool]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms > 0, norms, 1)
+    similarity = vectors @ vectors.T
+
+    k = min(k, len(pool))
+    selected = np.empty(k, dtype=np.intp)
+    available = np.ones(len(pool), dtype=bool)
+    # Первый - самый релевантный; max_similarity - максимальное сходство с выбранными
+    selected[0] = 0
+    available[0] = False
+    max_similarity = similarity[0].copy()
+    for step in range(1, k):
+        marginal = lambda_ * relevance - (1 - lambda_) * max_similarity
+        marginal[~available] = -np.inf
+        best = int(np.argmax(marginal))
+        selected[step] = best
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return pool[selected]
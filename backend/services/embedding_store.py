@@ -0,0 +1,111 @@
+"""
+Предвычисленные эмбеддинги описаний фильмов каталога.
+
+Векторы хранятся в таблице movie_embeddings (float32 BLOB) вместе с именем
+модели, которой они посчитаны. Недостающие векторы считаются при первом
+запросе и сохраняются, так что каждое описание кодируется один раз.
+
+Заполнить всю таблицу заранее:
+    python embedding_store.py --encoder onnx --onnx-model-dir backend/models/minilm-onnx
+"""
+import argparse
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+# Ограничение на число параметров в одном IN (...)
+QUERY_CHUNK = 500
+
+
+def chunks(items, size=QUERY_CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class EmbeddingStore:
+    """Чтение и ленивое заполнение movie_embeddings для заданного энкодера."""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def load(self, conn, movie_ids):
+        """Уже посчитанные векторы {movie_id: вектор} для movie_ids."""
+        found = {}
+        for chunk in chunks(list(movie_ids)):
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT movie_id, embedding FROM movie_embeddings "
+                f"WHERE model = ? AND movie_id IN ({placeholders})",
+                [self.encoder.name, *chunk]
+            ).fetchall()
+            for movie_id, blob in rows:
+                found[movie_id] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def compute(self, conn, movie_ids):
+        """Кодирует описания movie_ids, сохраняет и возвращает {movie_id: вектор}."""
+        overviews = {}
+        for chunk in chunks(list(movie_ids)):
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT id, overview FROM movies WHERE id IN ({placeholders})", chunk
+            ).fetchall()
+            overviews.update((movie_id, overview or '') for movie_id, overview in rows)
+
+        ids = [movie_id for movie_id in movie_ids if movie_id in overviews]
+        if not ids:
+            return {}
+        vectors = np.asarray(self.encoder.encode([overviews[i] for i in ids]), dtype=np.float32)
+        conn.executemany(
+            "INSERT OR REPLACE INTO movie_embeddings (movie_id, model, embedding) VALUES (?, ?, ?)",
+            [(movie_id, self.encoder.name, vector.tobytes()) for movie_id, vector in zip(ids, vectors)]
+        )
+        conn.commit()
+        return dict(zip(ids, vectors))
+
+    def get(self, conn, movie_ids):
+        """Матрица векторов в порядке movie_ids, недостающие считаются и сохраняются."""
+        movie_ids = list(movie_ids)
+        vectors = self.load(conn, movie_ids)
+        missing = list(dict.fromkeys(i for i in movie_ids if i not in vectors))
+        if missing:
+            vectors.update(self.compute(conn, missing))
+        if not movie_ids:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack([vectors[movie_id] for movie_id in movie_ids])
+
+    def backfill(self, conn, batch_size=1024):
+        """Считает векторы для всех фильмов каталога, у которых их еще нет."""
+        total = 0
+        while True:
+            rows = conn.execute("""
+                SELECT m.id FROM movies m
+                LEFT JOIN movie_embeddings e ON e.movie_id = m.id AND e.model = ?
+                WHERE e.movie_id IS NULL
+                AND m.overview IS NOT NULL AND m.overview != ''
+                LIMIT ?
+            """, (self.encoder.name, batch_size)).fetchall()
+            if not rows:
+                return total
+            total += len(self.compute(conn, [row[0] for row in rows]))
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(str(Path(__file__).parent.parent / "database"))
+    from db import DB_PATH, migrate
+    from encoders import create_encoder
+
+    parser = argparse.ArgumentParser(description="Предвычисление эмбеддингов каталога")
+    parser.add_argument('--database', default=DB_PATH)
+    parser.add_argument('--encoder', default='torch')
+    parser.add_argument('--onnx-model-dir')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    migrate(conn)
+    encoder = create_encoder({'ENCODER_BACKEND': args.encoder, 'ONNX_MODEL_DIR': args.onnx_model_dir})
+    print(EmbeddingStore(encoder).backfill(conn, args.batch_size))
+    conn.close()
@@ -0,0 +1,263 @@
+"""
+Бэкенды кодирования текстов в эмбеддинги MiniLM.
+
+По умолчанию используется PyTorch SentenceTransformer. Для CPU-продакшена
+есть OnnxEncoder: экспортированная в ONNX (опционально int8) модель с тем же
+токенайзером и mean pooling, которая не тянет torch при импорте.
+
+Экспорт модели:
+    python encoders.py backend/models/minilm-onnx --quantize
+"""
+import argparse
+import re
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIM = 384
+MAX_SEQ_LENGTH = 256
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_QUANTIZED_FILE = 'model_int8.onnx'
+
+
+def mean_pooling(token_embeddings, attention_mask):
+    """Усреднение эмбеддингов токенов с учетом маски (как models.Pooling)."""
+    mask = attention_mask[..., np.newaxis].astype(token_embeddings.dtype)
+    summed = (token_embeddings * mask).sum(axis=1)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    return summed / counts
+
+
+def l2_normalize(embeddings):
+    """L2-нормализация по строкам (как models.Normalize)."""
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
+
+
+class SentenceTransformerEncoder:
+    """Кодирование через PyTorch SentenceTransformer."""
+
+    def __init__(self, model_name=MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        # Имя, под которым хранятся предвычисленные эмбеддинги: модель и бэкенд
+        self.name = f'{model_name}/torch'
+        self.model = SentenceTransformer(model_name, device='cpu')
+
+    def encode(self, texts, batch_size=32):
+        return self.model.encode(texts, batch_size=batch_size)
+
+
+class OnnxEncoder:
+    """
+    Кодирование экспортированной моделью через onnxruntime.
+
+    Повторяет пайплайн all-MiniLM-L6-v2: токенизация -> трансформер ->
+    mean pooling -> L2-нормализация, поэтому косинусные расстояния совпадают
+    с SentenceTransformerEncoder в пределах погрешности float32/int8.
+    """
+
+    def __init__(self, model_dir, quantized=False, max_length=MAX_SEQ_LENGTH, num_threads=None,
+                 name=MODEL_NAME):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        # Векторы ONNX и int8 лишь близки к исходной модели, поэтому в movie_embeddings
+        # они хранятся отдельно: имя включает бэкенд и точность
+        self.name = f"{name}/onnx-{'int8' if quantized else 'fp32'}"
+        model_dir = Path(model_dir)
+        model_file = ONNX_QUANTIZED_FILE if quantized else ONNX_MODEL_FILE
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id('[PAD]') or 0)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(model_dir / model_file), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self.input_names:
+            feeds['token_type_ids'] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        return mean_pooling(token_embeddings, attention_mask)
+
+    def encode(self, texts, batch_size=32):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, self.session.get_outputs()[0].shape[-1]), dtype=np.float32)
+
+        # Сортируем по длине, чтобы в батче было меньше паддинга
+        order = np.argsort([-len(t) for t in texts], kind='stable')
+        chunks = []
+        for start in range(0, len(texts), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            chunks.append(self._encode_batch(batch))
+        sorted_embeddings = l2_normalize(np.vstack(chunks)).astype(np.float32)
+
+        embeddings = np.empty_like(sorted_embeddings)
+        embeddings[order] = sorted_embeddings
+        return embeddings[0] if single else embeddings
+
+
+class HashingEncoder:
+    """
+    Детерминированная заглушка без модели: hashing trick по словам текста.
+
+    Нужна бенчмаркам и нагрузочным тестам, чтобы не скачивать MiniLM.
+    Тексты с общими словами получают близкие векторы, как и у настоящей модели.
+    """
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def _encode_text(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r'\w+', text.lower()):
+            h = zlib.crc32(token.encode('utf-8'))
+            vector[h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return vector
+
+    def encode(self, texts, batch_size=32):
+        if isinstance(texts, str):
+            return l2_normalize(self._encode_text(texts)[np.newaxis])[0]
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return l2_normalize(np.vstack([self._encode_text(t) for t in texts]))
+
+
+def create_encoder(config):
+    """Создает энкодер по настройкам приложения (ENCODER_BACKEND и др.)."""
+    backend = config.get('ENCODER_BACKEND', 'torch')
+    if backend == 'onnx':
+        return OnnxEncoder(
+            config['ONNX_MODEL_DIR'],
+            quantized=config.get('ONNX_QUANTIZED', False),
+            num_threads=config.get('ONNX_NUM_THREADS'),
+            name=config.get('ENCODER_MODEL', MODEL_NAME),
+        )
+    if backend == 'torch':
+        return SentenceTransformerEncoder(config.get('ENCODER_MODEL', MODEL_NAME))
+    if backend == 'hashing':
+        return HashingEncoder()
+    raise ValueError(f"Unknown encoder backend: {backend}")
+
+
+class LazyEncoder:
+    """
+    Энкодер, который создается при первом обращении.
+
+    Загрузка модели (torch/onnxruntime) занимает секунды, поэтому API создает
+    энкодер лениво: тесты, админ-скрипты и запросы без рекомендаций его не
+    ждут. Сервер может загрузить модель заранее через load().
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._encoder = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._encoder is not None
+
+    def load(self):
+        with self._lock:
+            if self._encoder is None:
+                self._encoder = self._factory()
+            return self._encoder
+
+    @property
+    def name(self):
+        return self.load().name
+
+    def encode(self, texts, batch_size=32, timeout=None):
+        # timeout - для совместимости с InferenceClient: кодирование в процессе не прерывается
+        return self.load().encode(texts, batch_size=batch_size)
+
+
+def _last_hidden_state_module(transformer):
+    """Оборачивает трансформер так, чтобы forward возвращал только last_hidden_state."""
+    import torch
+
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids=None):
+            return self.model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+            ).last_hidden_state
+
+    return LastHiddenState(transformer)
+
+
+def export_onnx(output_dir, model_name=MODEL_NAME, quantize=False, opset=17):
+    """
+    Экспортирует трансформер SentenceTransformer-модели в ONNX.
+
+    В output_dir сохраняются model.onnx, tokenizer.json и, при quantize=True,
+    model_int8.onnx с динамической int8-квантизацией весов.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, device='cpu')
+    st_model.tokenizer.save_pretrained(str(output_dir))
+    wrapper = _last_hidden_state_module(st_model[0].auto_model).eval()
+
+    sample = st_model.tokenizer(['a movie about space'], return_tensors='pt')
+    input_names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    model_path = output_dir / ONNX_MODEL_FILE
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            tuple(sample[name] for name in input_names),
+            str(model_path),
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            dynamo=False,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(model_path), str(output_dir / ONNX_QUANTIZED_FILE),
+                         weight_type=QuantType.QInt8)
+    return model_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт MiniLM в ONNX")
+    parser.add_argument('output_dir')
+    parser.add_argument('--model', default=MODEL_NAME)
+    parser.add_argument('--quantize', action='store_true')
+    args = parser.parse_args()
+
+    print(export_onnx(args.output_dir, args.model, quantize=args.quantize))
@@ -0,0 +1,137 @@
+"""
+Числовые признаки фильмов каталога для ранжирования.
+
+Признаки нормированы в [0, 1] и хранятся в таблице movie_features; для
+кандидатов они читаются одной матрицей (n, len(FEATURE_NAMES)) в том же
+порядке, что и матрица эмбеддингов, так что итоговый скор считается
+одним матричным умножением (см. recommender.blend_scores). Снимок каталога
+(catalog.Catalog) досчитывает недостающие признаки в памяти, а таблицу
+заполняют загрузка из OMDb и backfill.
+
+Заполнить всю таблицу заранее:
+    python features.py --database backend/database/movies.db
+"""
+import argparse
+import math
+import sqlite3
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+
+from embedding_store import chunks
+
+FEATURE_NAMES = ('rating', 'recency', 'popularity')
+
+# Значение признака, если исходного поля нет
+MISSING = 0.5
+OLDEST_YEAR = 1900
+# Кассовые сборы, которые считаются максимальной популярностью (log-шкала)
+MAX_REVENUE = 3e9
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y')
+
+
+def parse_year(date_x):
+    """Год из date_x: в каталоге встречаются 2024-01-31 (OMDb) и 01/31/2024 (CSV)."""
+    if not date_x:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_x.strip(), fmt).year
+        except ValueError:
+            continue
+    return None
+
+
+def movie_features(score, date_x, budget_x, revenue, current_year=None):
+    """Признаки одного фильма в порядке FEATURE_NAMES."""
+    current_year = current_year or date.today().year
+    rating = min(max(score / 100, 0.0), 1.0) if score is not None else MISSING
+
+    year = parse_year(date_x)
+    if year is None:
+        recency = MISSING
+    else:
+        recency = min(max((year - OLDEST_YEAR) / (current_year - OLDEST_YEAR), 0.0), 1.0)
+
+    # Сборы, а если их нет - бюджет, как грубая оценка популярности
+    money = revenue or budget_x
+    popularity = min(math.log1p(money) / math.log1p(MAX_REVENUE), 1.0) if money else MISSING
+    return rating, recency, popularity
+
+
+class FeatureStore:
+    """Чтение и ленивое заполнение movie_features."""
+
+    def load(self, conn, movie_ids):
+        found = {}
+        columns = ', '.join(FEATURE_NAMES)
+        for chunk in chunks(list(movie_ids)):
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT movie_id, {columns} FROM movie_features WHERE movie_id IN ({placeholders})", chunk
+            ).fetchall()
+            for row in rows:
+                found[row[0]] = tuple(row[1:])
+        return found
+
+    def compute(self, conn, movie_ids):
+        """Считает признаки movie_ids из movies, сохраняет и возвращает {movie_id: признаки}."""
+        computed = {}
+        for chunk in chunks(list(movie_ids)):
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT id, score, date_x, budget_x, revenue FROM movies WHERE id IN ({placeholders})", chunk
+            ).fetchall()
+            computed.update((row[0], movie_features(*row[1:])) for row in rows)
+        if computed:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO movie_features (movie_id, {', '.join(FEATURE_NAMES)}) "
+                f"VALUES (?, {', '.join('?' * len(FEATURE_NAMES))})",
+                [(movie_id, *values) for movie_id, values in computed.items()]
+            )
+            conn.commit()
+        return computed
+
+    def get(self, conn, movie_ids):
+        """Матрица (len(movie_ids), len(FEATURE_NAMES)) в порядке movie_ids."""
+        movie_ids = list(movie_ids)
+        features = self.load(conn, movie_ids)
+        missing = list(dict.fromkeys(i for i in movie_ids if i not in features))
+        if missing:
+            features.update(self.compute(conn, missing))
+        matrix = np.full((len(movie_ids), len(FEATURE_NAMES)), MISSING, dtype=np.float32)
+        for row, movie_id in enumerate(movie_ids):
+            if movie_id in features:
+                matrix[row] = features[movie_id]
+        return matrix
+
+    def backfill(self, conn, batch_size=1024):
+        """Считает признаки всех фильмов каталога, у которых их еще нет."""
+        total = 0
+        while True:
+            rows = conn.execute("""
+                SELECT m.id FROM movies m
+                LEFT JOIN movie_features f ON f.movie_id = m.id
+                WHERE f.movie_id IS NULL
+                LIMIT ?
+            """, (batch_size,)).fetchall()
+            if not rows:
+                return total
+            total += len(self.compute(conn, [row[0] for row in rows]))
+
+
+if __name__ == "__main__":
+    import sys
+    sys.path.append(str(Path(__file__).parent.parent / "database"))
+    from db import DB_PATH, migrate
+
+    parser = argparse.ArgumentParser(description="Предвычисление признаков каталога")
+    parser.add_argument('--database', default=DB_PATH)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    migrate(conn)
+    print(FeatureStore().backfill(conn, args.batch_size))
+    conn.close()
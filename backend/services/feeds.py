@@ -0,0 +1,253 @@
+"""
+Материализованные ленты рекомендаций пользователей.
+
+Лента - ранжированные фильмы каталога по вкусу пользователя (его
+similar_movies), без описания запроса: кандидаты - фильмы его жанров, скор -
+сходство с понравившимися фильмами и числовые признаки, как в
+/api/ml/recommendations.
+
+Ленты хранятся в user_feeds вместе с версией профиля (user_profile_version,
+ее меняют триггеры на similar_movies) и версией каталога, по которым они
+посчитаны. FeedScheduler в фоне пересчитывает только ленты, у которых одна из
+версий изменилась, а /api/users/<id>/feed читает готовую ленту одним запросом
+по первичному ключу и помечает ее устаревшей, если версии уже не совпадают.
+
+Изменение профиля пересчитывает ленту при ближайшем проходе, а изменение
+каталога (например, загрузка фильмов из OMDb) - не чаще раза в
+catalog_interval: иначе каждая запись в movies пересчитывала бы все ленты.
+Планировщик есть в каждом процессе API, но ленты считает только один -
+владелец аренды в scheduler_leases; остальные передают ему запросы через
+таблицу feed_requests и подхватывают аренду, если он перестал ее продлевать.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from catalog import genre_names
+from recommender import blend_scores, build_recommendations, fetch_user_history, score_candidates
+from topk import top_k
+
+logger = logging.getLogger(__name__)
+
+FEED_SIZE = 50
+REFRESH_INTERVAL = 60.0
+# Сколько устаревших лент пересчитывается за один проход
+BATCH_SIZE = 32
+# Ленты, устаревшие только из-за каталога, пересчитываются не чаще раза в CATALOG_REFRESH_INTERVAL
+CATALOG_REFRESH_INTERVAL = 3600.0
+# Пауза между полными проходами, чтобы пересчет не занимал процесс API целиком
+BATCH_PAUSE = 1.0
+LEASE_NAME = 'feed-scheduler'
+
+
+def _timestamp(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def acquire_lease(conn, name, owner, ttl):
+    """Берет или продлевает аренду name на ttl секунд; True, если она у owner."""
+    now = time.time()
+    conn.execute("""
+        INSERT INTO scheduler_leases (name, owner, expires_at) VALUES (?1, ?2, ?3)
+        ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < ?4
+    """, (name, owner, now + ttl, now))
+    conn.commit()
+    row = conn.execute("SELECT owner FROM scheduler_leases WHERE name = ?", (name,)).fetchone()
+    return row is not None and row[0] == owner
+
+
+def profile_version(conn, user_id):
+    """Версия профиля пользователя; '' - он еще не добавлял похожих фильмов."""
+    row = conn.execute("SELECT version FROM user_profile_version WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else ''
+
+
+def read_feed(conn, user_id):
+    """(items - JSON-массив, refreshed_at, stale) или None, если ленты еще нет."""
+    row = conn.execute("""
+        SELECT f.items, f.refreshed_at,
+               f.profile_version != COALESCE(p.version, '') OR f.catalog_version != c.version
+        FROM user_feeds f
+        CROSS JOIN catalog_version c
+        LEFT JOIN user_profile_version p ON p.user_id = f.user_id
+        WHERE f.user_id = ?
+    """, (user_id,)).fetchone()
+    return (row[0], row[1], bool(row[2])) if row else None
+
+
+def stale_users(conn, version, limit, catalog_before=None, user_ids=None):
+    """
+    Пользователи, чья лента не посчитана или посчитана по старым версиям.
+
+    Ленты, устаревшие только из-за каталога, попадают в список, если посчитаны
+    раньше catalog_before (None - любые). Без user_ids ищутся среди
+    пользователей с профилем, с user_ids - только среди них; сначала - без
+    ленты и с изменившимся профилем.
+    """
+    if user_ids is None:
+        candidates, params = "SELECT user_id FROM user_profile_version", []
+    else:
+        if not user_ids:
+            return []
+        candidates, params = f"VALUES {', '.join(['(?)'] * len(user_ids))}", list(user_ids)
+    rows = conn.execute(f"""
+        WITH candidates (user_id) AS ({candidates})
+        SELECT c.user_id FROM candidates c
+        LEFT JOIN user_profile_version p ON p.user_id = c.user_id
+        LEFT JOIN user_feeds f ON f.user_id = c.user_id
+        WHERE f.user_id IS NULL OR f.profile_version != COALESCE(p.version, '')
+        OR (f.catalog_version != ? AND (? IS NULL OR f.refreshed_at < ?))
+        ORDER BY f.user_id IS NOT NULL, f.profile_version = COALESCE(p.version, '')
+        LIMIT ?
+    """, params + [version, catalog_before, catalog_before, limit])
+    return [row[0] for row in rows]
+
+
+def compute_feed(conn, catalog, embedding_store, user_id, blend_weights, size=FEED_SIZE):
+    """Лента пользователя в формате ответа /api/ml/recommendations."""
+    liked_movie_ids, liked_overviews = fetch_user_history(conn.cursor(), user_id)
+    genres = set()
+    for (genre,) in conn.execute("SELECT genre FROM user_similar_movies WHERE user_id = ?", (user_id,)):
+        genres.update(genre_names(genre))
+
+    # Фильмы жанров пользователя (без профиля - весь каталог), кроме уже добавленных
+    matching = [catalog.genre_rows[name] for name in genres if name in catalog.genre_rows]
+    if not matching:
+        matching = list(catalog.genre_rows.values())
+    if not matching:
+        return []
+    rows = np.setdiff1d(np.concatenate(matching), catalog.rows_for_ids(liked_movie_ids))
+    if not len(rows):
+        return []
+
+    targets = []
+    if liked_overviews:
+        targets.append(embedding_store.encoder.encode(liked_overviews))
+    if liked_movie_ids:
+        targets.append(embedding_store.get(conn, liked_movie_ids))
+    if targets:
+        target_embeddings = np.vstack(targets)
+        movie_embeddings = catalog.embeddings_for(rows, lambda movie_ids: embedding_store.get(conn, movie_ids))
+        similarity = score_candidates(target_embeddings, movie_embeddings, np.ones(len(target_embeddings)))
+    else:
+        similarity = np.zeros(len(rows), dtype=np.float32)
+
+    features = catalog.features_for(rows)
+    scores = blend_scores(similarity, [], features, blend_weights)
+    return build_recommendations(catalog, rows, scores, top_k(scores, size), [])
+
+
+class FeedScheduler:
+    """
+    Фоновый пересчет лент.
+
+    Раз в interval секунд пересчитывает до batch_size устаревших лент (после
+    полной пачки - через batch_pause); request(user_id) ставит пользователя
+    первым в очередь и будит поток. Считает только владелец аренды LEASE_NAME,
+    она выдается на lease_ttl секунд и продлевается каждым проходом. Если
+    задан cluster_index (clusters.ClusterIndex), перед лентами инкрементально
+    обновляются кластеры вкусов.
+    """
+
+    def __init__(self, connect, catalog_index, embedding_store, blend_weights,
+                 interval=REFRESH_INTERVAL, batch_size=BATCH_SIZE, size=FEED_SIZE, cluster_index=None,
+                 catalog_interval=CATALOG_REFRESH_INTERVAL, batch_pause=BATCH_PAUSE, lease_ttl=None):
+        self.connect = connect
+        self.catalog_index = catalog_index
+        self.embedding_store = embedding_store
+        self.blend_weights = blend_weights
+        self.interval = interval
+        self.batch_size = batch_size
+        self.size = size
+        self.cluster_index = cluster_index
+        self.catalog_interval = catalog_interval
+        self.batch_pause = batch_pause
+        self.lease_ttl = lease_ttl or 3 * interval
+        self.owner = uuid.uuid4().hex
+        self._requested = {}
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='feed-scheduler', daemon=True)
+                self._thread.start()
+
+    def request(self, user_id):
+        """Просит пересчитать ленту пользователя при ближайшем проходе (поток запускает start())."""
+        with self._lock:
+            self._requested[user_id] = None
+        self._wake.set()
+
+    def refresh(self, conn, user_id):
+        """Пересчитывает и сохраняет ленту; версии читаются до расчета, чтобы не пропустить изменения."""
+        profile = profile_version(conn, user_id)
+        # Лента помечается версией снимка каталога, по которому посчитана (он может отставать от базы)
+        catalog = self.catalog_index.get(conn)
+        version = catalog.version
+        items = compute_feed(conn, catalog, self.embedding_store, user_id, self.blend_weights, self.size)
+        conn.execute(
+            """INSERT OR REPLACE INTO user_feeds
+            (user_id, profile_version, catalog_version, items, refreshed_at) VALUES (?, ?, ?, ?, ?)""",
+            (user_id, profile, version, json.dumps(items, default=float),
+             _timestamp(datetime.now(timezone.utc)))
+        )
+        conn.commit()
+
+    def run_once(self):
+        """Один проход: запрошенные пользователи, затем устаревшие ленты. Возвращает число пересчитанных."""
+        with self._lock:
+            requested = list(self._requested)
+            self._requested.clear()
+        conn = self.connect()
+        try:
+            if not acquire_lease(conn, LEASE_NAME, self.owner, self.lease_ttl):
+                # Ленты считает планировщик другого процесса - запросы передаются ему через базу
+                if requested:
+                    conn.executemany("INSERT OR IGNORE INTO feed_requests (user_id) VALUES (?)",
+                                     [(user_id,) for user_id in requested])
+                    conn.commit()
+                return 0
+            requested.extend(row[0] for row in conn.execute("DELETE FROM feed_requests RETURNING user_id"))
+            conn.commit()
+            if self.cluster_index is not None:
+                try:
+                    self.cluster_index.update(conn, self.embedding_store, self.catalog_index)
+                except Exception:
+                    logger.exception("Failed to update taste clusters")
+            version = self.catalog_index.get(conn).version
+            catalog_before = _timestamp(datetime.now(timezone.utc) - timedelta(seconds=self.catalog_interval))
+            # Запрошенные пересчитываются, только если лента действительно устарела
+            requested = list(dict.fromkeys(requested))
+            users = stale_users(conn, version, len(requested), catalog_before, requested)
+            if len(users) < self.batch_size:
+                users.extend(stale_users(conn, version, self.batch_size, catalog_before))
+            refreshed = 0
+            for user_id in dict.fromkeys(users):
+                try:
+                    self.refresh(conn, user_id)
+                    refreshed += 1
+                except Exception:
+                    logger.exception("Failed to refresh feed of user %s", user_id)
+        finally:
+            conn.close()
+        return refreshed
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                refreshed = self.run_once()
+            except Exception:
+                logger.exception("Feed refresh failed")
+                refreshed = 0
+            # Полный проход - возможно, устаревших лент больше, продолжаем после короткой паузы
+            self._wake.wait(self.interval if refreshed < self.batch_size else self.batch_pause)
@@ -0,0 +1,208 @@
+"""
+Поиск имен актеров каталога в свободном тексте запроса.
+
+ActorGazetteer - автомат Ахо-Корасик по словам всех имен актеров из поля crew
+каталога: описание проходится один раз, без регулярных выражений на каждое
+имя, совпадения только по границам слов, без учета регистра, диакритики и
+пунктуации ("with keanu reeves", "Keanu Reeves' best"). Вместе с автоматом
+хранится индекс актер -> фильмы, так что найденные имена сразу дают id
+фильмов без разбора crew у каждого кандидата.
+
+ActorIndex держит автомат актуальным: каталог помечается версией (таблица
+catalog_version, ее меняют триггеры на movies), а построенный автомат
+сериализуется в таблицу actor_gazetteer, так что при старте процесса он
+загружается одним чтением, а не строится заново. После изменения каталога
+новый автомат строится в фоне (versioned.VersionedIndex), а запросы до его
+готовности используют предыдущий.
+
+Построить заранее:
+    python gazetteer.py --database backend/database/movies.db
+"""
+import argparse
+import json
+import marshal
+import re
+import sys
+import unicodedata
+from collections import deque
+
+from recommender import parse_actors
+from versioned import VersionedIndex
+
+# Имена из одного слова ("Madonna", "Tom") дают слишком много ложных совпадений в описаниях
+MIN_NAME_WORDS = 2
+# marshal не переносим между версиями Python - при смене версии автомат перестраивается
+FORMAT = f'marshal-{sys.version_info[0]}.{sys.version_info[1]}-1'
+
+
+def words(text):
+    """Слова текста в нижнем регистре без диакритики; пунктуация - разделитель."""
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return re.findall(r'[^\W_]+', text.casefold())
+
+
+class ActorGazetteer:
+    """Словарь имен актеров с автоматом Ахо-Корасик и индексом актер -> фильмы."""
+
+    def __init__(self, state, version=None):
+        self.names = state['names']
+        self.postings = state['postings']
+        self.lengths = state['lengths']
+        self.goto = state['goto']
+        self.fail = state['fail']
+        self.output = state['output']
+        self.version = version
+        self._name_ids = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def build(cls, rows, version=None):
+        """Строит словарь по строкам (id фильма, crew)."""
+        keys = {}
+        names = []
+        postings = []
+        for movie_id, crew in rows:
+            try:
+                actors = parse_actors(crew)
+            except (json.JSONDecodeError, AttributeError):
+                continue
+            for actor in actors:
+                key = tuple(words(actor))
+                if len(key) < MIN_NAME_WORDS:
+                    continue
+                i = keys.get(key)
+                if i is None:
+                    i = keys[key] = len(names)
+                    names.append(actor.strip())
+                    postings.append([])
+                if not postings[i] or postings[i][-1] != movie_id:
+                    postings[i].append(movie_id)
+
+        # Бор по словам: переходы - словари {слово: состояние}
+        goto = [{}]
+        output = [()]
+        for key, i in keys.items():
+            state = 0
+            for word in key:
+                following = goto[state].get(word)
+                if following is None:
+                    following = goto[state][word] = len(goto)
+                    goto.append({})
+                    output.append(())
+                state = following
+            output[state] = (i,)
+
+        # Суффиксные ссылки обходом в ширину; output включает имена, заканчивающиеся в суффиксах
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, following in goto[state].items():
+                queue.append(following)
+                link = fail[state]
+                while link and word not in goto[link]:
+                    link = fail[link]
+                fail[following] = goto[link].get(word, 0)
+                output[following] = output[following] + output[fail[following]]
+
+        return cls({
+            'names': names,
+            'postings': [tuple(p) for p in postings],
+            'lengths': [len(key) for key in keys],
+            'goto': goto,
+            'fail': fail,
+            'output': output,
+        }, version)
+
+    def dumps(self):
+        return marshal.dumps({
+            'names': self.names, 'postings': self.postings, 'lengths': self.lengths,
+            'goto': self.goto, 'fail': self.fail, 'output': self.output,
+        })
+
+    @classmethod
+    def loads(cls, data, version=None):
+        return cls(marshal.loads(data), version)
+
+    def find(self, text):
+        """Имена актеров из text без повторов, в порядке упоминания."""
+        matches = []
+        state = 0
+        for position, word in enumerate(words(text)):
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            for i in self.output[state]:
+                matches.append((position - self.lengths[i] + 1, position, i))
+
+        # Имя внутри более длинного совпадения ("Robert Downey" в "Robert Downey Jr") не считается
+        found = []
+        covered_until = -1
+        for start, end, i in sorted(matches, key=lambda m: (m[0], -m[1])):
+            if end <= covered_until:
+                continue
+            covered_until = end
+            if self.names[i] not in found:
+                found.append(self.names[i])
+        return found
+
+    def movies_for(self, names):
+        """{id фильма: имена из names, которые в нем играют} по индексу актер -> фильмы."""
+        movies = {}
+        for name in names:
+            for movie_id in self.postings[self._name_ids[name]]:
+                movies.setdefault(movie_id, []).append(name)
+        return movies
+
+
+def catalog_version(conn):
+    return conn.execute("SELECT version FROM catalog_version").fetchone()[0]
+
+
+class ActorIndex(VersionedIndex):
+    """
+    ActorGazetteer для текущей версии каталога; перестраивается, когда каталог меняется.
+
+    С connect (фабрика соединений) перестройка идет в фоне, см. VersionedIndex.
+    """
+
+    def version(self, conn):
+        return catalog_version(conn)
+
+    def build(self, conn, version):
+        return self.load(conn, version) or self.rebuild(conn, version)
+
+    def load(self, conn, version):
+        """Сохраненный автомат, если он построен для этой версии каталога."""
+        row = conn.execute(
+            "SELECT data FROM actor_gazetteer WHERE catalog_version = ? AND format = ?", (version, FORMAT)
+        ).fetchone()
+        return ActorGazetteer.loads(row[0], version) if row else None
+
+    def rebuild(self, conn, version):
+        rows = conn.execute("SELECT id, crew FROM movies WHERE crew IS NOT NULL AND crew != ''")
+        gazetteer = ActorGazetteer.build(rows, version)
+        conn.execute(
+            "INSERT OR REPLACE INTO actor_gazetteer (id, catalog_version, format, data) VALUES (1, ?, ?, ?)",
+            (version, FORMAT, gazetteer.dumps())
+        )
+        conn.commit()
+        return gazetteer
+
+
+if __name__ == "__main__":
+    import sqlite3
+    from pathlib import Path
+
+    sys.path.append(str(Path(__file__).parent.parent / "database"))
+    from db import DB_PATH, migrate
+
+    parser = argparse.ArgumentParser(description="Построение словаря актеров каталога")
+    parser.add_argument('--database', default=DB_PATH)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    migrate(conn)
+    gazetteer = ActorIndex().rebuild(conn, catalog_version(conn))
+    print(f"{len(gazetteer.names)} actors, {len(gazetteer.goto)} states")
+    conn.close()
@@ -0,0 +1,304 @@
+"""
+Отдельный процесс инференса эмбеддингов.
+
+Модель загружается один раз в воркере, а не в каждом веб-воркере Flask:
+память под torch/onnxruntime и потоки BLAS не умножаются на число веб-воркеров.
+Веб-воркеры обращаются к нему через InferenceClient по Unix-сокету; запросы
+от разных соединений склеиваются в батчи до max_batch текстов или max_wait.
+
+Протокол - кадры multiprocessing.connection (send_bytes/recv_bytes, без pickle):
+запрос - JSON {"texts": [...]} или {"op": "name"}, ответ - JSON-заголовок
+{"shape": [n, d]} и кадр с float32-матрицей либо {"error": причина}.
+
+Запуск воркера:
+    python inference.py --socket /tmp/movies-inference.sock --encoder onnx \\
+        --onnx-model-dir backend/models/minilm-onnx --threads 4
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+MAX_BATCH = 64
+MAX_WAIT = 0.005
+# Сколько запросов может ждать батча; сверх этого воркер сразу отвечает 'overloaded'
+MAX_PENDING = 256
+TIMEOUT = 2.0
+
+
+class InferenceUnavailable(Exception):
+    """
+    Воркер не ответил за timeout, перегружен или не запущен.
+
+    reason - 'timeout', 'overloaded', 'unavailable' или 'error'.
+    """
+
+    def __init__(self, reason, message=''):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+class _Job:
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class FramedServer:
+    """
+    Сервер кадров multiprocessing.connection на Unix-сокете, поток на соединение.
+
+    Подклассы разбирают запрос в _handle_request(conn, request) и отвечают через _reply.
+    """
+
+    def __init__(self, address, authkey=None):
+        self.address = str(address)
+        self.authkey = authkey
+        self._listener = None
+        self._closed = threading.Event()
+
+    def serve_forever(self, ready=None):
+        # Сокет от упавшего процесса мешает bind
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self._listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        os.chmod(self.address, 0o600)
+        if ready is not None:
+            ready.set()
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                # Клиент с другим ключом (или без ключа) - отказ только ему
+                continue
+            except OSError:
+                if self._closed.is_set():
+                    break
+                continue
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        if self._listener is not None:
+            self._listener.close()
+
+    def _reply(self, conn, header, data=None):
+        conn.send_bytes(json.dumps(header).encode('utf-8'))
+        if data is not None:
+            conn.send_bytes(data)
+
+    def _handle(self, conn):
+        with conn:
+            try:
+                while True:
+                    self._handle_request(conn, json.loads(conn.recv_bytes()))
+            except (EOFError, OSError):
+                # Клиент закрыл соединение, в том числе не дождавшись ответа
+                return
+
+    def _handle_request(self, conn, request):
+        raise NotImplementedError
+
+
+class InferenceServer(FramedServer):
+    """Воркер: принимает соединения и кодирует тексты батчами одним потоком."""
+
+    def __init__(self, encoder, address, max_batch=MAX_BATCH, max_wait=MAX_WAIT,
+                 max_pending=MAX_PENDING, authkey=None):
+        super().__init__(address, authkey)
+        self.encoder = encoder
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def serve_forever(self, ready=None):
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+        super().serve_forever(ready)
+
+    def _handle_request(self, conn, request):
+        if request.get('op') == 'name':
+            self._reply(conn, {'name': self.encoder.name})
+            return
+
+        job = _Job(list(request.get('texts', [])))
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._reply(conn, {'error': 'overloaded'})
+            return
+        job.done.wait()
+        if job.error is not None:
+            self._reply(conn, {'error': 'error', 'message': job.error})
+        else:
+            self._reply(conn, {'shape': list(job.result.shape)}, job.result.tobytes())
+
+    def _next_batch(self):
+        """Первый запрос из очереди и все, что успело прийти за max_wait (до max_batch текстов)."""
+        jobs = [self._queue.get()]
+        size = len(jobs[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job.texts)
+        return jobs
+
+    def _batch_loop(self):
+        while True:
+            jobs = self._next_batch()
+            texts = [text for job in jobs for text in job.texts]
+            try:
+                embeddings = np.asarray(self.encoder.encode(texts), dtype=np.float32) if texts else None
+            except Exception as e:
+                for job in jobs:
+                    job.error = str(e)
+                    job.done.set()
+                continue
+            start = 0
+            for job in jobs:
+                if embeddings is None:
+                    job.result = np.zeros((0, 0), dtype=np.float32)
+                else:
+                    job.result = embeddings[start:start + len(job.texts)]
+                start += len(job.texts)
+                job.done.set()
+
+
+class FramedClient:
+    """
+    Клиент FramedServer с пулом соединений.
+
+    Соединение, по которому не дождались ответа, закрывается, чтобы опоздавший
+    ответ не достался следующему запросу. Ошибки - исключение self.error(reason, message).
+    """
+
+    error = InferenceUnavailable
+
+    def __init__(self, address, timeout=TIMEOUT, authkey=None, pool_size=8):
+        self.address = str(address)
+        self.timeout = timeout
+        self.authkey = authkey
+        self.pool_size = pool_size
+        self._pool = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with self._lock:
+            if self._pool:
+                return self._pool.pop()
+        try:
+            return Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        except (OSError, EOFError) as e:
+            raise self.error('unavailable', str(e)) from e
+        except AuthenticationError as e:
+            raise self.error('unauthorized', str(e)) from e
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(conn)
+                return
+        conn.close()
+
+    def _request(self, payload, timeout=None, data=None):
+        """Отправляет JSON-заголовок (и кадр data), возвращает (заголовок ответа, данные или None)."""
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        conn = self._connect()
+        try:
+            conn.send_bytes(json.dumps(payload).encode('utf-8'))
+            if data is not None:
+                conn.send_bytes(data)
+            if not conn.poll(timeout):
+                conn.close()
+                raise self.error('timeout', f'No response in {timeout:.3f}s')
+            header = json.loads(conn.recv_bytes())
+            data = conn.recv_bytes() if 'shape' in header else None
+        except (OSError, EOFError) as e:
+            conn.close()
+            raise self.error('unavailable', str(e)) from e
+        except ValueError as e:
+            # Не кадр протокола - например, сервер ждет ключ, а клиент его не передал
+            conn.close()
+            raise self.error('unauthorized', str(e)) from e
+        self._release(conn)
+        if 'error' in header:
+            raise self.error(header['error'], header.get('message', ''))
+        return header, data
+
+
+class InferenceClient(FramedClient):
+    """Энкодер веб-воркера поверх InferenceServer (тот же интерфейс: name, encode)."""
+
+    def __init__(self, address, timeout=TIMEOUT, authkey=None, pool_size=8):
+        super().__init__(address, timeout, authkey, pool_size)
+        self._name = None
+
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = self._request({'op': 'name'})[0]['name']
+        return self._name
+
+    def encode(self, texts, batch_size=32, timeout=None):
+        """timeout - остаток дедлайна запроса; ожидание не дольше self.timeout в любом случае."""
+        single = isinstance(texts, str)
+        header, data = self._request({'texts': [texts] if single else list(texts)}, timeout)
+        embeddings = np.frombuffer(data, dtype=np.float32).reshape(header['shape'])
+        return embeddings[0] if single else embeddings
+
+
+def main():
+    import sys
+    from pathlib import Path
+
+    from encoders import create_encoder
+
+    parser = argparse.ArgumentParser(description="Воркер инференса эмбеддингов")
+    parser.add_argument('--socket', default=os.environ.get('INFERENCE_SOCKET', '/tmp/movies-inference.sock'))
+    parser.add_argument('--encoder', default='torch')
+    parser.add_argument('--onnx-model-dir', default=str(Path(__file__).parent.parent / "models" / "minilm-onnx"))
+    parser.add_argument('--onnx-quantized', action='store_true')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(),
+                        help="Потоки инференса (torch/onnxruntime)")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT * 1000)
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING)
+    args = parser.parse_args()
+
+    # Бюджет потоков задается до загрузки torch/onnxruntime
+    os.environ['OMP_NUM_THREADS'] = str(args.threads)
+    encoder = create_encoder({
+        'ENCODER_BACKEND': args.encoder,
+        'ONNX_MODEL_DIR': args.onnx_model_dir,
+        'ONNX_QUANTIZED': args.onnx_quantized,
+        'ONNX_NUM_THREADS': args.threads,
+    })
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(args.threads)
+
+    authkey = os.environ.get('INFERENCE_AUTHKEY')
+    server = InferenceServer(encoder, args.socket, args.max_batch, args.max_wait_ms / 1000,
+                             args.max_pending, authkey.encode('utf-8') if authkey else None)
+    print(f"Inference worker ({encoder.name}) listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Пополнение каталога movies фильмами из OMDb.
+
+Карточки фильмов, полученные через OMDb-прокси, ставятся в очередь и в фоне
+записываются в movies (ключ дедупликации - imdb_id). Эмбеддинги описаний
+и числовые признаки считаются сразу пачкой, так что рекомендации по этим
+фильмам берут готовые данные из movie_embeddings и movie_features.
+
+Каждая запись в movies меняет catalog_version, а с ней ключи кэша
+рекомендаций и ETag всех пользователей. Поэтому карточки копятся до
+flush_interval секунд и пишутся одной пачкой, а карточка без изменений
+строку не трогает: просмотр карточки пользователем не сбрасывает кэш.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 300.0
+
+
+def _value(details, field):
+    value = details.get(field)
+    return None if value in (None, '', 'N/A') else value
+
+
+def _number(value):
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace('$', '').replace(',', ''))
+    except ValueError:
+        return None
+
+
+def omdb_to_movie(details):
+    """Строка для movies из карточки OMDb (ответ на ?i=...), None если это не фильм с названием и описанием."""
+    if details.get('Response') != 'True' or not _value(details, 'imdbID'):
+        return None
+    title, plot = _value(details, 'Title'), _value(details, 'Plot')
+    if details.get('Type', 'movie') != 'movie' or not title or not plot:
+        return None
+
+    released = _value(details, 'Released')
+    try:
+        date_x = datetime.strptime(released, '%d %b %Y').strftime('%Y-%m-%d') if released else None
+    except ValueError:
+        date_x = None
+    rating = _number(_value(details, 'imdbRating'))
+    crew = {name: _value(details, name) for name in ('Actors', 'Director') if _value(details, name)}
+
+    return {
+        'imdb_id': details['imdbID'],
+        'title': title,
+        'date_x': date_x,
+        # В каталоге оценка по шкале 0-100
+        'score': rating * 10 if rating is not None else None,
+        'genre': _value(details, 'Genre'),
+        'overview': plot,
+        'crew': json.dumps(crew) if crew else None,
+        'orig_title': title,
+        'status': 'Released' if date_x else None,
+        'orig_lang': _value(details, 'Language'),
+        'budget_x': None,
+        'revenue': _number(_value(details, 'BoxOffice')),
+        'country': _value(details, 'Country'),
+    }
+
+
+MOVIE_FIELDS = ('imdb_id', 'title', 'date_x', 'score', 'genre', 'overview', 'crew',
+                'orig_title', 'status', 'orig_lang', 'budget_x', 'revenue', 'country')
+
+
+def upsert_movies(conn, movies):
+    """Вставляет или обновляет фильмы по imdb_id, возвращает их id в movies."""
+    columns = ', '.join(MOVIE_FIELDS)
+    placeholders = ', '.join('?' * len(MOVIE_FIELDS))
+    updates = ', '.join(f"{name} = COALESCE(excluded.{name}, {name})" for name in MOVIE_FIELDS[1:])
+    changed = ' OR '.join(f"excluded.{name} IS NOT NULL AND excluded.{name} IS NOT movies.{name}"
+                          for name in MOVIE_FIELDS[1:])
+    ids = []
+    for movie in movies:
+        row = conn.execute(
+            f"""INSERT INTO movies ({columns}) VALUES ({placeholders})
+            ON CONFLICT (imdb_id) DO UPDATE SET {updates} WHERE {changed}
+            RETURNING id""",
+            [movie[name] for name in MOVIE_FIELDS]
+        ).fetchone()
+        if row is None:
+            # Фильм уже в каталоге без изменений: строка не обновляется и catalog_version не меняется
+            row = conn.execute("SELECT id FROM movies WHERE imdb_id = ?", (movie['imdb_id'],)).fetchone()
+        ids.append(row[0])
+    conn.commit()
+    return ids
+
+
+class IngestionWorker:
+    """
+    Фоновая запись карточек OMDb в каталог.
+
+    submit() не блокирует запрос; поток копит карточки до batch_size штук или
+    flush_interval секунд после первой и обрабатывает их одной пачкой.
+    """
+
+    def __init__(self, connect, embedding_store, feature_store=None,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.connect = connect
+        self.embedding_store = embedding_store
+        self.feature_store = feature_store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.ingested = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, details):
+        """Ставит карточку в очередь, если она пригодна для каталога."""
+        movie = omdb_to_movie(details)
+        if movie is None:
+            return False
+        with self._lock:
+            self.queue.put(movie)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='omdb-ingestion', daemon=True)
+                self._thread.start()
+        return True
+
+    def _next_batch(self, timeout, collect=0):
+        """Первая карточка - не дольше timeout, остальные - до collect секунд после нее."""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + collect
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch):
+        # Одна и та же карточка могла прийти несколько раз - оставляем последнюю
+        movies = list({movie['imdb_id']: movie for movie in batch}.values())
+        conn = self.connect()
+        try:
+            ids = upsert_movies(conn, movies)
+            self.embedding_store.compute(conn, ids)
+            if self.feature_store is not None:
+                self.feature_store.compute(conn, ids)
+        finally:
+            conn.close()
+        self.ingested += len(movies)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch(self.flush_interval, self.flush_interval)
+            if not batch:
+                # Поток завершается, когда очередь пуста; следующий submit запустит новый
+                with self._lock:
+                    if self.queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                self._process(batch)
+            except Exception:
+                logger.exception("Failed to ingest %d OMDb movies", len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def drain(self):
+        """Обрабатывает всю очередь в текущем потоке (тесты, остановка процесса)."""
+        while True:
+            batch = self._next_batch(timeout=0)
+            if not batch:
+                return
+            try:
+                self._process(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
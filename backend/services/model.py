@@ -5,6 +5,8 @@ import sqlite3
 from pathlib import Path
 import re
 
+from topk import top_k
+
 def get_db_connection():
     """Подключение к базе данных."""
     db_path = Path(__file__).parent.parent.parent / "database" / "movies.db"
@@ -51,18 +53,14 @@ def recommend_movies(user_text, omdb_movies, top_n=10):
     # 6. Проверяем наличие актеров из запроса в фильмах OMDb
     actors_in_query = extract_actors(user_text)  # Функция для извлечения актеров (пример ниже)
     
+    actor_matches = np.zeros(len(omdb_movies))
     for i, movie in enumerate(omdb_movies):
         movie["similarity"] = similarities[i]
         movie["actor_match"] = check_actor_match(movie.get("Actors", ""), actors_in_query)
+        actor_matches[i] = movie["actor_match"]
     
-    # 7. Сортируем по схожести и совпадению актеров
-    sorted_movies = sorted(
-        omdb_movies,
-        key=lambda x: (x["similarity"], x["actor_match"]),
-        reverse=True
-    )
-    
-    return sorted_movies[:top_n]
+    # 7. Отбираем top_n по схожести и совпадению актеров
+    return [omdb_movies[i] for i in top_k(similarities, top_n, tiebreak=actor_matches)]
 
 import re
 
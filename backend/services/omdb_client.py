@@ -0,0 +1,156 @@
+"""
+Клиент OMDb API с кэшем ответов в SQLite.
+
+- ответы хранятся в таблице omdb_cache с TTL, ответы "не найдено"
+  (Response: False) кэшируются на более короткий срок;
+- одновременные одинаковые запросы объединяются в один вызов OMDb;
+- соединения с OMDb переиспользуются через пул requests.Session
+  (requests импортируется при первом запросе к OMDb, а не при старте API);
+- если OMDb недоступен, отдается устаревшая запись из кэша, если она есть.
+"""
+import json
+import threading
+import time
+
+SEARCH_TTL = 24 * 3600
+DETAILS_TTL = 7 * 24 * 3600
+NOT_FOUND_TTL = 3600
+
+# Параметры OMDb, которые проксируются; остальные (в том числе apikey) отбрасываются
+ALLOWED_PARAMS = ('s', 'i', 't', 'type', 'y', 'page', 'plot')
+
+
+class OmdbError(Exception):
+    """OMDb недоступен или ответил ошибкой, а в кэше ничего нет."""
+
+
+def cache_key(params):
+    """Нормализованный ключ запроса: без регистра и лишних пробелов в поиске."""
+    normalized = {}
+    for name in ALLOWED_PARAMS:
+        value = params.get(name)
+        if value in (None, ''):
+            continue
+        value = ' '.join(str(value).split())
+        normalized[name] = value.lower() if name in ('s', 't', 'type', 'plot') else value
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OmdbClient:
+    """Запросы к OMDb через кэш omdb_cache."""
+
+    def __init__(self, base_url, api_key, timeout=10, pool_size=20,
+                 search_ttl=SEARCH_TTL, details_ttl=DETAILS_TTL, not_found_ttl=NOT_FOUND_TTL):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.search_ttl = search_ttl
+        self.details_ttl = details_ttl
+        self.not_found_ttl = not_found_ttl
+        self.pool_size = pool_size
+        self._session = None
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Пул соединений, создается при первом запросе к OMDb."""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            return self._session
+
+    def _ttl(self, params, body):
+        if body.get('Response') == 'False':
+            return self.not_found_ttl
+        return self.search_ttl if 's' in params else self.details_ttl
+
+    def _read(self, conn, key):
+        return conn.execute(
+            "SELECT body, expires_at FROM omdb_cache WHERE key = ?", (key,)
+        ).fetchone()
+
+    def _fetch(self, conn, key, params):
+        """Запрос к OMDb и запись ответа в кэш."""
+        query = {name: value for name, value in params.items() if name in ALLOWED_PARAMS}
+        query['apikey'] = self.api_key
+        import requests
+        try:
+            response = self.session.get(self.base_url, params=query, timeout=self.timeout)
+            response.raise_for_status()
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise OmdbError(str(e)) from e
+        if not isinstance(body, dict):
+            raise OmdbError(f"Unexpected OMDb response: {type(body).__name__}")
+
+        # Ошибки ключа и лимита OMDb тоже приходят как Response: False - их не кэшируем
+        error = body.get('Error', '')
+        if body.get('Response') == 'False' and ('API key' in error or 'limit' in error.lower()):
+            raise OmdbError(error)
+
+        text = json.dumps(body)
+        conn.execute(
+            "INSERT OR REPLACE INTO omdb_cache (key, body, expires_at) VALUES (?, ?, ?)",
+            (key, text, time.time() + self._ttl(params, body))
+        )
+        conn.commit()
+        return text
+
+    def get(self, conn, params):
+        """
+        Ответ OMDb для params в виде JSON-строки.
+
+        Возвращает (тело, источник), где источник - 'hit', 'miss',
+        'coalesced' (дождались чужого запроса) или 'stale'.
+        """
+        key = cache_key(params)
+        cached = self._read(conn, key)
+        if cached and cached[1] > time.time():
+            return cached[0], 'hit'
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is None:
+                return call.result, 'coalesced'
+        else:
+            try:
+                call.result = self._fetch(conn, key, params)
+                return call.result, 'miss'
+            except OmdbError as e:
+                call.error = e
+            except Exception as e:
+                # Любая ошибка лидера (например, sqlite при записи в кэш) доходит
+                # до ожидающих его запросов как OmdbError
+                call.error = OmdbError(str(e))
+                call.error.__cause__ = e
+            finally:
+                if call.result is None and call.error is None:
+                    call.error = OmdbError("OMDb request was interrupted")
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if cached:
+            return cached[0], 'stale'
+        raise call.error
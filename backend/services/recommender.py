@@ -0,0 +1,172 @@
+"""
+Этапы подбора рекомендаций для /api/ml/recommendations.
+
+Каждый этап - отдельная функция, чтобы маршрут во Flask, бенчмарки и
+инструментирование работали с одним и тем же кодом. Модуль импортируется
+при старте API, поэтому здесь только numpy: scikit-learn (~0.8 с импорта)
+для косинусного сходства не нужен.
+"""
+import json
+import math
+import re
+
+import numpy as np
+
+from embedding_store import chunks
+from encoders import l2_normalize
+from features import FEATURE_NAMES
+
+DESCRIPTION_WEIGHT = 1.0
+SIMILAR_MOVIE_WEIGHT = 0.5
+
+# Сигналы итогового скора: косинусное сходство, число совпавших актеров
+# и числовые признаки фильма (features.FEATURE_NAMES)
+SIGNALS = ('similarity', 'actors') + FEATURE_NAMES
+DEFAULT_SCORE_WEIGHTS = {
+    'similarity': 1.0,
+    'actors': 0.1,
+    'rating': 0.05,
+    'recency': 0.02,
+    'popularity': 0.02,
+}
+
+
+def fetch_user_history(cursor, user_id):
+    """
+    Похожие фильмы пользователя.
+
+    Возвращает (id фильмов каталога, описания фильмов не из каталога):
+    для первых эмбеддинги берутся из movie_embeddings, вторые кодируются.
+    """
+    cursor.execute("""
+        SELECT s.movie_id, COALESCE(m.overview, s.overview) AS overview
+        FROM similar_movies s
+        LEFT JOIN movies m ON m.id = s.movie_id
+        WHERE s.user_id = ?
+    """, (user_id,))
+    movie_ids = []
+    overviews = []
+    for movie_id, overview in cursor.fetchall():
+        if not overview:
+            continue
+        if movie_id is not None:
+            movie_ids.append(movie_id)
+        else:
+            overviews.append(overview)
+    return movie_ids, overviews
+
+
+def fetch_genre_candidates(cursor, genre, movie_ids=None):
+    """
+    Фильмы каталога, у которых в жанрах есть genre.
+
+    movie_ids ограничивает выборку этими фильмами (например, фильмами
+    найденных в запросе актеров) - тогда жанр проверяется только у них.
+    """
+    query = """
+        SELECT id, title, overview, genre, score, crew
+        FROM movies
+        WHERE genre LIKE ?
+        AND overview IS NOT NULL
+        AND overview != ''
+    """
+    if movie_ids is None:
+        cursor.execute(query, (f"%{genre}%",))
+        return cursor.fetchall()
+    movies = []
+    for chunk in chunks(sorted(movie_ids)):
+        cursor.execute(query + f" AND id IN ({','.join('?' * len(chunk))})", (f"%{genre}%", *chunk))
+        movies.extend(cursor.fetchall())
+    return movies
+
+
+def parse_actors(crew):
+    """
+    Список актеров из поля crew.
+
+    Фильмы из OMDb хранят JSON {"Actors": "A, B"}, фильмы из CSV - строку
+    "Актер, Роль, Актер, Роль".
+    """
+    if not crew:
+        return []
+    if crew.lstrip().startswith('{'):
+        crew_data = json.loads(crew)
+        return crew_data.get('Actors', '').split(', ') if 'Actors' in crew_data else []
+    return [name.strip() for name in crew.split(',')[::2] if name.strip()]
+
+
+def target_weights(similar_count):
+    """Веса описания запроса и похожих фильмов пользователя."""
+    return np.array([DESCRIPTION_WEIGHT] + [SIMILAR_MOVIE_WEIGHT] * similar_count)
+
+
+def score_candidates(target_embeddings, movie_embeddings, weights):
+    """Среднее взвешенных косинусных сходств кандидатов со всеми целевыми текстами."""
+    # Косинусное сходство как у sklearn: нулевые векторы дают сходство 0
+    similarities = l2_normalize(np.asarray(target_embeddings, dtype=np.float32)) @ \
+        l2_normalize(np.asarray(movie_embeddings, dtype=np.float32)).T
+    return np.mean(similarities * np.asarray(weights)[:, np.newaxis], axis=0)
+
+
+def _words(text):
+    return set(re.findall(r'\w{3,}', text.lower()))
+
+
+def lexical_scores(target_texts, overviews, weights):
+    """
+    Запасное ранжирование без модели, если воркер инференса недоступен.
+
+    Косинус между множествами слов (от 3 букв) описаний и целевых текстов,
+    усредненный с теми же весами, что и в score_candidates.
+    """
+    targets = [_words(text) for text in target_texts]
+    scores = np.zeros(len(overviews), dtype=np.float32)
+    for i, overview in enumerate(overviews):
+        words = _words(overview)
+        if not words:
+            continue
+        for target, weight in zip(targets, weights):
+            if target:
+                scores[i] += weight * len(words & target) / math.sqrt(len(words) * len(target))
+    return scores / max(len(targets), 1)
+
+
+def score_weights(overrides=None):
+    """Вектор весов в порядке SIGNALS; overrides - {сигнал: вес} поверх DEFAULT_SCORE_WEIGHTS."""
+    weights = dict(DEFAULT_SCORE_WEIGHTS, **(overrides or {}))
+    unknown = set(weights) - set(SIGNALS)
+    if unknown:
+        raise ValueError(f"Unknown score signals: {', '.join(sorted(unknown))}")
+    return np.array([weights[name] for name in SIGNALS], dtype=np.float64)
+
+
+def blend_scores(similarity, matched_actors, features, weights):
+    """
+    Итоговый скор - линейная комбинация сигналов одним матричным умножением.
+
+    similarity - (n,), matched_actors - совпавшие актеры по кандидатам (или []),
+    features - (n, len(FEATURE_NAMES)) из FeatureStore, weights - из score_weights().
+    """
+    n = len(similarity)
+    actor_counts = np.fromiter((len(m) for m in matched_actors), dtype=np.float32, count=n) \
+        if matched_actors else np.zeros(n, dtype=np.float32)
+    # Скор в float64 на всех путях (локально, шарды, слияние), чтобы ответы совпадали
+    signals = np.column_stack([similarity, actor_counts, features]).astype(np.float64, copy=False)
+    return signals @ np.asarray(weights, dtype=np.float64)
+
+
+def build_recommendations(catalog, rows, scores, indices, matched_actors):
+    """Формирует ответ для выбранных индексов кандидатов (rows - их строки в catalog.Catalog)."""
+    recommendations = []
+    for i in indices:
+        row = rows[i]
+        recommendations.append({
+            'id': int(catalog.ids[row]),
+            'title': catalog.text('title', row),
+            'overview': catalog.text('overview', row),
+            'genre': catalog.text('genre', row),
+            'score': catalog.score(row),
+            'similarity_score': scores[i],
+            'matched_actors': matched_actors[i] if matched_actors else []
+        })
+    return recommendations
@@ -0,0 +1,288 @@
+"""
+Шардированный поиск по векторам каталога (scatter-gather).
+
+Каталог делится по диапазонам id между N локальными процессами-шардами.
+ShardServer держит в памяти свою часть каталога (catalog.Catalog) и матрицу
+ее эмбеддингов и на запрос - целевые векторы, веса, жанр и фильмы найденных
+актеров - считает итоговый скор своих кандидатов (как get_ml_recommendations)
+и возвращает локальный top-k. ShardedSearch во фронтовом процессе рассылает
+запрос всем шардам параллельно, ждет каждый не дольше timeout и сливает
+ответы через topk.top_k_merge; не ответившие шарды пропускаются, результат
+помечается как частичный.
+
+У шардов нет модели: кандидаты без сохраненного вектора возвращаются списком
+missing, фронт кодирует их через EmbeddingStore и досчитывает сам, а шард
+подхватывает сохраненные векторы при следующем запросе.
+
+Протокол - кадры inference.FramedServer: JSON-заголовок запроса с "shape"
+и кадр float32-матрицы целевых векторов; ответ - JSON с ids, scores,
+candidates и missing.
+
+Запуск 4 шардов на одной машине:
+    python shards.py --database backend/database/movies.db --shards 4 --socket-dir /tmp/movies-shards
+и для API SEARCH_SHARDS=/tmp/movies-shards/shard-0.sock,/tmp/movies-shards/shard-1.sock,...
+С INFERENCE_AUTHKEY шарды принимают только клиентов с тем же ключом.
+"""
+import argparse
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from catalog import Catalog
+from embedding_store import EmbeddingStore
+from gazetteer import catalog_version
+from inference import FramedClient, FramedServer
+from recommender import blend_scores, score_candidates
+from topk import top_k, top_k_merge
+
+TIMEOUT = 0.5
+
+
+class ShardUnavailable(Exception):
+    """Шард не ответил: reason - 'timeout', 'unavailable' или 'error'."""
+
+    def __init__(self, reason, message=''):
+        super().__init__(message or reason)
+        self.reason = reason
+
+
+def shard_ranges(conn, shards):
+    """Диапазоны id [(min_id, max_id), ...] с примерно равным числом фильмов; крайние открыты (None)."""
+    ids = [row[0] for row in conn.execute("SELECT id FROM movies ORDER BY id")]
+    bounds = [ids[len(ids) * i // shards] if ids else 0 for i in range(1, shards)]
+    edges = [None] + bounds + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+class _ShardIndex:
+    """Каталог шарда и матрица эмбеддингов модели model (строка матрицы = строка каталога)."""
+
+    def __init__(self, catalog, model):
+        self.catalog = catalog
+        self.model = model
+        self.vectors = None
+        self.has_vector = np.zeros(len(catalog), dtype=bool)
+        # EmbeddingStore нужен только для чтения, ему достаточно имени модели
+        self._store = EmbeddingStore(SimpleNamespace(name=model))
+        self._lock = threading.Lock()
+
+    def load_vectors(self, conn, rows=None):
+        """Читает сохраненные векторы строк rows (None - всех строк шарда)."""
+        ids = self.catalog.ids if rows is None else self.catalog.ids[rows]
+        found = self._store.load(conn, ids.tolist())
+        if not found:
+            return
+        with self._lock:
+            if self.vectors is None:
+                dimension = len(next(iter(found.values())))
+                self.vectors = np.zeros((len(self.catalog), dimension), dtype=np.float32)
+            found_rows = np.searchsorted(self.catalog.ids, list(found))
+            self.vectors[found_rows] = np.vstack(list(found.values()))
+            self.has_vector[found_rows] = True
+
+
+class ShardServer(FramedServer):
+    """Шард: фильмы с id из id_range и их эмбеддинги в памяти процесса."""
+
+    def __init__(self, database, address, id_range=(None, None), authkey=None):
+        super().__init__(address, authkey)
+        self.database = str(database)
+        self.id_range = tuple(id_range)
+        self._index = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self):
+        # Соединение SQLite на поток обработки
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.database)
+        return conn
+
+    def index(self, conn, model):
+        """_ShardIndex для текущей версии каталога и модели; перезагружается при их смене."""
+        version = catalog_version(conn)
+        index = self._index
+        if index is not None and index.catalog.version == version and index.model == model:
+            return index
+        with self._lock:
+            index = self._index
+            if index is None or index.catalog.version != version or index.model != model:
+                index = _ShardIndex(Catalog.load(conn, version, self.id_range), model)
+                index.load_vectors(conn)
+                self._index = index
+            return index
+
+    def _handle_request(self, conn, request):
+        targets = np.frombuffer(conn.recv_bytes(), dtype=np.float32).reshape(request['shape'])
+        try:
+            reply = self.search(targets, request)
+        except Exception as e:
+            self._reply(conn, {'error': 'error', 'message': str(e)})
+            return
+        self._reply(conn, reply)
+
+    def search(self, targets, request):
+        """Локальный top-k кандидатов шарда по итоговому скору."""
+        db = self._connection()
+        index = self.index(db, request['model'])
+        catalog = index.catalog
+        actor_movies = None
+        if request.get('actor_movies') is not None:
+            actor_movies = {movie_id: names for movie_id, names in request['actor_movies']}
+
+        rows = catalog.genre_candidates(
+            request['genre'], catalog.rows_for_ids(actor_movies) if actor_movies is not None else None
+        )
+        # Векторы, которые фронт сохранил после прошлых запросов
+        if not index.has_vector[rows].all():
+            index.load_vectors(db, rows[~index.has_vector[rows]])
+        have = index.has_vector[rows]
+        missing = catalog.ids[rows[~have]].tolist()
+        rows = rows[have]
+        if not len(rows):
+            return {'ids': [], 'scores': [], 'candidates': len(missing), 'missing': missing}
+
+        ids = catalog.ids[rows]
+        similarity = score_candidates(targets, index.vectors[rows], request['weights'])
+        matched_actors = [actor_movies[movie_id] for movie_id in ids.tolist()] if actor_movies else []
+        features = catalog.features_for(rows)
+        scores = blend_scores(similarity, matched_actors, features,
+                              np.asarray(request['blend_weights'], dtype=np.float64))
+        best = top_k(scores, request['k'])
+        return {
+            'ids': ids[best].tolist(),
+            'scores': scores[best].tolist(),
+            'candidates': len(rows) + len(missing),
+            'missing': missing,
+        }
+
+
+class ShardClient(FramedClient):
+    error = ShardUnavailable
+
+    def search(self, request, targets, timeout=None):
+        return self._request(request, timeout, np.ascontiguousarray(targets, dtype=np.float32).tobytes())[0]
+
+
+class SearchResult:
+    """Слитый top-k: ids и scores по убыванию, число кандидатов, не ответившие шарды [(шард, причина)]."""
+
+    def __init__(self, ids, scores, candidates, failed):
+        self.ids = ids
+        self.scores = scores
+        self.candidates = candidates
+        self.failed = failed
+
+
+class ShardedSearch:
+    """Фронт: рассылка запроса по шардам и слияние их top-k."""
+
+    def __init__(self, addresses, timeout=TIMEOUT, authkey=None):
+        self.clients = [ShardClient(address, timeout, authkey) for address in addresses]
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.clients),
+                                            thread_name_prefix='shard-search')
+
+    def search(self, targets, weights, blend_weights, genre, actor_movies, k, model,
+               timeout=None, score_missing=None):
+        """
+        Top-k фильмов по всем шардам.
+
+        actor_movies - {id фильма: имена актеров} или None, score_missing(ids) -
+        итоговые скоры фильмов, для которых у шардов нет векторов. timeout
+        (остаток дедлайна) ограничивает ожидание каждого шарда сверх self.timeout.
+        Бросает ShardUnavailable, если не ответил ни один шард.
+        """
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        targets = np.asarray(targets, dtype=np.float32)
+        request = {
+            'shape': list(targets.shape),
+            'weights': np.asarray(weights).tolist(),
+            'blend_weights': np.asarray(blend_weights).tolist(),
+            'genre': genre,
+            'actor_movies': list(actor_movies.items()) if actor_movies is not None else None,
+            'k': k,
+            'model': model,
+        }
+        futures = [self._executor.submit(client.search, request, targets, timeout) for client in self.clients]
+        done, _ = wait(futures, timeout)
+
+        chunks, failed, missing, candidates = [], [], [], 0
+        for shard, future in enumerate(futures):
+            if future not in done:
+                failed.append((shard, 'timeout'))
+                continue
+            try:
+                reply = future.result()
+            except ShardUnavailable as e:
+                failed.append((shard, e.reason))
+                continue
+            chunks.append((None, reply['ids'], reply['scores']))
+            candidates += reply['candidates']
+            missing.extend(reply['missing'])
+        if not chunks:
+            raise ShardUnavailable(failed[0][1] if failed else 'unavailable', 'No shard answered')
+
+        if missing and score_missing is not None:
+            chunks.append((None, missing, score_missing(missing)))
+        ids, scores = top_k_merge(chunks, k)
+        return SearchResult(ids, scores, candidates, failed)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def _serve(database, address, id_range, authkey):
+    server = ShardServer(database, address, id_range, authkey)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.close()
+
+
+def main():
+    import multiprocessing
+    import sys
+
+    sys.path.append(str(Path(__file__).parent.parent / "database"))
+    from db import DB_PATH, migrate
+
+    parser = argparse.ArgumentParser(description="Локальные шарды векторного поиска")
+    parser.add_argument('--database', default=DB_PATH)
+    parser.add_argument('--shards', type=int, default=os.cpu_count())
+    parser.add_argument('--socket-dir', default='/tmp/movies-shards')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.database)
+    migrate(conn)
+    ranges = shard_ranges(conn, args.shards)
+    conn.close()
+
+    # Тот же ключ, что у воркера инференса: API передает его обоим клиентам
+    authkey = os.environ.get('INFERENCE_AUTHKEY')
+    os.makedirs(args.socket_dir, exist_ok=True)
+    processes = []
+    for shard, id_range in enumerate(ranges):
+        address = os.path.join(args.socket_dir, f'shard-{shard}.sock')
+        process = multiprocessing.Process(target=_serve, args=(args.database, address, id_range,
+                                                                     authkey.encode('utf-8') if authkey else None))
+        process.start()
+        processes.append((process, address))
+        print(f"Shard {shard} ids [{id_range[0]}, {id_range[1]}) listening on {address}")
+    print("SEARCH_SHARDS=" + ','.join(address for _, address in processes))
+    try:
+        for process, _ in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process, _ in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()
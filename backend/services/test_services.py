@@ -0,0 +1,1031 @@
+import unittest
+import json
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+import encoders
+from embedding_store import EmbeddingStore
+from omdb_client import OmdbClient, OmdbError
+from ingestion import IngestionWorker, omdb_to_movie, upsert_movies
+from features import FEATURE_NAMES, MISSING, FeatureStore, movie_features, parse_year
+from recommender import SIGNALS, blend_scores, lexical_scores, score_candidates, score_weights
+from inference import InferenceClient, InferenceServer, InferenceUnavailable
+from gazetteer import ActorGazetteer, ActorIndex
+from catalog import Catalog, CatalogIndex
+from shards import ShardServer, ShardedSearch, shard_ranges
+from feeds import FeedScheduler, read_feed, stale_users
+from clusters import ClusterIndex, MiniBatchKMeans, evaluate
+from gazetteer import catalog_version
+from diversity import mmr
+
+sys.path.append(str(Path(__file__).parent.parent / "database"))
+import db
+from topk import top_k, top_k_merge
+
+
+def _build_tiny_sentence_transformer(path):
+    """Собирает маленькую случайную BERT-модель в формате SentenceTransformer (без сети)."""
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+    from sentence_transformers import SentenceTransformer, models
+
+    words = ("the a movie film about space war love story hero with and "
+             "dream thief secret computer hacker reality").split()
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words + ["##s", "##ing"]
+
+    bert_dir = path / "bert"
+    bert_dir.mkdir()
+    (bert_dir / "vocab.txt").write_text("\n".join(vocab))
+    BertTokenizerFast(str(bert_dir / "vocab.txt")).save_pretrained(str(bert_dir))
+    config = BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=64)
+    BertModel(config).save_pretrained(str(bert_dir))
+
+    transformer = models.Transformer(str(bert_dir), max_seq_length=encoders.MAX_SEQ_LENGTH)
+    st_model = SentenceTransformer(modules=[
+        transformer,
+        models.Pooling(config.hidden_size, "mean"),
+        models.Normalize(),
+    ])
+    st_model.save(str(path / "st"))
+    return path / "st"
+
+
+class TestOnnxEncoder(unittest.TestCase):
+    TEXTS = [
+        "A computer hacker learns about reality",
+        "A thief steals secrets through dreams",
+        "love story",
+        "",
+        "a space war movie with a hero and a secret about the film",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            import onnxruntime  # noqa: F401
+            import sentence_transformers  # noqa: F401
+        except ImportError as e:
+            raise unittest.SkipTest(f"ONNX export dependencies are not installed: {e}")
+
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        tmp_path = Path(cls.tmp_dir.name)
+        cls.model_path = _build_tiny_sentence_transformer(tmp_path)
+        cls.onnx_dir = tmp_path / "onnx"
+        encoders.export_onnx(cls.onnx_dir, str(cls.model_path), quantize=True)
+        cls.reference = encoders.SentenceTransformerEncoder(str(cls.model_path))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def assertCosineClose(self, expected, actual, tolerance):
+        cos = (expected * actual).sum(axis=1) / (
+            np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+        self.assertGreaterEqual(cos.min(), 1 - tolerance)
+
+    def test_fp32_matches_sentence_transformer(self):
+        onnx_encoder = encoders.OnnxEncoder(self.onnx_dir)
+        expected = self.reference.encode(self.TEXTS)
+        actual = onnx_encoder.encode(self.TEXTS, batch_size=2)
+
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertCosineClose(expected, actual, 1e-4)
+
+    def test_int8_matches_sentence_transformer(self):
+        onnx_encoder = encoders.OnnxEncoder(self.onnx_dir, quantized=True)
+        expected = self.reference.encode(self.TEXTS)
+        actual = onnx_encoder.encode(self.TEXTS)
+
+        self.assertCosineClose(expected, actual, 2e-2)
+
+    def test_single_text_returns_vector(self):
+        onnx_encoder = encoders.OnnxEncoder(self.onnx_dir)
+        vector = onnx_encoder.encode("love story")
+
+        self.assertEqual(vector.ndim, 1)
+        self.assertAlmostEqual(float(np.linalg.norm(vector)), 1.0, places=5)
+
+    def test_create_encoder_selects_backend(self):
+        config = {'ENCODER_BACKEND': 'onnx', 'ONNX_MODEL_DIR': self.onnx_dir}
+        encoder = encoders.create_encoder(config)
+        self.assertIsInstance(encoder, encoders.OnnxEncoder)
+        self.assertEqual(encoder.name, 'all-MiniLM-L6-v2/onnx-fp32')
+        quantized = encoders.create_encoder(dict(config, ONNX_QUANTIZED=True))
+        self.assertEqual(quantized.name, 'all-MiniLM-L6-v2/onnx-int8')
+
+        with self.assertRaises(ValueError):
+            encoders.create_encoder({'ENCODER_BACKEND': 'tensorflow'})
+
+
+class TestHashingEncoder(unittest.TestCase):
+    def test_deterministic_and_normalized(self):
+        encoder = encoders.HashingEncoder()
+        first = encoder.encode(["A space war movie", "love story"])
+        second = encoder.encode(["A space war movie", "love story"])
+
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-6)
+        self.assertEqual(first.shape, (2, encoders.EMBEDDING_DIM))
+
+
+class TestLazyEncoder(unittest.TestCase):
+    def test_created_once_on_first_use(self):
+        created = []
+
+        def factory():
+            created.append(encoders.HashingEncoder())
+            return created[-1]
+
+        encoder = encoders.LazyEncoder(factory)
+        self.assertFalse(encoder.loaded)
+        self.assertEqual(created, [])
+
+        vectors = encoder.encode(["space war", "love story"])
+        self.assertEqual(encoder.name, created[0].name)
+        encoder.encode("space war")
+        self.assertEqual(len(created), 1)
+        np.testing.assert_array_equal(vectors, created[0].encode(["space war", "love story"]))
+
+
+class CountingEncoder(encoders.HashingEncoder):
+    def __init__(self):
+        super().__init__()
+        self.encoded = []
+
+    def encode(self, texts, batch_size=32):
+        self.encoded.extend(texts)
+        return super().encode(texts, batch_size)
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        db.migrate(self.conn)
+        self.conn.executemany(
+            "INSERT INTO movies (id, title, overview) VALUES (?, ?, ?)",
+            [(1, "Alien", "space horror"), (2, "Heat", "bank robbery"), (3, "Up", "balloon house")]
+        )
+        self.encoder = CountingEncoder()
+        self.store = EmbeddingStore(self.encoder)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_vectors_are_computed_once(self):
+        first = self.store.get(self.conn, [3, 1])
+        second = self.store.get(self.conn, [1, 3, 2])
+
+        self.assertEqual(self.encoder.encoded, ["balloon house", "space horror", "bank robbery"])
+        np.testing.assert_allclose(first, self.encoder.encode(["balloon house", "space horror"]), rtol=1e-6)
+        np.testing.assert_array_equal(second[[1, 0]], first)
+
+    def test_other_model_is_recomputed(self):
+        self.store.get(self.conn, [1])
+        other = EmbeddingStore(encoders.HashingEncoder(dim=16))
+
+        self.assertEqual(other.get(self.conn, [1]).shape, (1, 16))
+        self.assertEqual(other.backfill(self.conn), 2)
+        self.assertEqual(other.backfill(self.conn), 0)
+
+
+class TestFeatures(unittest.TestCase):
+    def test_movie_features_are_normalized(self):
+        self.assertEqual(parse_year('2014-11-07'), 2014)
+        self.assertEqual(parse_year('03/02/2023'), 2023)
+        self.assertIsNone(parse_year('soon'))
+
+        rating, recency, popularity = movie_features(86.0, '2014-11-07', None, 7e8, current_year=2024)
+        self.assertAlmostEqual(rating, 0.86)
+        self.assertAlmostEqual(recency, 114 / 124)
+        self.assertTrue(0.8 < popularity < 1.0)
+        self.assertEqual(movie_features(None, None, None, None), (MISSING,) * len(FEATURE_NAMES))
+
+    def test_store_is_aligned_with_ids(self):
+        conn = sqlite3.connect(":memory:")
+        db.migrate(conn)
+        conn.executemany("INSERT INTO movies (id, title, score) VALUES (?, ?, ?)",
+                         [(1, "A", 20.0), (2, "B", 90.0)])
+        matrix = FeatureStore().get(conn, [2, 1, 3])
+        conn.close()
+
+        self.assertEqual(matrix.shape, (3, len(FEATURE_NAMES)))
+        np.testing.assert_allclose(matrix[:, 0], [0.9, 0.2, MISSING], rtol=1e-6)
+
+    def test_backfill(self):
+        conn = sqlite3.connect(":memory:")
+        db.migrate(conn)
+        conn.executemany("INSERT INTO movies (id, title, score) VALUES (?, ?, ?)",
+                         [(1, "A", 20.0), (2, "B", 90.0), (3, "C", None)])
+        conn.execute("INSERT INTO movie_features VALUES (2, 0.1, 0.1, 0.1)")
+        store = FeatureStore()
+
+        self.assertEqual(store.backfill(conn, batch_size=1), 2)
+        self.assertEqual(store.backfill(conn), 0)
+        self.assertEqual(store.load(conn, [1, 2])[2], (0.1, 0.1, 0.1))
+        conn.close()
+
+    def test_blend_matches_per_row_formula(self):
+        rng = np.random.default_rng(0)
+        similarity = rng.random(50, dtype=np.float32)
+        features = rng.random((50, len(FEATURE_NAMES)), dtype=np.float32)
+        matched = [['Actor'] * (i % 3) for i in range(50)]
+        weights = score_weights({'rating': 0.3})
+
+        blended = blend_scores(similarity, matched, features, weights)
+        expected = [
+            weights[0] * similarity[i] + weights[1] * len(matched[i]) + features[i] @ weights[2:]
+            for i in range(50)
+        ]
+        np.testing.assert_allclose(blended, expected, rtol=1e-5)
+        self.assertEqual(len(weights), len(SIGNALS))
+        with self.assertRaises(ValueError):
+            score_weights({'budget': 1.0})
+
+
+class TestMMR(unittest.TestCase):
+    def test_lambda_one_is_top_k(self):
+        rng = np.random.default_rng(1)
+        embeddings = rng.normal(size=(500, 16))
+        scores = rng.random(500)
+        np.testing.assert_array_equal(mmr(embeddings, scores, 20, lambda_=1.0), top_k(scores, 20))
+
+    def test_near_duplicates_are_spread(self):
+        # 0 и 1 - почти одинаковые (сиквел), 2 - другой фильм чуть ниже по скору
+        embeddings = np.array([[1.0, 0.0], [0.99, 0.01], [0.0, 1.0], [0.7, 0.7]])
+        scores = np.array([0.9, 0.89, 0.8, 0.1])
+
+        self.assertEqual(list(mmr(embeddings, scores, 3, lambda_=0.5)), [0, 2, 1])
+        self.assertEqual(list(mmr(embeddings, scores, 3, lambda_=1.0)), [0, 1, 2])
+
+    def test_pool_limits_candidates(self):
+        rng = np.random.default_rng(2)
+        scores = rng.random(1000)
+        result = mmr(rng.normal(size=(1000, 8)), scores, 10, lambda_=0.3, pool_size=50)
+        self.assertTrue(set(result) <= set(top_k(scores, 50)))
+        self.assertEqual(len(set(result)), 10)
+
+
+class BlockingEncoder(encoders.HashingEncoder):
+    """Кодирует только после release.set() - имитация занятой модели."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def encode(self, texts, batch_size=32):
+        self.release.wait()
+        return super().encode(texts, batch_size)
+
+
+class TestInference(unittest.TestCase):
+    def start_server(self, encoder, **kwargs):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        server = InferenceServer(encoder, Path(tmp.name) / "inference.sock", **kwargs)
+        ready = threading.Event()
+        threading.Thread(target=server.serve_forever, args=(ready,), daemon=True).start()
+        ready.wait()
+        self.addCleanup(server.close)
+        return server
+
+    def test_encodes_like_local_encoder(self):
+        encoder = encoders.HashingEncoder()
+        server = self.start_server(encoder)
+        client = InferenceClient(server.address)
+
+        texts = ["A space war movie", "love story", "space love"]
+        np.testing.assert_allclose(client.encode(texts), encoder.encode(texts), rtol=1e-6)
+        np.testing.assert_allclose(client.encode("love story"), encoder.encode("love story"), rtol=1e-6)
+        self.assertEqual(client.name, encoder.name)
+
+    def test_concurrent_requests_are_batched(self):
+        encoder = encoders.HashingEncoder()
+        calls = []
+        original = encoder.encode
+        encoder.encode = lambda texts, batch_size=32: calls.append(len(texts)) or original(texts)
+        server = self.start_server(encoder, max_wait=0.2)
+        client = InferenceClient(server.address)
+
+        results = [None] * 4
+        def worker(i):
+            results[i] = client.encode([f"movie {i}", "space"])
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sum(calls), 8)
+        self.assertLess(len(calls), 4)
+        for i, result in enumerate(results):
+            np.testing.assert_allclose(result, encoders.HashingEncoder().encode([f"movie {i}", "space"]),
+                                       rtol=1e-6)
+
+    def test_timeout_and_overload(self):
+        encoder = BlockingEncoder()
+        self.addCleanup(encoder.release.set)
+        server = self.start_server(encoder, max_wait=0, max_pending=1)
+
+        with self.assertRaises(InferenceUnavailable) as timeout:
+            InferenceClient(server.address, timeout=0.1).encode(["first"])
+        self.assertEqual(timeout.exception.reason, 'timeout')
+
+        # Первый запрос занят в модели, второй ждет в очереди - третий не помещается
+        with self.assertRaises(InferenceUnavailable):
+            InferenceClient(server.address, timeout=0.1).encode(["second"])
+        with self.assertRaises(InferenceUnavailable) as overloaded:
+            InferenceClient(server.address, timeout=1).encode(["third"])
+        self.assertEqual(overloaded.exception.reason, 'overloaded')
+
+    def test_authkey(self):
+        server = self.start_server(encoders.HashingEncoder(), authkey=b'secret')
+
+        self.assertEqual(InferenceClient(server.address, authkey=b'secret').encode(["space"]).shape[0], 1)
+        with self.assertRaises(InferenceUnavailable) as unauthorized:
+            InferenceClient(server.address, authkey=b'other').encode(["space"])
+        self.assertEqual(unauthorized.exception.reason, 'unauthorized')
+        with self.assertRaises(InferenceUnavailable) as unauthorized:
+            InferenceClient(server.address, timeout=1).encode(["space"])
+        self.assertEqual(unauthorized.exception.reason, 'unauthorized')
+        # Отказ одному клиенту не останавливает сервер
+        self.assertEqual(InferenceClient(server.address, authkey=b'secret').encode(["love"]).shape[0], 1)
+
+    def test_worker_not_running(self):
+        with self.assertRaises(InferenceUnavailable) as unavailable:
+            InferenceClient("/nonexistent/inference.sock").encode(["space"])
+        self.assertEqual(unavailable.exception.reason, 'unavailable')
+
+
+class TestLexicalScores(unittest.TestCase):
+    def test_word_overlap_ranking(self):
+        overviews = ["A war in deep space", "A quiet love story", "", "Space pirates at war in space"]
+        scores = lexical_scores(["space war movie"], overviews, [1.0])
+
+        self.assertEqual(scores.shape, (4,))
+        self.assertEqual(scores[1], 0)
+        self.assertEqual(scores[2], 0)
+        self.assertGreater(scores[0], scores[1])
+        self.assertGreater(scores[3], scores[1])
+
+
+class TestGazetteer(unittest.TestCase):
+    ROWS = [
+        (1, json.dumps({'Actors': 'Keanu Reeves, Laurence Fishburne, Carrie-Anne Moss'})),
+        (2, json.dumps({'Actors': 'Robert Downey Jr., Gwyneth Paltrow'})),
+        (3, 'Robert Downey, Himself, Penélope Cruz, Raimunda'),
+        (4, json.dumps({'Actors': 'Keanu Reeves, Madonna'})),
+        (5, 'not json {'),
+    ]
+
+    def test_finds_names_in_any_phrasing(self):
+        gazetteer = ActorGazetteer.build(self.ROWS)
+
+        self.assertEqual(gazetteer.find("keanu reeves and carrie anne moss in a hacker movie"),
+                         ['Keanu Reeves', 'Carrie-Anne Moss'])
+        self.assertEqual(gazetteer.find("Something like Penelope Cruz's early films"), ['Penélope Cruz'])
+        # Более короткое имя внутри длинного не засчитывается, однословные имена не индексируются
+        self.assertEqual(gazetteer.find("Robert Downey Jr. as a genius"), ['Robert Downey Jr.'])
+        self.assertEqual(gazetteer.find("Robert Downey at home"), ['Robert Downey'])
+        self.assertEqual(gazetteer.find("a Madonna concert about Keanu"), [])
+
+    def test_movies_for_uses_postings(self):
+        gazetteer = ActorGazetteer.build(self.ROWS)
+        movies = gazetteer.movies_for(['Keanu Reeves', 'Carrie-Anne Moss'])
+
+        self.assertEqual(movies, {1: ['Keanu Reeves', 'Carrie-Anne Moss'], 4: ['Keanu Reeves']})
+        restored = ActorGazetteer.loads(gazetteer.dumps())
+        self.assertEqual(restored.movies_for(restored.find("KEANU REEVES")), {1: ['Keanu Reeves'], 4: ['Keanu Reeves']})
+
+    def test_index_follows_catalog_version(self):
+        conn = sqlite3.connect(":memory:")
+        self.addCleanup(conn.close)
+        db.migrate(conn)
+        conn.execute("INSERT INTO movies (id, title, crew) VALUES (1, 'The Matrix', ?)", (self.ROWS[0][1],))
+        conn.commit()
+
+        index = ActorIndex()
+        first = index.get(conn)
+        self.assertIs(index.get(conn), first)
+        self.assertEqual(first.find("Keanu Reeves"), ['Keanu Reeves'])
+
+        conn.execute("UPDATE movies SET crew = ? WHERE id = 1", (self.ROWS[1][1],))
+        conn.commit()
+        updated = index.get(conn)
+        self.assertIsNot(updated, first)
+        self.assertEqual(updated.find("Keanu Reeves with Gwyneth Paltrow"), ['Gwyneth Paltrow'])
+
+        # Новый процесс загружает сохраненный автомат, а не строит его
+        restored = ActorIndex().load(conn, updated.version)
+        self.assertEqual(restored.names, updated.names)
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        db.migrate(self.conn)
+        self.conn.executemany(
+            "INSERT INTO movies (id, title, overview, genre, score) VALUES (?, ?, ?, ?, ?)",
+            [(3, 'Amélie', 'A shy waitress in Paris', 'Comedy,\xa0Romance', 83.0),
+             (7, 'Alien', 'A deadly lifeform', 'Horror,\xa0Science Fiction', None),
+             (9, 'Aliens', '', 'Science Fiction', 80.0),
+             (12, 'Heat', 'Cops and robbers', 'Crime', 79.0)]
+        )
+        self.conn.execute("INSERT INTO movie_features VALUES (3, 0.8, 0.1, 0.5)")
+        self.conn.commit()
+
+    def test_columns_and_genre_candidates(self):
+        catalog = Catalog.load(self.conn)
+
+        self.assertEqual(catalog.ids.tolist(), [3, 7, 9, 12])
+        self.assertEqual(catalog.text('title', 0), 'Amélie')
+        self.assertEqual((catalog.score(0), catalog.score(1)), (83.0, None))
+        # Как LIKE '%genre%' без учета регистра; фильмы без описания не кандидаты
+        self.assertEqual(catalog.genre_candidates('science').tolist(), [1])
+        self.assertEqual(catalog.genre_candidates('o').tolist(), [0, 1])
+        self.assertEqual(len(catalog.genre_candidates('Western')), 0)
+
+        rows = catalog.rows_for_ids([12, 3, 5])
+        self.assertEqual(rows.tolist(), [0, 3])
+        self.assertEqual(catalog.genre_candidates('crime', rows).tolist(), [3])
+
+    def test_missing_features_are_computed_in_snapshot(self):
+        catalog = Catalog.load(self.conn)
+
+        features = catalog.features_for(np.array([0, 3]))
+        np.testing.assert_allclose(features, [[0.8, 0.1, 0.5], movie_features(79.0, None, None, None)], rtol=1e-6)
+        # Снимок не пишет в базу
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM movie_features").fetchone()[0], 1)
+
+    def test_index_follows_catalog_version(self):
+        index = CatalogIndex()
+        first = index.get(self.conn)
+        self.assertIs(index.get(self.conn), first)
+
+        self.conn.execute("UPDATE movies SET overview = 'Heist' WHERE id = 9")
+        self.conn.commit()
+        updated = index.get(self.conn)
+        self.assertIsNot(updated, first)
+        self.assertEqual(updated.genre_candidates('science').tolist(), [1, 2])
+
+    def test_embeddings_are_in_snapshot(self):
+        store = EmbeddingStore(CountingEncoder())
+        stored = store.get(self.conn, [3, 7])
+        catalog = CatalogIndex(store).get(self.conn)
+        self.assertEqual(catalog.model, store.encoder.name)
+        requested = []
+
+        def compute(movie_ids):
+            requested.append(movie_ids)
+            return store.get(self.conn, movie_ids)
+
+        embeddings = catalog.embeddings_for(np.array([0, 1, 3]), compute)
+        self.assertEqual(requested, [[12]])
+        np.testing.assert_array_equal(embeddings[:2], stored)
+        np.testing.assert_array_equal(embeddings[2], store.encoder.encode('Cops and robbers'))
+        # Досчитанный вектор остается в снимке - повторный запрос не идет в базу
+        np.testing.assert_array_equal(catalog.embeddings_for(np.array([0, 1, 3]), compute), embeddings)
+        self.assertEqual(requested, [[12]])
+
+    def test_snapshot_without_stored_embeddings_keeps_computed(self):
+        store = EmbeddingStore(CountingEncoder())
+        catalog = CatalogIndex(store).get(self.conn)
+        self.assertIsNone(catalog.embeddings)
+        requested = []
+
+        def compute(movie_ids):
+            requested.append(movie_ids)
+            return store.get(self.conn, movie_ids)
+
+        first = catalog.embeddings_for(np.array([0, 3]), compute)
+        second = catalog.embeddings_for(np.array([0, 1, 3]), compute)
+        self.assertEqual(requested, [[3, 12], [7]])
+        np.testing.assert_array_equal(second[[0, 2]], first)
+
+    def test_rebuild_in_background_serves_previous_snapshot(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "catalog.db"
+        conn = sqlite3.connect(path)
+        self.addCleanup(conn.close)
+        self.conn.backup(conn)
+        index = CatalogIndex(connect=lambda: sqlite3.connect(path))
+        first = index.get(conn)
+
+        conn.execute("UPDATE movies SET overview = 'Heist' WHERE id = 9")
+        conn.commit()
+        self.assertIs(index.get(conn), first)
+        for _ in range(100):
+            if not index.building:
+                break
+            time.sleep(0.01)
+        updated = index.get(conn)
+        self.assertEqual(updated.version, catalog_version(conn))
+        self.assertEqual(updated.genre_candidates('science').tolist(), [1, 2])
+
+
+class TestShards(unittest.TestCase):
+    GENRES = ['Drama', 'Comedy,\xa0Drama', 'Horror']
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp_dir = Path(tmp.name)
+        self.db_path = self.tmp_dir / "shards.db"
+        self.conn = sqlite3.connect(self.db_path)
+        self.addCleanup(self.conn.close)
+        db.migrate(self.conn)
+        words = ['space', 'love', 'war', 'heist', 'ghost', 'family', 'robot', 'ocean']
+        self.conn.executemany(
+            "INSERT INTO movies (id, title, overview, genre, score) VALUES (?, ?, ?, ?, ?)",
+            [(i, f'Movie {i}', f'{words[i % 8]} {words[i * 3 % 8]} story {i}', self.GENRES[i % 3], i % 90)
+             for i in range(1, 61)]
+        )
+        self.conn.commit()
+        self.encoder = encoders.HashingEncoder()
+        self.store = EmbeddingStore(self.encoder)
+        self.targets = self.encoder.encode(["a love story in space", "robot war"])
+        self.weights = np.array([0.6, 0.4])
+        self.blend_weights = score_weights()
+
+    def start_shards(self, count):
+        addresses = []
+        for shard, id_range in enumerate(shard_ranges(self.conn, count)):
+            server = ShardServer(self.db_path, self.tmp_dir / f"shard-{shard}.sock", id_range)
+            ready = threading.Event()
+            threading.Thread(target=server.serve_forever, args=(ready,), daemon=True).start()
+            ready.wait()
+            self.addCleanup(server.close)
+            addresses.append(server.address)
+        return addresses
+
+    def expected(self, k):
+        catalog = Catalog.load(self.conn)
+        rows = catalog.genre_candidates('drama')
+        ids = catalog.ids[rows].tolist()
+        similarity = score_candidates(self.targets, self.store.get(self.conn, ids), self.weights)
+        scores = blend_scores(similarity, [], FeatureStore().get(self.conn, ids), self.blend_weights)
+        return [ids[i] for i in top_k(scores, k)], len(ids)
+
+    def search(self, sharded, k=5, **kwargs):
+        return sharded.search(self.targets, self.weights, self.blend_weights, 'drama', None, k,
+                              self.encoder.name, **kwargs)
+
+    def test_ranges_split_catalog(self):
+        ranges = shard_ranges(self.conn, 3)
+        self.assertEqual(ranges, [(None, 21), (21, 41), (41, None)])
+
+    def test_merged_top_k_matches_single_process(self):
+        expected, candidates = self.expected(5)
+        sharded = ShardedSearch(self.start_shards(3), timeout=5)
+        self.addCleanup(sharded.close)
+
+        result = self.search(sharded)
+        self.assertEqual(result.ids.tolist(), expected)
+        self.assertEqual((result.candidates, result.failed), (candidates, []))
+
+    def test_missing_vectors_are_scored_by_caller(self):
+        sharded = ShardedSearch(self.start_shards(2), timeout=5)
+        self.addCleanup(sharded.close)
+        requested = []
+
+        def score_missing(movie_ids):
+            requested.extend(movie_ids)
+            return 100.0 - np.asarray(movie_ids)
+
+        # В movie_embeddings еще пусто - шарды отдают всех кандидатов фронту
+        result = self.search(sharded, score_missing=score_missing)
+        self.assertEqual(len(requested), result.candidates)
+        self.assertEqual(result.ids.tolist(), sorted(requested)[:5])
+
+        # После сохранения векторов шарды считают сами
+        expected, _ = self.expected(5)
+        requested.clear()
+        self.assertEqual(self.search(sharded, score_missing=score_missing).ids.tolist(), expected)
+        self.assertEqual(requested, [])
+
+    def test_partial_result_when_shard_is_down(self):
+        self.expected(5)
+        addresses = self.start_shards(2)
+        sharded = ShardedSearch([addresses[0], self.tmp_dir / "down.sock"], timeout=5)
+        self.addCleanup(sharded.close)
+
+        result = self.search(sharded)
+        self.assertEqual(result.failed, [(1, 'unavailable')])
+        self.assertTrue(all(movie_id < 31 for movie_id in result.ids.tolist()))
+
+
+class TestFeeds(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = Path(tmp.name) / "feeds.db"
+        self.conn = sqlite3.connect(self.db_path)
+        self.addCleanup(self.conn.close)
+        db.migrate(self.conn)
+        self.conn.executemany(
+            "INSERT INTO movies (id, title, overview, genre, score) VALUES (?, ?, ?, ?, ?)",
+            [(1, 'Alien', 'space crew meets a deadly alien', 'Horror', 85.0),
+             (2, 'Aliens', 'space marines fight alien hive', 'Horror', 84.0),
+             (3, 'The Ring', 'cursed video tape ghost', 'Horror', 71.0),
+             (4, 'Notting Hill', 'a bookseller falls in love', 'Romance', 72.0)]
+        )
+        self.conn.execute("INSERT INTO users (user_id, login, password) VALUES (1, 'ripley', 'x')")
+        self.conn.execute("INSERT INTO similar_movies (user_id, movie_id, title) VALUES (1, 1, 'Alien')")
+        self.conn.commit()
+        self.scheduler = FeedScheduler(lambda: sqlite3.connect(self.db_path), CatalogIndex(),
+                                       EmbeddingStore(encoders.HashingEncoder()), score_weights())
+
+    def test_feed_ranks_profile_genres(self):
+        self.assertEqual(self.scheduler.run_once(), 1)
+        items, _, stale = read_feed(self.conn, 1)
+
+        self.assertFalse(stale)
+        # Только жанры профиля, без уже добавленного фильма; ближе по описанию - выше
+        self.assertEqual([m['title'] for m in json.loads(items)], ['Aliens', 'The Ring'])
+        self.assertIsNone(read_feed(self.conn, 2))
+
+    def test_refreshes_only_when_profile_or_catalog_changes(self):
+        self.scheduler.run_once()
+        self.assertEqual(self.scheduler.run_once(), 0)
+
+        self.conn.execute("INSERT INTO similar_movies (user_id, movie_id, title) VALUES (1, 4, 'Notting Hill')")
+        self.conn.commit()
+        self.assertTrue(read_feed(self.conn, 1)[2])
+        self.assertEqual(stale_users(self.conn, catalog_version(self.conn), 10), [1])
+        self.assertEqual(self.scheduler.run_once(), 1)
+        self.assertFalse(read_feed(self.conn, 1)[2])
+
+        # Изменение каталога пересчитывает ленту не раньше catalog_interval после прошлого расчета
+        self.conn.execute("UPDATE movies SET score = 90 WHERE id = 3")
+        self.conn.commit()
+        self.assertTrue(read_feed(self.conn, 1)[2])
+        self.scheduler.request(1)
+        self.assertEqual(self.scheduler.run_once(), 0)
+        self.scheduler.catalog_interval = 0
+        self.assertEqual(self.scheduler.run_once(), 1)
+        self.assertFalse(read_feed(self.conn, 1)[2])
+
+    def test_only_lease_owner_refreshes(self):
+        other = FeedScheduler(lambda: sqlite3.connect(self.db_path), CatalogIndex(),
+                              EmbeddingStore(encoders.HashingEncoder()), score_weights(), lease_ttl=0.2)
+        self.conn.execute("INSERT INTO users (user_id, login, password) VALUES (2, 'dallas', 'x')")
+        self.conn.commit()
+        self.assertEqual(other.run_once(), 1)
+
+        # Запрос к процессу без аренды передается владельцу через feed_requests
+        self.scheduler.request(2)
+        self.assertEqual(self.scheduler.run_once(), 0)
+        self.assertIsNone(read_feed(self.conn, 2))
+        self.assertEqual(other.run_once(), 1)
+        self.assertIsNotNone(read_feed(self.conn, 2))
+
+        # Владелец перестал продлевать аренду - ее забирает другой процесс
+        time.sleep(0.25)
+        self.conn.execute("INSERT INTO similar_movies (user_id, movie_id, title) VALUES (1, 4, 'Notting Hill')")
+        self.conn.commit()
+        self.assertEqual(self.scheduler.run_once(), 1)
+        self.assertEqual(other.run_once(), 0)
+
+
+class TestClusters(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.addCleanup(self.conn.close)
+        db.migrate(self.conn)
+        movies = [(1, 'Alien', 'space crew alien ship', 'Horror'),
+                  (2, 'Aliens', 'space marines alien hive', 'Horror'),
+                  (3, 'Prometheus', 'space crew alien engineers', 'Horror'),
+                  (4, 'Notting Hill', 'bookseller falls in love', 'Romance'),
+                  (5, 'Love Actually', 'london love stories christmas', 'Romance'),
+                  (6, 'Sleepless in Seattle', 'widower love radio show', 'Romance')]
+        self.conn.executemany("INSERT INTO movies (id, title, overview, genre) VALUES (?, ?, ?, ?)", movies)
+        self.conn.executemany("INSERT INTO users (user_id, login, password) VALUES (?, ?, 'x')",
+                              [(1, 'ripley'), (2, 'anna')])
+        self.conn.executemany("INSERT INTO similar_movies (user_id, movie_id, title) VALUES (?, ?, ?)",
+                              [(1, 1, 'Alien'), (2, 4, 'Notting Hill')])
+        self.conn.commit()
+        self.store = EmbeddingStore(encoders.HashingEncoder())
+        self.catalog_index = CatalogIndex()
+        self.index = ClusterIndex(n_clusters=2, pool_size=2)
+
+    def test_kmeans_separates_groups(self):
+        rng = np.random.default_rng(0)
+        vectors = np.vstack([[1, 0, 0] + 0.05 * rng.standard_normal((20, 3)),
+                             [0, 0, 1] + 0.05 * rng.standard_normal((20, 3))])
+        assigned = MiniBatchKMeans.fit(vectors, 2, batch_size=8, iterations=20).predict(vectors)[:, 0]
+
+        self.assertEqual(len(set(assigned[:20])), 1)
+        self.assertEqual(len(set(assigned[20:])), 1)
+        self.assertNotEqual(assigned[0], assigned[20])
+
+    def test_pools_follow_taste(self):
+        self.assertEqual(self.index.update(self.conn, self.store, self.catalog_index), 2)
+        clusters = self.index.get(self.conn)
+        catalog = self.catalog_index.get(self.conn)
+        taste = self.store.get(self.conn, [1])[0]
+
+        self.assertEqual(sorted(clusters.candidate_ids(taste, 1)), [1, 3])
+        # Фильм новее кластеризации попадает в кандидаты, хотя его нет в пулах
+        self.conn.execute("INSERT INTO movies (id, title, overview, genre) VALUES (7, 'Alien 3', 'prison', 'Horror')")
+        self.conn.commit()
+        catalog = self.catalog_index.get(self.conn)
+        rows = catalog.genre_candidates('Horror')
+        self.assertEqual(catalog.ids[clusters.restrict(catalog, rows, taste, 1)].tolist(), [1, 3, 7])
+        # Список фильмов, ближайших к описанию запроса, добавляется к пулам
+        query = self.store.get(self.conn, [2])[0]
+        self.assertIn(2, clusters.movie_lists.candidate_ids(query, 1).tolist())
+        restricted = clusters.restrict(catalog, rows, taste, 1, query=query, n_query_probe=1)
+        self.assertEqual(catalog.ids[restricted].tolist(), [1, 2, 3, 7])
+
+    def test_incremental_update(self):
+        self.index.update(self.conn, self.store, self.catalog_index)
+        revision = self.index.get(self.conn).revision
+        lists = self.index.get(self.conn).movie_lists.ids
+        self.assertEqual(self.index.update(self.conn, self.store, self.catalog_index), 0)
+
+        self.conn.execute("INSERT INTO similar_movies (user_id, movie_id, title) VALUES (1, 5, 'Love Actually')")
+        self.conn.commit()
+        # Учитывается только изменившийся профиль
+        self.assertEqual(self.index.update(self.conn, self.store, self.catalog_index), 1)
+        self.assertNotEqual(self.index.get(self.conn).revision, revision)
+        # Каталог не менялся - списки фильмов не перестраиваются
+        np.testing.assert_array_equal(self.index.get(self.conn).movie_lists.ids, lists)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM user_taste_clusters").fetchone()[0], 2)
+
+    def test_recall_against_full_search(self):
+        self.index.update(self.conn, self.store, self.catalog_index)
+        report = evaluate(self.conn, self.index.get(self.conn), self.catalog_index.get(self.conn),
+                          self.store, [1, 2], 'Horror', ['space alien', 'love story'], k=2,
+                          n_query_probe=0)
+        self.assertEqual(report['users'], 2)
+        self.assertLess(report['candidate_fraction'], 1.0)
+
+        # Пулы на весь каталог - ответ совпадает с полным поиском
+        full = ClusterIndex(n_clusters=2, pool_size=6)
+        full.update(self.conn, self.store, self.catalog_index)
+        report = evaluate(self.conn, full.get(self.conn), self.catalog_index.get(self.conn),
+                          self.store, [1, 2], 'Horror', ['space alien', 'love story'], k=2)
+        self.assertEqual(report['recall_at_k'], 1.0)
+
+
+class TestTopK(unittest.TestCase):
+    def setUp(self):
+        self.scores = np.random.default_rng(42).random(1000)
+
+    def test_matches_full_sort(self):
+        expected = np.argsort(self.scores)[-20:][::-1]
+        np.testing.assert_array_equal(top_k(self.scores, 20), expected)
+
+    def test_k_larger_than_input(self):
+        np.testing.assert_array_equal(top_k([0.1, 0.3, 0.2], 10), [1, 2, 0])
+        self.assertEqual(len(top_k([], 5)), 0)
+
+    def test_tiebreak_matches_sorted(self):
+        scores = [0.5, 0.9, 0.5, 0.5, 0.1]
+        tiebreak = [0, 0, 2, 1, 5]
+        expected = sorted(range(5), key=lambda i: (scores[i], tiebreak[i]), reverse=True)[:3]
+        self.assertEqual(list(top_k(scores, 3, tiebreak=tiebreak)), expected)
+
+    def test_merge_matches_global_top_k(self):
+        chunks = [(None, np.arange(start, start + 100), self.scores[start:start + 100])
+                  for start in range(0, 1000, 100)]
+        indices, scores = top_k_merge(chunks, 20)
+
+        np.testing.assert_array_equal(indices, top_k(self.scores, 20))
+        np.testing.assert_allclose(scores, np.sort(self.scores)[-20:][::-1])
+
+    def test_merge_stops_on_upper_bound(self):
+        computed = []
+
+        def lazy_scores(offset, values):
+            def compute():
+                computed.append(offset)
+                return values
+            return compute
+
+        chunks = [
+            (2.0, [0, 1, 2], lazy_scores(0, [1.9, 1.5, 1.2])),
+            (1.0, [3, 4], lazy_scores(3, [0.9, 0.8])),
+            (0.5, [5], lazy_scores(5, [0.4])),
+        ]
+        indices, _ = top_k_merge(chunks, 2)
+
+        self.assertEqual(list(indices), [0, 1])
+        self.assertEqual(computed, [0])
+
+
+class FakeOmdb:
+    """Локальный сервер с ответами в формате OMDb, считает обращения."""
+
+    def __init__(self, delay=0.0):
+        self.calls = []
+        self.delay = delay
+        self.fail = False
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                fake.calls.append(params)
+                time.sleep(fake.delay)
+                if fake.fail:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                if params.get('i') == 'tt0000000':
+                    body = {'Response': 'False', 'Error': 'Incorrect IMDb ID.'}
+                else:
+                    body = {'Response': 'True', 'Title': 'Alien', 'imdbID': params.get('i', 'tt0078748')}
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestOmdbClient(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "omdb.db"
+        self.conn = self.connect()
+        db.migrate(self.conn)
+        self.fake = FakeOmdb()
+        self.client = OmdbClient(self.fake.url, 'test-key', not_found_ttl=0.2)
+
+    def tearDown(self):
+        self.fake.close()
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, check_same_thread=False)
+
+    def test_second_request_is_served_from_cache(self):
+        body, source = self.client.get(self.conn, {'i': 'tt0078748', 'plot': 'full'})
+        self.assertEqual(source, 'miss')
+        self.assertEqual(json.loads(body)['Title'], 'Alien')
+
+        _, source = self.client.get(self.conn, {'i': 'tt0078748', 'plot': 'FULL'})
+        self.assertEqual(source, 'hit')
+        self.assertEqual(len(self.fake.calls), 1)
+        self.assertEqual(self.fake.calls[0]['apikey'], 'test-key')
+
+    def test_not_found_is_cached_with_short_ttl(self):
+        self.client.get(self.conn, {'i': 'tt0000000'})
+        _, source = self.client.get(self.conn, {'i': 'tt0000000'})
+        self.assertEqual(source, 'hit')
+
+        time.sleep(0.25)
+        _, source = self.client.get(self.conn, {'i': 'tt0000000'})
+        self.assertEqual(source, 'miss')
+        self.assertEqual(len(self.fake.calls), 2)
+
+    def test_concurrent_requests_are_coalesced(self):
+        self.fake.delay = 0.3
+        sources = []
+
+        def fetch():
+            conn = self.connect()
+            sources.append(self.client.get(conn, {'s': 'alien', 'page': '1'})[1])
+            conn.close()
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.fake.calls), 1)
+        self.assertEqual(sorted(sources), ['coalesced'] * 7 + ['miss'])
+
+    def test_leader_error_reaches_coalesced_requests(self):
+        def fetch_fails(conn, key, params):
+            time.sleep(0.3)
+            raise sqlite3.OperationalError("database is locked")
+
+        self.client._fetch = fetch_fails
+        errors = []
+
+        def fetch():
+            conn = self.connect()
+            try:
+                self.client.get(conn, {'s': 'alien'})
+            except Exception as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+        threads = [threading.Thread(target=fetch) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(isinstance(e, OmdbError) for e in errors))
+        self.assertTrue(all('database is locked' in str(e) for e in errors))
+
+    def test_stale_entry_is_served_when_upstream_fails(self):
+        self.client.details_ttl = 0
+        self.client.get(self.conn, {'i': 'tt0078748'})
+        self.fake.fail = True
+
+        body, source = self.client.get(self.conn, {'i': 'tt0078748'})
+        self.assertEqual(source, 'stale')
+        self.assertEqual(json.loads(body)['Title'], 'Alien')
+        with self.assertRaises(OmdbError):
+            self.client.get(self.conn, {'i': 'tt0133093'})
+
+
+ALIEN_DETAILS = {
+    'Response': 'True', 'Type': 'movie', 'imdbID': 'tt0078748', 'Title': 'Alien',
+    'Released': '22 Jun 1979', 'imdbRating': '8.5', 'Genre': 'Horror, Sci-Fi',
+    'Plot': 'The crew of a commercial spacecraft encounters a deadly lifeform.',
+    'Actors': 'Sigourney Weaver, Tom Skerritt', 'Director': 'Ridley Scott',
+    'Language': 'English', 'Country': 'United Kingdom', 'BoxOffice': '$84,206,106',
+}
+
+
+class TestIngestion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self.tmp_dir.name) / "catalog.db"
+        self.conn = sqlite3.connect(self.db_path)
+        db.migrate(self.conn)
+        self.worker = IngestionWorker(lambda: sqlite3.connect(self.db_path),
+                                      EmbeddingStore(encoders.HashingEncoder()), flush_interval=0.05)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_omdb_to_movie(self):
+        movie = omdb_to_movie(ALIEN_DETAILS)
+        self.assertEqual(movie['date_x'], '1979-06-22')
+        self.assertEqual(movie['score'], 85.0)
+        self.assertEqual(movie['revenue'], 84206106.0)
+        self.assertEqual(json.loads(movie['crew'])['Actors'], 'Sigourney Weaver, Tom Skerritt')
+
+        self.assertIsNone(omdb_to_movie(dict(ALIEN_DETAILS, Plot='N/A')))
+        # Карточка без названия пропускается, а не роняет запрос к прокси
+        self.assertIsNone(omdb_to_movie({key: value for key, value in ALIEN_DETAILS.items() if key != 'Title'}))
+        self.assertIsNone(omdb_to_movie({'Response': 'False', 'Error': 'Movie not found!'}))
+
+    def test_upsert_deduplicates_by_imdb_id(self):
+        first = upsert_movies(self.conn, [omdb_to_movie(ALIEN_DETAILS)])
+        second = upsert_movies(self.conn, [omdb_to_movie(dict(ALIEN_DETAILS, imdbRating='8.4'))])
+
+        self.assertEqual(first, second)
+        rows = self.conn.execute("SELECT score FROM movies WHERE imdb_id = 'tt0078748'").fetchall()
+        self.assertEqual(rows, [(84.0,)])
+
+        # Та же карточка еще раз - строка не обновляется, кэш рекомендаций не сбрасывается
+        version = catalog_version(self.conn)
+        self.assertEqual(upsert_movies(self.conn, [omdb_to_movie(dict(ALIEN_DETAILS, imdbRating='8.4'))]), first)
+        self.assertEqual(catalog_version(self.conn), version)
+
+    def test_worker_stores_movies_with_embeddings(self):
+        self.assertTrue(self.worker.submit(ALIEN_DETAILS))
+        self.assertTrue(self.worker.submit(dict(ALIEN_DETAILS, imdbID='tt0090605', Title='Aliens')))
+        self.assertFalse(self.worker.submit({'Response': 'False'}))
+        self.worker.queue.join()
+
+        movies = self.conn.execute("SELECT COUNT(*) FROM movies").fetchone()[0]
+        vectors = self.conn.execute("SELECT COUNT(*) FROM movie_embeddings").fetchone()[0]
+        self.assertEqual((movies, vectors), (2, 2))
+
+    def test_cards_within_flush_interval_form_one_batch(self):
+        batches = []
+        self.worker._process = batches.append
+        self.worker.flush_interval = 0.3
+        self.worker.submit(ALIEN_DETAILS)
+        time.sleep(0.05)
+        self.worker.submit(dict(ALIEN_DETAILS, imdbID='tt0090605', Title='Aliens'))
+        self.worker.queue.join()
+
+        self.assertEqual([[movie['imdb_id'] for movie in batch] for batch in batches], [['tt0078748', 'tt0090605']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Отбор top-k кандидатов без полной сортировки.
+
+top_k выбирает k лучших через np.argpartition за O(n) и сортирует только их.
+top_k_merge сливает top-k по частям кандидатов через кучу и умеет досрочно
+останавливаться, если верхняя граница оставшихся частей не дотягивает до k-го
+результата.
+"""
+import heapq
+
+import numpy as np
+
+
+def top_k(scores, k, tiebreak=None):
+    """
+    Индексы k наибольших scores по убыванию.
+
+    tiebreak - необязательный второй ключ (больше - лучше) для равных scores,
+    аналог sorted(key=lambda x: (score, tiebreak), reverse=True).
+    """
+    scores = np.asarray(scores)
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+
+    if k >= n:
+        candidates = np.arange(n)
+    elif tiebreak is None:
+        candidates = np.argpartition(scores, n - k)[n - k:]
+    else:
+        # Берем всех, кто не хуже k-го значения, чтобы не потерять равные
+        kth_score = np.partition(scores, n - k)[n - k]
+        candidates = np.flatnonzero(scores >= kth_score)
+
+    if tiebreak is None:
+        order = np.argsort(-scores[candidates], kind='stable')
+    else:
+        tiebreak = np.asarray(tiebreak)
+        order = np.lexsort((-tiebreak[candidates], -scores[candidates]))
+    return candidates[order][:k]
+
+
+def top_k_merge(chunks, k):
+    """
+    Слияние top-k по частям кандидатов через кучу.
+
+    chunks - итерируемое из (upper_bound, indices, scores), где indices -
+    глобальные индексы кандидатов части, а scores - их оценки или функция без
+    аргументов, которая их вычисляет (вызывается только если часть нужна).
+    Если части идут по невозрастанию upper_bound, перебор останавливается,
+    как только k-й лучший результат не хуже границы очередной части.
+    upper_bound=None отключает отсечение для этой части.
+
+    Возвращает (indices, scores) по убыванию scores.
+    """
+    heap = []
+    for upper_bound, indices, scores in chunks:
+        if len(heap) == k and upper_bound is not None and upper_bound <= heap[0][0]:
+            break
+
+        if callable(scores):
+            scores = scores()
+        scores = np.asarray(scores)
+        indices = np.asarray(indices)
+
+        for i in top_k(scores, k):
+            item = (float(scores[i]), -int(indices[i]))
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+            else:
+                # Дальше в части только оценки не выше текущей
+                break
+
+    best = sorted(heap, reverse=True)
+    return (
+        np.array([-index for _, index in best], dtype=np.intp),
+        np.array([score for score, _ in best], dtype=np.float64),
+    )
@@ -0,0 +1,83 @@
+"""
+Снимки данных в памяти процесса, которые перестраиваются в фоне.
+
+VersionedIndex держит последний построенный снимок (объект с атрибутом
+version). Первый снимок строится синхронно - отдавать еще нечего. Когда
+данные меняются, get() продолжает отдавать предыдущий снимок, а новый
+строится в фоновом потоке на своем соединении (connect) и подменяет старый
+целиком, когда готов; одновременно строится не больше одного снимка. Так
+запросы не ждут полной перестройки после каждой записи (например, пачки
+фильмов из OMDb). Без connect снимок перестраивается синхронно в get().
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class VersionedIndex:
+    """Последний снимок и его фоновая перестройка; подклассы задают version() и build()."""
+
+    def __init__(self, connect=None):
+        self.connect = connect
+        self._snapshot = None
+        self._building = False
+        self._lock = threading.Lock()
+
+    def version(self, conn):
+        """Текущая версия данных в базе."""
+        raise NotImplementedError
+
+    def build(self, conn, version):
+        """Новый снимок для version."""
+        raise NotImplementedError
+
+    def is_fresh(self, snapshot, version):
+        return snapshot.version == version
+
+    def get(self, conn, version=None):
+        version = version or self.version(conn)
+        snapshot = self._snapshot
+        if snapshot is not None and self.is_fresh(snapshot, version):
+            return snapshot
+        if snapshot is not None and self.connect is not None:
+            self.refresh()
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or not self.is_fresh(self._snapshot, version):
+                self._snapshot = self.build(conn, version)
+            return self._snapshot
+
+    def refresh(self):
+        """Запускает фоновую перестройку, если она еще не идет."""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild, name=f'{type(self).__name__}-rebuild', daemon=True).start()
+
+    @property
+    def building(self):
+        return self._building
+
+    def _rebuild(self):
+        try:
+            conn = self.connect()
+            try:
+                version = self.version(conn)
+                while True:
+                    snapshot = self.build(conn, version)
+                    with self._lock:
+                        self._snapshot = snapshot
+                    # Пока строили, данные могли снова измениться
+                    latest = self.version(conn)
+                    if latest == version:
+                        break
+                    version = latest
+            finally:
+                conn.close()
+        except Exception:
+            logger.exception("Failed to rebuild %s", type(self).__name__)
+        finally:
+            with self._lock:
+                self._building = False
@@ -0,0 +1,97 @@
+"""
+Ограничение числа одновременных тяжелых запросов (admission control).
+
+AdmissionController пропускает не больше max_concurrent запросов; остальные
+ждут в очереди не дольше max_wait и не дольше дедлайна клиента, а если в
+очереди уже max_queue запросов или дедлайн уже истек - отклоняются сразу. Дешевые эндпоинты лимит
+не проходят и не голодают, пока рекомендации считаются.
+
+Дедлайн клиент передает заголовком X-Request-Timeout (мс); он ограничивает
+ожидание в очереди и время ответа воркера инференса.
+"""
+import threading
+import time
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUED, ADMISSION_WAIT_SECONDS
+
+TIMEOUT_HEADER = 'X-Request-Timeout'
+
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен: reason - 'queue_full' или 'timeout'."""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Deadline:
+    """Момент, после которого ответ клиенту уже не нужен (None - без дедлайна)."""
+
+    def __init__(self, timeout=None):
+        self.at = time.monotonic() + timeout if timeout is not None else None
+
+    @classmethod
+    def from_header(cls, value):
+        """Дедлайн из X-Request-Timeout в миллисекундах; ValueError, если значение некорректно."""
+        if value is None:
+            return cls()
+        timeout_ms = float(value)
+        if not timeout_ms > 0:
+            raise ValueError(f"{TIMEOUT_HEADER} must be a positive number of milliseconds")
+        return cls(timeout_ms / 1000)
+
+    def remaining(self, cap=None):
+        """Оставшееся время в секундах, не больше cap; None - без ограничения."""
+        if self.at is None:
+            return cap
+        left = max(self.at - time.monotonic(), 0.0)
+        return left if cap is None else min(left, cap)
+
+    @property
+    def expired(self):
+        return self.at is not None and time.monotonic() >= self.at
+
+
+class AdmissionController:
+    """Семафор со счетчиком ожидающих и ограниченным временем ожидания."""
+
+    def __init__(self, endpoint, max_concurrent, max_queue, max_wait):
+        self.endpoint = endpoint
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.queued = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, deadline=None):
+        """Занимает слот или бросает AdmissionRejected; с истекшим дедлайном - сразу 'timeout'."""
+        deadline = deadline or Deadline()
+        if deadline.expired:
+            raise AdmissionRejected('timeout')
+        timeout = deadline.remaining(self.max_wait)
+        start = time.monotonic()
+        with self._condition:
+            if self.in_flight >= self.max_concurrent:
+                if self.queued >= self.max_queue:
+                    raise AdmissionRejected('queue_full')
+                self.queued += 1
+                ADMISSION_QUEUED.inc(endpoint=self.endpoint)
+                try:
+                    admitted = self._condition.wait_for(
+                        lambda: self.in_flight < self.max_concurrent, timeout)
+                finally:
+                    self.queued -= 1
+                    ADMISSION_QUEUED.dec(endpoint=self.endpoint)
+                if not admitted:
+                    raise AdmissionRejected('timeout')
+            self.in_flight += 1
+            ADMISSION_IN_FLIGHT.inc(endpoint=self.endpoint)
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start, endpoint=self.endpoint)
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            ADMISSION_IN_FLIGHT.dec(endpoint=self.endpoint)
+            self._condition.notify()
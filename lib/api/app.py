@@ -1,31 +1,203 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, url_for
+import os
+import sys
+import json
+import hmac
+import random
+from functools import wraps
 import sqlite3
-import re
+import time
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+from datetime import datetime, timezone
 import numpy as np
-import json
-from sklearn.metrics.pairwise import cosine_similarity
-import requests
-from threading import Thread
+from threading import Lock, Thread
 from werkzeug.security import generate_password_hash, check_password_hash
 
+BACKEND_DIR = Path(__file__).parent.parent.parent / "backend"
+sys.path.append(str(BACKEND_DIR / "services"))
+sys.path.append(str(BACKEND_DIR / "database"))
+
+from db import migrate
+import backup
+from embedding_store import EmbeddingStore
+from features import FeatureStore
+from encoders import create_encoder, LazyEncoder
+from topk import top_k
+from diversity import mmr
+from gazetteer import ActorIndex, catalog_version
+from catalog import CatalogIndex
+from recommender import (
+    fetch_user_history, target_weights,
+    score_candidates, lexical_scores, score_weights, blend_scores, build_recommendations,
+)
+from inference import InferenceClient, InferenceUnavailable
+from shards import ShardedSearch, ShardUnavailable
+from feeds import FeedScheduler, read_feed
+from clusters import ClusterIndex, taste_vector
+from omdb_client import OmdbClient, OmdbError
+from ingestion import IngestionWorker
+from response_cache import create_cache, data_versions
+from fast_json import OrjsonProvider
+from compression import compress_response
+from profiling import AllocationTracer, ProfilerUnavailable, StackSampler, DEFAULT_INTERVAL
+from admission import AdmissionController, AdmissionRejected, Deadline, TIMEOUT_HEADER
+from metrics import (
+    registry, span, request_timings, server_timing_header, TimedConnection,
+    REQUESTS_TOTAL, REQUEST_SECONDS, OMDB_REQUESTS_TOTAL, INFERENCE_FALLBACK_TOTAL,
+    ADMISSION_SHED_TOTAL, SEARCH_SHARD_FAILURES_TOTAL,
+)
 
-model = SentenceTransformer('all-MiniLM-L6-v2')
 
 app = Flask(__name__)
-app.config['DATABASE'] = Path(__file__).parent.parent.parent / "backend" / "database" / "movies.db"
+# orjson-сериализация для jsonify/app.json, понимает NumPy и sqlite3.Row
+app.json = OrjsonProvider(app)
+app.config['DATABASE'] = BACKEND_DIR / "database" / "movies.db"
 app.config['SEND_TELEGRAM_NOTIFICATIONS'] = True
 app.config['TELEGRAM_CHAT_ID'] = [922279354, 471661173]
 app.config['TELEGRAM_BOT_TOKEN'] = '7578670137:AAEqEP36zQ-aAFaDm7uHRyjkfIGkPC8Gqvg'
-           
-print(app.config['DATABASE'])
+app.config['TELEGRAM_API_URL'] = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+# Бэкенд энкодера: 'torch' (SentenceTransformer), 'onnx' (onnxruntime, без torch)
+# или 'hashing' (детерминированная заглушка без модели для бенчмарков)
+app.config['ENCODER_BACKEND'] = os.environ.get('ENCODER_BACKEND', 'torch')
+app.config['ONNX_MODEL_DIR'] = os.environ.get('ONNX_MODEL_DIR', BACKEND_DIR / "models" / "minilm-onnx")
+app.config['ONNX_QUANTIZED'] = os.environ.get('ONNX_QUANTIZED', '0') == '1'
+# Unix-сокет отдельного процесса инференса (backend/services/inference.py); если задан,
+# веб-воркер не загружает модель, а при таймауте или перегрузке ранжирует по словам
+app.config['INFERENCE_SOCKET'] = os.environ.get('INFERENCE_SOCKET')
+app.config['INFERENCE_TIMEOUT'] = float(os.environ.get('INFERENCE_TIMEOUT', '2.0'))
+# Общий ключ рукопожатия с воркером инференса и шардами (их INFERENCE_AUTHKEY)
+app.config['INFERENCE_AUTHKEY'] = os.environ.get('INFERENCE_AUTHKEY')
+# Шардированный поиск: сокеты процессов backend/services/shards.py через запятую
+app.config['SEARCH_SHARDS'] = [address for address in os.environ.get('SEARCH_SHARDS', '').split(',') if address]
+app.config['SEARCH_SHARD_TIMEOUT'] = float(os.environ.get('SEARCH_SHARD_TIMEOUT', '0.5'))
+# Кэш ответов рекомендаций: 'memory', 'redis' или 'none'
+app.config['RECOMMENDATION_CACHE'] = os.environ.get('RECOMMENDATION_CACHE', 'memory')
+app.config['RECOMMENDATION_CACHE_TTL'] = 300
+app.config['REDIS_URL'] = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+# Заголовок Server-Timing с длительностями этапов запроса (для отладки на клиенте)
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '0') == '1'
+# Веса сигналов итогового скора поверх recommender.DEFAULT_SCORE_WEIGHTS, JSON: {"rating": 0.1}
+app.config['SCORE_WEIGHTS'] = json.loads(os.environ.get('SCORE_WEIGHTS', '{}'))
+# Переранжирование с учетом разнообразия (MMR): lambda по умолчанию (пусто - выключено),
+# запрос может передать свою в поле 'diversity'
+app.config['MMR_LAMBDA'] = float(os.environ['MMR_LAMBDA']) if os.environ.get('MMR_LAMBDA') else None
+app.config['MMR_POOL_SIZE'] = 200
+# OMDb API: клиент приложения ходит через /api/omdb/*, ключ хранится только на сервере
+app.config['OMDB_API_URL'] = os.environ.get('OMDB_API_URL', 'https://www.omdbapi.com')
+app.config['OMDB_API_KEY'] = os.environ.get('OMDB_API_KEY', 'e49b8565')
+app.config['OMDB_INGESTION'] = os.environ.get('OMDB_INGESTION', '1') == '1'
+# Карточки пишутся в каталог пачкой раз в OMDB_INGESTION_INTERVAL секунд: каждая запись меняет
+# catalog_version и сбрасывает кэш рекомендаций всех пользователей, поэтому не чаще его TTL
+app.config['OMDB_INGESTION_INTERVAL'] = float(os.environ.get('OMDB_INGESTION_INTERVAL', '300'))
+# Сжатие JSON-ответов (gzip/br по Accept-Encoding) начиная с COMPRESSION_MIN_SIZE байт
+app.config['COMPRESSION'] = os.environ.get('COMPRESSION', '1') == '1'
+app.config['COMPRESSION_MIN_SIZE'] = 1024
+# Admission control рекомендаций: одновременно считаются не больше MAX_CONCURRENCY запросов,
+# до MAX_QUEUE ждут слот не дольше MAX_WAIT секунд, остальным - 503 с Retry-After
+app.config['RECOMMENDATION_MAX_CONCURRENCY'] = int(os.environ.get('RECOMMENDATION_MAX_CONCURRENCY', os.cpu_count() or 4))
+app.config['RECOMMENDATION_MAX_QUEUE'] = int(os.environ.get('RECOMMENDATION_MAX_QUEUE', '16'))
+app.config['RECOMMENDATION_MAX_WAIT'] = float(os.environ.get('RECOMMENDATION_MAX_WAIT', '1.0'))
+app.config['RECOMMENDATION_RETRY_AFTER'] = 1
+# Запасное ранжирование по словам (воркер инференса недоступен): сколько кандидатов
+# с лучшей оценкой и описаний из истории пользователя в нем участвуют
+app.config['LEXICAL_MAX_CANDIDATES'] = int(os.environ.get('LEXICAL_MAX_CANDIDATES', '500'))
+app.config['LEXICAL_MAX_TARGETS'] = int(os.environ.get('LEXICAL_MAX_TARGETS', '5'))
+# Ленты /api/users/<id>/feed: как часто фоновый планировщик ищет устаревшие и их длина
+app.config['FEED_SCHEDULER'] = os.environ.get('FEED_SCHEDULER', '1') == '1'
+app.config['FEED_REFRESH_INTERVAL'] = float(os.environ.get('FEED_REFRESH_INTERVAL', '60'))
+# Ленты, устаревшие только из-за изменений каталога, пересчитываются не чаще раза в этот интервал
+app.config['FEED_CATALOG_REFRESH_INTERVAL'] = float(os.environ.get('FEED_CATALOG_REFRESH_INTERVAL', '3600'))
+app.config['FEED_SIZE'] = 50
+# Кандидаты пользователя с историей - пулы TASTE_CLUSTER_PROBES ближайших кластеров вкусов и
+# TASTE_CLUSTER_QUERY_PROBES ближайших к описанию списков фильмов. По умолчанию выключено (0 - весь
+# жанр, кластеры не строятся): включать после проверки полноты на своих запросах
+# (python clusters.py --evaluate)
+app.config['TASTE_CLUSTER_PROBES'] = int(os.environ.get('TASTE_CLUSTER_PROBES', '0'))
+app.config['TASTE_CLUSTER_QUERY_PROBES'] = int(os.environ.get('TASTE_CLUSTER_QUERY_PROBES', '4'))
+# Эндпоинты /admin/* доступны с заголовком Authorization: Bearer ADMIN_TOKEN; без токена их нет
+app.config['ADMIN_TOKEN'] = os.environ.get('ADMIN_TOKEN')
+# Сэмплирующий профайлер (обработчик SIGPROF ставится при импорте, сэмплы - только после /admin/profiler/start)
+app.config['PROFILER'] = os.environ.get('PROFILER', '0') == '1'
+# Доля запросов со снимками tracemalloc; админ может включить их для запроса заголовком X-Trace-Allocations
+app.config['ALLOCATION_TRACE_RATE'] = float(os.environ.get('ALLOCATION_TRACE_RATE', '0'))
+# Снимки базы (POST /admin/snapshots): каталог и шаг копирования backup API
+app.config['SNAPSHOT_DIR'] = Path(os.environ.get('SNAPSHOT_DIR', BACKEND_DIR / "database" / "snapshots"))
+app.config['SNAPSHOT_PAGES'] = backup.PAGES
+app.config['SNAPSHOT_SLEEP'] = backup.SLEEP
+
+inference_authkey = app.config['INFERENCE_AUTHKEY'].encode('utf-8') if app.config['INFERENCE_AUTHKEY'] else None
+if app.config['INFERENCE_SOCKET']:
+    model = InferenceClient(app.config['INFERENCE_SOCKET'], app.config['INFERENCE_TIMEOUT'], inference_authkey)
+else:
+    # Модель загружается при первой рекомендации (или заранее при запуске сервера),
+    # чтобы импорт app не тянул torch/onnxruntime - см. benchmarks/bench_startup.py
+    model = LazyEncoder(lambda: create_encoder(app.config))
+embedding_store = EmbeddingStore(model)
+feature_store = FeatureStore()
+recommendation_cache = create_cache(app.config)
+omdb_client = OmdbClient(app.config['OMDB_API_URL'], app.config['OMDB_API_KEY'])
+# Карточки фильмов из OMDb в фоне добавляются в каталог вместе с эмбеддингами
+ingestion_worker = IngestionWorker(lambda: get_db(), embedding_store, feature_store,
+                                   flush_interval=app.config['OMDB_INGESTION_INTERVAL'])
+# Словарь актеров и колоночная копия каталога с эмбеддингами в памяти; после изменения
+# catalog_version обе перестраиваются в фоне, а запросы до готовности читают прежний снимок
+actor_index = ActorIndex(connect=lambda: get_db())
+catalog_index = CatalogIndex(embedding_store, connect=lambda: get_db())
+shard_search = ShardedSearch(app.config['SEARCH_SHARDS'], app.config['SEARCH_SHARD_TIMEOUT'], inference_authkey) \
+    if app.config['SEARCH_SHARDS'] else None
+# Кластеры вкусов и ленты пользователей пересчитываются в фоне при изменении профилей или каталога;
+# считает один процесс API - владелец аренды в scheduler_leases (см. services/feeds.py)
+cluster_index = ClusterIndex()
+feed_scheduler = FeedScheduler(
+    lambda: get_db(), catalog_index, embedding_store,
+    score_weights(app.config['SCORE_WEIGHTS']),
+    interval=app.config['FEED_REFRESH_INTERVAL'], size=app.config['FEED_SIZE'],
+    cluster_index=cluster_index if app.config['TASTE_CLUSTER_PROBES'] else None,
+    catalog_interval=app.config['FEED_CATALOG_REFRESH_INTERVAL'],
+)
+stack_sampler = StackSampler()
+allocation_tracer = AllocationTracer()
+if app.config['PROFILER']:
+    try:
+        stack_sampler.install()
+    except ProfilerUnavailable as e:
+        app.logger.warning(f"Профайлер недоступен: {e}")
+recommendation_admission = AdmissionController(
+    '/api/ml/recommendations', app.config['RECOMMENDATION_MAX_CONCURRENCY'],
+    app.config['RECOMMENDATION_MAX_QUEUE'], app.config['RECOMMENDATION_MAX_WAIT'],
+)
+
 def get_db():
-    print(app.config['DATABASE'])
-    conn = sqlite3.connect(app.config['DATABASE'])
+    conn = sqlite3.connect(app.config['DATABASE'], factory=TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
+def migrate_database():
+    """Применяет миграции к базе приложения; вызывается один раз при старте процесса, не на запросах"""
+    conn = sqlite3.connect(app.config['DATABASE'])
+    try:
+        version = migrate(conn)
+    finally:
+        conn.close()
+    app.logger.info(f"База {app.config['DATABASE']}: схема версии {version}")
+    process_state['started'] = True
+    return version
+
+# Под WSGI-сервером (gunicorn, uwsgi) __main__ не выполняется: процесс готовится перед первым запросом
+process_state = {'started': False}
+process_lock = Lock()
+
+@app.before_request
+def start_process():
+    """Миграции и фоновый планировщик лент - один раз на процесс"""
+    if process_state['started']:
+        return
+    with process_lock:
+        if not process_state['started']:
+            migrate_database()
+            if app.config['FEED_SCHEDULER']:
+                feed_scheduler.start()
+
 def send_telegram_notification(feedback_data):
     """Отправка уведомления в Telegram"""
     if not app.config['SEND_TELEGRAM_NOTIFICATIONS']:
@@ -43,45 +215,206 @@ def send_telegram_notification(feedback_data):
         f"Текст: {feedback_data.get('text', 'Без текста')}"
     )
     
+    import requests
     try:
         for id in app.config['TELEGRAM_CHAT_ID']:
             requests.post(
-                f"https://api.telegram.org/bot{app.config['TELEGRAM_BOT_TOKEN']}/sendMessage",
+                f"{app.config['TELEGRAM_API_URL']}/bot{app.config['TELEGRAM_BOT_TOKEN']}/sendMessage",
                 json={
                     'chat_id': id,
                     'text': message,
                     'parse_mode': 'Markdown'
-                }
+                },
+                timeout=10
             )
     except Exception as e:
         app.logger.error(f"Ошибка отправки в Telegram: {e}")
 
-def extract_actors(text):
-    """
-    Извлекает имена актеров из текста, корректно разделяя их по 'and' и запятым.
-    Пример:
-        "with Tom Hardi and Elizabeth Groth" -> ["Tom Hardi", "Elizabeth Groth"]
-        "film with Roman Shechin, Tom Hardi and Elizabeth Groth" 
-        -> ["Roman Shechin", "Tom Hardi", "Elizabeth Groth"]
-    """
-    # Находим всю часть текста после 'with'
-    match = re.search(r'with\s+(.*)', text, re.IGNORECASE)
-    if not match:
-        return []
-    
-    actors_part = match.group(1)
-    
-    # Разделяем актеров по запятым и 'and'
-    actors = re.split(r',\s*|\s+and\s+', actors_part)
-    
-    # Очищаем и проверяем каждое имя
-    result = []
-    for actor in actors:
-        actor = actor.strip()
-        if re.match(r'^[A-Z][a-z]+\s+[A-Z][a-z]+', actor):
-            result.append(actor)
+def cached_json_response(body, etag):
+    """JSON-ответ с ETag; 304, если у клиента уже есть эта версия"""
+    # ETag слабый: тело может отдаваться сжатым (см. compress_json_response)
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, status=200, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Метрики по каждому запросу и опциональный заголовок Server-Timing"""
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUESTS_TOTAL.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
     
-    return result
+    if app.config['SERVER_TIMING']:
+        timings = dict(request_timings(), total=elapsed)
+        response.headers['Server-Timing'] = server_timing_header(timings)
+    return response
+
+@app.after_request
+def compress_json_response(response):
+    """gzip/br для больших JSON-ответов"""
+    if app.config['COMPRESSION']:
+        compress_response(response, request.accept_encodings, app.config['COMPRESSION_MIN_SIZE'])
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def is_admin():
+    token = app.config['ADMIN_TOKEN']
+    authorization = request.headers.get('Authorization', '')
+    return bool(token) and authorization.startswith('Bearer ') \
+        and hmac.compare_digest(authorization[len('Bearer '):].encode(), token.encode())
+
+def admin_only(view):
+    """Эндпоинт только для админа: без ADMIN_TOKEN - 404, с неверным токеном - 403"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config['ADMIN_TOKEN']:
+            return jsonify({'error': 'Not found'}), 404
+        if not is_admin():
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.before_request
+def start_allocation_trace():
+    """Снимок tracemalloc для запроса по заголовку админа или для доли ALLOCATION_TRACE_RATE"""
+    if request.path.startswith('/admin/') or request.path == '/metrics':
+        return
+    rate = app.config['ALLOCATION_TRACE_RATE']
+    if (request.headers.get('X-Trace-Allocations') and is_admin()) or (rate and random.random() < rate):
+        g.allocation_trace_started_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        g.allocation_trace = allocation_tracer.begin()
+
+@app.teardown_request
+def finish_allocation_trace(error=None):
+    state = g.pop('allocation_trace', None)
+    if state is not None:
+        allocation_tracer.end(
+            state, method=request.method, path=request.path, started_at=g.allocation_trace_started_at,
+        )
+
+@app.route('/admin/profiler/start', methods=['POST'])
+@admin_only
+def start_profiler():
+    """Запускает сэмплирование стеков; interval - секунды процессорного времени между сэмплами"""
+    try:
+        interval = float(request.args.get('interval', DEFAULT_INTERVAL))
+    except ValueError:
+        return jsonify({'error': 'interval must be a number'}), 400
+    if not 0.001 <= interval <= 1:
+        return jsonify({'error': 'interval must be between 0.001 and 1 seconds'}), 400
+    try:
+        stack_sampler.start(interval)
+    except ProfilerUnavailable as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'message': 'Profiler started', 'max_seconds': stack_sampler.max_seconds}), 200
+
+@app.route('/admin/profiler/stop', methods=['POST'])
+@admin_only
+def stop_profiler():
+    """Останавливает профайлер и отдает collapsed stacks (flamegraph.pl, speedscope)"""
+    return app.response_class(stack_sampler.stop(), mimetype='text/plain')
+
+@app.route('/admin/profiler', methods=['GET'])
+@admin_only
+def get_profile():
+    """Накопленные сэмплы без остановки профайлера"""
+    response = app.response_class(stack_sampler.collapsed(), mimetype='text/plain')
+    response.headers['X-Profiler-Running'] = '1' if stack_sampler.running else '0'
+    return response
+
+@app.route('/admin/allocations', methods=['GET'])
+@admin_only
+def get_allocations():
+    """Последние снимки tracemalloc по запросам, новые первыми"""
+    return jsonify(list(reversed(allocation_tracer.records))), 200
+
+# Снимок, который сейчас пишется, и результат последнего
+snapshot_state = {'running': None, 'last': None}
+snapshot_lock = Lock()
+
+def run_snapshot(database, output):
+    try:
+        result = backup.snapshot(database, output, app.config['SNAPSHOT_PAGES'], app.config['SNAPSHOT_SLEEP'])
+    except Exception as e:
+        app.logger.error(f"Снимок базы не создан: {e}")
+        result = {'path': str(output), 'error': str(e)}
+    with snapshot_lock:
+        snapshot_state['running'] = None
+        snapshot_state['last'] = result
+
+@app.route('/admin/snapshots', methods=['POST'])
+@admin_only
+def create_snapshot():
+    """Запускает снимок базы в фоне; запись в базу во время снимка не останавливается"""
+    name = datetime.now(timezone.utc).strftime('movies-%Y%m%dT%H%M%S%fZ.db')
+    output = Path(app.config['SNAPSHOT_DIR']) / name
+    with snapshot_lock:
+        if snapshot_state['running']:
+            return jsonify({'error': 'Snapshot is already running', 'snapshot': snapshot_state['running']}), 409
+        snapshot_state['running'] = name
+    Thread(target=run_snapshot, args=(app.config['DATABASE'], output), daemon=True).start()
+    response = jsonify({'snapshot': name})
+    response.headers['Location'] = url_for('list_snapshots')
+    return response, 202
+
+@app.route('/admin/snapshots', methods=['GET'])
+@admin_only
+def list_snapshots():
+    """Готовые снимки (новые первыми), текущий и результат последнего"""
+    directory = Path(app.config['SNAPSHOT_DIR'])
+    files = sorted(directory.glob('*.db'), reverse=True) if directory.exists() else []
+    with snapshot_lock:
+        state = dict(snapshot_state)
+    return jsonify({
+        'snapshots': [{'name': path.name, 'bytes': path.stat().st_size} for path in files],
+        'running': state['running'],
+        'last': state['last'],
+    }), 200
+
+def omdb_response(params, ingest=False):
+    """Ответ OMDb через кэш; заголовок X-Cache показывает, откуда он взят"""
+    try:
+        conn = get_db()
+        body, source = omdb_client.get(conn, params)
+        # Новые карточки фильмов уходят в каталог (из кэша - уже были отправлены)
+        if ingest and source == 'miss' and app.config['OMDB_INGESTION']:
+            ingestion_worker.submit(json.loads(body))
+    except OmdbError as e:
+        OMDB_REQUESTS_TOTAL.inc(result='error')
+        return jsonify({'error': f'OMDb is unavailable: {e}'}), 502
+    finally:
+        if 'conn' in locals():
+            conn.close()
+    OMDB_REQUESTS_TOTAL.inc(result=source)
+    response = app.response_class(body, status=200, mimetype='application/json')
+    response.headers['X-Cache'] = source.upper()
+    return response
+
+@app.route('/api/omdb/search', methods=['GET'])
+def omdb_search():
+    if not request.args.get('s'):
+        return jsonify({'error': 'Search query (s) is required'}), 400
+    return omdb_response({
+        's': request.args['s'],
+        'type': request.args.get('type'),
+        'y': request.args.get('y'),
+        'page': request.args.get('page', '1'),
+    })
+
+@app.route('/api/omdb/movie/<imdb_id>', methods=['GET'])
+def omdb_movie(imdb_id):
+    return omdb_response({'i': imdb_id, 'plot': request.args.get('plot', 'short')}, ingest=True)
 
 @app.teardown_appcontext
 def close_db(error):
@@ -89,6 +422,35 @@ def close_db(error):
     if hasattr(app, 'db'):
         app.db.close()
 
+def encode_targets(conn, target_texts, liked_movie_ids, deadline):
+    """Векторы текстов запроса (через модель) и похожих фильмов пользователя (из movie_embeddings)"""
+    with span('encode_targets'):
+        target_embeddings = model.encode(target_texts, timeout=deadline.remaining())
+        if liked_movie_ids:
+            target_embeddings = np.vstack([target_embeddings, embedding_store.get(conn, liked_movie_ids)])
+    return target_embeddings
+
+def score_movies(conn, catalog, movie_ids, target_embeddings, weights, actor_movies, blend_weights):
+    """Итоговый скор фильмов по id - для кандидатов, векторов которых еще нет у шардов"""
+    rows = catalog.rows_of(movie_ids)
+    known = rows >= 0
+    scores = np.full(len(movie_ids), -np.inf, dtype=np.float64)
+    if known.any():
+        ids = catalog.ids[rows[known]].tolist()
+        embeddings = catalog.embeddings_for(rows[known], lambda missing: embedding_store.get(conn, missing))
+        similarity = score_candidates(target_embeddings, embeddings, weights)
+        matched_actors = [actor_movies[movie_id] for movie_id in ids] if actor_movies else []
+        features = catalog.features_for(rows[known])
+        scores[known] = blend_scores(similarity, matched_actors, features, blend_weights)
+    return scores
+
+def top_rated_rows(catalog, rows, limit):
+    """Не больше limit строк из rows с наибольшей оценкой (без оценки - последними), по возрастанию"""
+    if len(rows) <= limit:
+        return rows
+    rated = np.nan_to_num(catalog.scores[rows], nan=-np.inf)
+    return np.sort(rows[np.argpartition(-rated, limit - 1)[:limit]])
+
 @app.route('/api/ml/recommendations', methods=['POST'])
 def get_ml_recommendations():
     data = request.get_json()
@@ -102,115 +464,212 @@ def get_ml_recommendations():
         user_id = data['user_id']
         description = data['description']
         genres = [g.strip() for g in data['genres'].split(',')]
-        actors = extract_actors(description)
+        mmr_lambda = data.get('diversity', app.config['MMR_LAMBDA'])
+        if mmr_lambda is not None and (
+                isinstance(mmr_lambda, bool) or not isinstance(mmr_lambda, (int, float))
+                or not 0 <= mmr_lambda <= 1):
+            return jsonify({'error': 'diversity must be a number between 0 and 1'}), 400
+        try:
+            deadline = Deadline.from_header(request.headers.get(TIMEOUT_HEADER))
+        except ValueError:
+            return jsonify({'error': f'{TIMEOUT_HEADER} must be a positive number of milliseconds'}), 400
         
         conn = get_db()
+        
+        # 0. Проверяем кэш ответов (ключ учитывает версии профиля пользователя и каталога в базе)
+        if recommendation_cache is not None:
+            with span('cache_lookup'):
+                cache_key = recommendation_cache.make_key(
+                    data_versions(conn, user_id), user_id, description, genres,
+                    {'diversity': mmr_lambda} if mmr_lambda is not None else None
+                )
+                # ETag, выданный любым воркером при тех же версиях, подтверждаем без пересчета
+                etag = recommendation_cache.etag(cache_key)
+                if request.if_none_match.contains_weak(etag):
+                    return cached_json_response(None, etag)
+                cached = recommendation_cache.get(cache_key)
+            if cached:
+                return cached_json_response(*cached)
+        
+        # Слот на тяжелую часть запроса. Если очередь полна, слот не освободился за
+        # RECOMMENDATION_MAX_WAIT или истек дедлайн клиента - 503 с Retry-After: запасное
+        # ранжирование тоже тратит CPU и без слота добавило бы нагрузки перегруженному воркеру
+        admitted = False
+        try:
+            with span('admission'):
+                recommendation_admission.acquire(deadline)
+            admitted = True
+        except AdmissionRejected as e:
+            ADMISSION_SHED_TOTAL.inc(endpoint=request.url_rule.rule, reason=e.reason, action='rejected')
+            response = jsonify({'error': 'Too many recommendation requests, retry later'})
+            response.headers['Retry-After'] = str(app.config['RECOMMENDATION_RETRY_AFTER'])
+            return response, 503
+        
         cursor = conn.cursor()
         
         # 1. Получаем похожие фильмы пользователя
-        cursor.execute("""
-            SELECT overview 
-            FROM similar_movies 
-            WHERE user_id = ? 
-            AND overview IS NOT NULL 
-            AND overview != ''
-        """, (user_id,))
-        similar_movies = [row[0] for row in cursor.fetchall()]
-        
-        # 2. Получаем фильмы по жанрам
-        query = """
-            SELECT id, title, overview, genre, score, crew 
-            FROM movies 
-            WHERE genre LIKE ? 
-            AND overview IS NOT NULL 
-            AND overview != ''
-        """
-        params = [f"%{genres[0]}%"]
+        with span('user_history'):
+            liked_movie_ids, liked_overviews = fetch_user_history(cursor, user_id)
         
-        cursor.execute(query, params)
-        movies = cursor.fetchall()
-        
-        if not movies:
-            return jsonify({'error': 'No movies found with specified genres'}), 404
-        
-        # Фильтрация по актерам
-        if actors:
-            filtered_movies = []
-            for movie in movies:
-                try:
-                    crew_data = json.loads(movie['crew']) if movie['crew'] else {}
-                    movie_actors = crew_data.get('Actors', '').split(', ') if 'Actors' in crew_data else []
-                    if any(actor in movie_actors for actor in actors):
-                        filtered_movies.append(movie)
-                except json.JSONDecodeError:
-                    continue
+        # 2. Снимок каталога в памяти (колонки NumPy и эмбеддинги; после изменения movies
+        # новый строится в фоне, а до тех пор используется прежний)
+        with span('catalog'):
+            version = catalog_version(conn)
+            catalog = catalog_index.get(conn, version)
+        
+        # Ищем в описании имена актеров каталога; их фильмы берутся из индекса
+        # актер -> фильмы, и жанр проверяется только у них
+        with span('actor_match'):
+            gazetteer = actor_index.get(conn, version)
+            actors = gazetteer.find(description)
+            actor_movies = gazetteer.movies_for(actors) if actors else None
+        
+        # 3. Подготовка текстов для сравнения: кодируются только описание запроса
+        # и фильмы не из каталога, для каталога векторы берутся из снимка
+        target_texts = [description] + liked_overviews
+        weights = target_weights(len(liked_overviews) + len(liked_movie_ids))
+        blend_weights = score_weights(app.config['SCORE_WEIGHTS'])
+        use_model = not deadline.expired
+        target_embeddings = None
+        
+        # 4. Шардированный поиск: векторы запроса и фильтры рассылаются шардам,
+        # их top-k сливаются; если не ответил ни один шард - считаем здесь
+        search = None
+        if shard_search is not None and use_model:
+            try:
+                target_embeddings = encode_targets(conn, target_texts, liked_movie_ids, deadline)
+                with span('shard_search'):
+                    search = shard_search.search(
+                        target_embeddings, weights, blend_weights, genres[0], actor_movies,
+                        app.config['MMR_POOL_SIZE'] if mmr_lambda is not None else 20, model.name,
+                        timeout=deadline.remaining(),
+                        score_missing=lambda ids: score_movies(
+                            conn, catalog, ids, target_embeddings, weights, actor_movies, blend_weights),
+                    )
+            except InferenceUnavailable as e:
+                INFERENCE_FALLBACK_TOTAL.inc(reason=e.reason)
+                use_model = False
+            except ShardUnavailable as e:
+                SEARCH_SHARD_FAILURES_TOTAL.inc(shard='all', reason=e.reason)
+        
+        if search is not None:
+            for shard, reason in search.failed:
+                SEARCH_SHARD_FAILURES_TOTAL.inc(shard=str(shard), reason=reason)
+            if not search.candidates:
+                if actors:
+                    return jsonify({'error': 'No movies found with specified actors'}), 404
+                return jsonify({'error': 'No movies found with specified genres'}), 404
+            # Каталог мог измениться между чтением фронтом и шардами - такие фильмы пропускаются
+            rows = catalog.rows_of(search.ids)
+            known = rows >= 0
+            rows, scores = rows[known], search.scores[known]
+            candidate_ids = catalog.ids[rows].tolist()
+            matched_actors = [actor_movies[movie_id] for movie_id in candidate_ids] if actors else []
+            with span('encode_candidates'):
+                movie_embeddings = catalog.embeddings_for(rows, lambda ids: embedding_store.get(conn, ids))
+        else:
+            # Получаем фильмы по жанрам: кандидаты - индексы строк каталога
+            with span('genre_filter'):
+                rows = catalog.genre_candidates(
+                    genres[0], catalog.rows_for_ids(actor_movies) if actors else None
+                )
+            
+            if not len(rows):
+                if actors:
+                    return jsonify({'error': 'No movies found with specified actors'}), 404
+                return jsonify({'error': 'No movies found with specified genres'}), 404
+            candidate_ids = catalog.ids[rows].tolist()
+            
+            # Совпавшие актеры сохраняются для скора и ответа
+            matched_actors = [actor_movies[movie_id] for movie_id in candidate_ids] if actors else []
+            
+            # 5. Получение векторных представлений
+            movie_embeddings = None
+            try:
+                if use_model:
+                    if target_embeddings is None:
+                        target_embeddings = encode_targets(conn, target_texts, liked_movie_ids, deadline)
+                    
+                    # Пользователю с историей векторы читаются и полный скоринг идет только по
+                    # пулам ближайших к его вкусу кластеров (векторы после описания - его вкус),
+                    # спискам ближайших к описанию фильмов и фильмам новее кластеризации
+                    if app.config['TASTE_CLUSTER_PROBES'] and not actors and len(target_embeddings) > 1:
+                        with span('taste_clusters'):
+                            clusters = cluster_index.get(conn)
+                            if clusters is not None and clusters.model == model.name:
+                                rows = clusters.restrict(
+                                    catalog, rows, taste_vector(target_embeddings[1:]),
+                                    app.config['TASTE_CLUSTER_PROBES'], min_size=20,
+                                    query=target_embeddings[0],
+                                    n_query_probe=app.config['TASTE_CLUSTER_QUERY_PROBES'],
+                                )
+                                candidate_ids = catalog.ids[rows].tolist()
                     
-            if not filtered_movies:
-                return jsonify({'error': 'No movies found with specified actors'}), 404
-            movies = filtered_movies
-        
-        # 3. Подготовка текстов для сравнения
-        target_texts = [description] + similar_movies
-        movie_overviews = [m['overview'] for m in movies]
-        
-        # 4. Получение векторных представлений
-        target_embeddings = model.encode(target_texts)
-        movie_embeddings = model.encode(movie_overviews)
-        
-        # 5. Взвешенное сравнение
-        weights = [1.0] + [0.5] * len(similar_movies)
-        weighted_similarities = []
-        
-        for i, embedding in enumerate(target_embeddings):
-            sim = cosine_similarity([embedding], movie_embeddings)[0]
-            weighted_sim = sim * weights[i]
-            weighted_similarities.append(weighted_sim)
-        
-        # 6. Усреднение результатов
-        avg_similarities = np.mean(weighted_similarities, axis=0)
-        
-        # 7. Бонус за совпадение актеров
-        if actors:
-            for i, movie in enumerate(movies):
-                try:
-                    crew_data = json.loads(movie['crew']) if movie['crew'] else {}
-                    movie_actors = crew_data.get('Actors', '').split(', ') if 'Actors' in crew_data else []
-                    actor_count = sum(1 for actor in actors if actor in movie_actors)
-                    if actor_count > 0:
-                        avg_similarities[i] += actor_count * 0.1
-                except json.JSONDecodeError:
-                    continue
-        
-        # 8. Формирование рекомендаций
-        recommendations = []
-        for i in np.argsort(avg_similarities)[-20:][::-1]:
-            movie = movies[i]
-            matched_actors = []
-            if actors:
-                try:
-                    crew_data = json.loads(movie['crew']) if movie['crew'] else {}
-                    movie_actors = crew_data.get('Actors', '').split(', ') if 'Actors' in crew_data else []
-                    matched_actors = [actor for actor in actors if actor in movie_actors]
-                except json.JSONDecodeError:
-                    pass
+                    with span('encode_candidates'):
+                        movie_embeddings = catalog.embeddings_for(
+                            rows, lambda ids: embedding_store.get(conn, ids))
+                    
+                    # 6. Взвешенное сравнение и усреднение результатов
+                    with span('scoring'):
+                        avg_similarities = score_candidates(target_embeddings, movie_embeddings, weights)
+            except InferenceUnavailable as e:
+                # Воркер инференса перегружен или недоступен - ранжируем по совпадению слов
+                INFERENCE_FALLBACK_TOTAL.inc(reason=e.reason)
+                movie_embeddings = None
+            if movie_embeddings is None:
+                # Запасное ранжирование - чистый Python, поэтому ограничено LEXICAL_MAX_CANDIDATES
+                # фильмами с лучшей оценкой и LEXICAL_MAX_TARGETS описаниями из истории
+                rows = top_rated_rows(catalog, rows, app.config['LEXICAL_MAX_CANDIDATES'])
+                candidate_ids = catalog.ids[rows].tolist()
+                matched_actors = [actor_movies[movie_id] for movie_id in candidate_ids] if actors else []
+                lexical_targets = [description] + liked_overviews[:app.config['LEXICAL_MAX_TARGETS']]
+                with span('lexical_scoring'):
+                    avg_similarities = lexical_scores(
+                        lexical_targets, [catalog.text('overview', row) for row in rows],
+                        target_weights(len(lexical_targets) - 1)
+                    )
             
-            recommendations.append({
-                'id': movie['id'],
-                'title': movie['title'],
-                'overview': movie['overview'],
-                'genre': movie['genre'],
-                'score': movie['score'],
-                'similarity_score': float(avg_similarities[i]),
-                'matched_actors': matched_actors
-            })
-        
-        return jsonify(recommendations), 200
+            # 7. Итоговый скор: сходство, совпавшие актеры и числовые признаки фильма
+            with span('blend'):
+                features = catalog.features_for(rows)
+                scores = blend_scores(avg_similarities, matched_actors, features, blend_weights)
+        
+        # 8. Формирование рекомендаций (с MMR - разнообразные среди лучших MMR_POOL_SIZE)
+        with span('top_k'):
+            if mmr_lambda is None or movie_embeddings is None:
+                indices = top_k(scores, 20)
+            else:
+                indices = mmr(movie_embeddings, scores, 20, mmr_lambda, app.config['MMR_POOL_SIZE'])
+            recommendations = build_recommendations(catalog, rows, scores, indices, matched_actors)
+        
+        # Запасной ответ не кэшируется, чтобы после восстановления воркера сразу вернулось обычное ранжирование
+        if movie_embeddings is None:
+            response = jsonify(recommendations)
+            response.headers['X-Ranking'] = 'lexical'
+            return response, 200
+        
+        # Частичный результат (часть шардов не ответила) тоже не кэшируется
+        if search is not None and search.failed:
+            response = jsonify(recommendations)
+            response.headers['X-Search-Shards'] = \
+                f"{len(shard_search.clients) - len(search.failed)}/{len(shard_search.clients)}"
+            return response, 200
+        
+        # Ответ по отстающему снимку каталога не кэшируется под ключом с новой версией
+        if recommendation_cache is None or catalog.version != version:
+            return jsonify(recommendations), 200
+        
+        body = app.json.dumps(recommendations)
+        etag = recommendation_cache.set(cache_key, body)
+        return cached_json_response(body, etag)
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     finally:
         if 'conn' in locals():
             conn.close()
+        if locals().get('admitted'):
+            recommendation_admission.release()
 
 @app.route('/api/users', methods=['POST'])
 def create_user():
@@ -323,12 +782,70 @@ def reset_password():
 
 
 # Эндпоинты для похожих фильмов
+SIMILAR_MOVIE_COLUMNS = (
+    'user_id', 'movie_id', 'title', 'date_x', 'score', 'genre', 'overview', 'crew', 'orig_title',
+    'status', 'orig_lang', 'budget_x', 'revenue', 'country', 'added_at',
+)
+INSERT_SIMILAR_MOVIE = (
+    f"INSERT INTO similar_movies ({', '.join(SIMILAR_MOVIE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(SIMILAR_MOVIE_COLUMNS))})"
+)
+SIMILAR_MOVIE_REQUIRED_FIELDS = ('title', 'date_x', 'score', 'genre', 'overview')
+# Сколько фильмов можно добавить или удалить одним batch-запросом
+SIMILAR_MOVIES_BATCH_LIMIT = 500
+
+
+def similar_movie_values(user_id, data, catalog_titles, added_at):
+    """
+    Значения SIMILAR_MOVIE_COLUMNS для фильма из запроса.
+
+    Фильм из каталога (movie_id есть в catalog_titles) сохраняется только ссылкой,
+    остальные - полной копией; None - фильма нет в каталоге и полных данных тоже нет.
+    """
+    catalog_movie_id = data.get('movie_id')
+    if catalog_movie_id in catalog_titles:
+        # Данные фильма берутся из каталога
+        return (user_id, catalog_movie_id, catalog_titles[catalog_movie_id]) + (None,) * 11 + (added_at,)
+    if not all(field in data for field in SIMILAR_MOVIE_REQUIRED_FIELDS):
+        return None
+    return (
+        user_id,
+        None,
+        data['title'],
+        data.get('date_x'),
+        float(data['score']) if data.get('score') else None,
+        data['genre'],
+        data['overview'],
+        data.get('crew', ''),
+        data.get('orig_title', data['title']),
+        data.get('status', ''),
+        data.get('orig_lang', ''),
+        float(data['budget_x']) if data.get('budget_x') else None,
+        float(data['revenue']) if data.get('revenue') else None,
+        data.get('country', ''),
+        added_at,
+    )
+
+
+def catalog_titles(cursor, movies):
+    """{movie_id: title} фильмов каталога, на которые ссылаются movies, одним запросом"""
+    movie_ids = list({movie['movie_id'] for movie in movies if movie.get('movie_id') is not None})
+    if not movie_ids:
+        return {}
+    cursor.execute(
+        f"SELECT id, title FROM movies WHERE id IN ({', '.join('?' * len(movie_ids))})", movie_ids
+    )
+    return {row['id']: row['title'] for row in cursor.fetchall()}
+
+
 @app.route('/api/users/<int:user_id>/similar_movies', methods=['POST'])
 def add_similar_movie(user_id):
     data = request.get_json()
     
-    required_fields = ['title', 'date_x', 'score', 'genre', 'overview']
-    if not data or not all(field in data for field in required_fields):
+    # Фильм из каталога передается ссылкой movie_id, остальные - полным описанием
+    if not isinstance(data, dict) or (
+            data.get('movie_id') is None
+            and not all(field in data for field in SIMILAR_MOVIE_REQUIRED_FIELDS)):
         return jsonify({'error': 'Missing required fields'}), 400
     
     try:
@@ -340,29 +857,13 @@ def add_similar_movie(user_id):
         if not cursor.fetchone():
             return jsonify({'error': 'User not found'}), 404
         
-        # Добавляем фильм
-        cursor.execute(
-            """INSERT INTO similar_movies 
-            (user_id, title, date_x, score, genre, overview, crew, orig_title, 
-             status, orig_lang, budget_x, revenue, country) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                user_id,
-                data['title'],
-                data.get('date_x'),
-                float(data['score']) if data.get('score') else None,
-                data['genre'],
-                data['overview'],
-                data.get('crew', ''),
-                data.get('orig_title', data['title']),
-                data.get('status', ''),
-                data.get('orig_lang', ''),
-                float(data['budget_x']) if data.get('budget_x') else None,
-                float(data['revenue']) if data.get('revenue') else None,
-                data.get('country', '')
-            )
-        )
+        added_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        values = similar_movie_values(user_id, data, catalog_titles(cursor, [data]), added_at)
+        if values is None:
+            return jsonify({'error': 'Movie not found in catalog'}), 404
+        cursor.execute(INSERT_SIMILAR_MOVIE, values)
         conn.commit()
+        request_feed_refresh(user_id)
         return jsonify({'message': 'Similar movie added successfully'}), 201
     except sqlite3.Error as e:
         return jsonify({'error': str(e)}), 500
@@ -370,6 +871,52 @@ def add_similar_movie(user_id):
         if 'conn' in locals():
             conn.close()
 
+@app.route('/api/users/<int:user_id>/similar_movies/batch', methods=['POST'])
+def add_similar_movies_batch(user_id):
+    """
+    Добавляет список фильмов {"movies": [...]} одной транзакцией.
+
+    Каждый элемент - как тело POST /similar_movies. Если хоть один элемент
+    некорректен, не добавляется ничего; в ошибке - его индекс.
+    """
+    data = request.get_json()
+    movies = data.get('movies') if isinstance(data, dict) else None
+    if not isinstance(movies, list) or not movies:
+        return jsonify({'error': 'movies must be a non-empty list'}), 400
+    if len(movies) > SIMILAR_MOVIES_BATCH_LIMIT:
+        return jsonify({'error': f'At most {SIMILAR_MOVIES_BATCH_LIMIT} movies per request'}), 400
+    for index, movie in enumerate(movies):
+        if not isinstance(movie, dict) or (
+                movie.get('movie_id') is None
+                and not all(field in movie for field in SIMILAR_MOVIE_REQUIRED_FIELDS)):
+            return jsonify({'error': 'Missing required fields', 'index': index}), 400
+    
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+        if not cursor.fetchone():
+            return jsonify({'error': 'User not found'}), 404
+        
+        added_at = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+        titles = catalog_titles(cursor, movies)
+        rows = []
+        for index, movie in enumerate(movies):
+            values = similar_movie_values(user_id, movie, titles, added_at)
+            if values is None:
+                return jsonify({'error': 'Movie not found in catalog', 'index': index}), 404
+            rows.append(values)
+        cursor.executemany(INSERT_SIMILAR_MOVIE, rows)
+        conn.commit()
+        request_feed_refresh(user_id)
+        return jsonify({'message': 'Similar movies added successfully', 'added': len(rows)}), 201
+    except sqlite3.Error as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
 @app.route('/api/users/<int:user_id>/similar_movies/<int:movie_id>', methods=['DELETE'])
 def delete_similar_movie(user_id, movie_id):
     try:
@@ -390,6 +937,7 @@ def delete_similar_movie(user_id, movie_id):
             (movie_id, user_id)
         )
         conn.commit()
+        request_feed_refresh(user_id)
         
         return jsonify({'message': 'Movie deleted successfully'}), 200
     except sqlite3.Error as e:
@@ -398,22 +946,144 @@ def delete_similar_movie(user_id, movie_id):
         if 'conn' in locals():
             conn.close()
 
-@app.route('/api/users/<int:user_id>/similar_movies', methods=['GET'])
-def get_similar_movies(user_id):
+@app.route('/api/users/<int:user_id>/similar_movies/batch', methods=['DELETE'])
+def delete_similar_movies_batch(user_id):
+    """Удаляет записи {"ids": [...]} одной транзакцией; id, которых у пользователя нет, возвращаются в not_found"""
+    data = request.get_json(silent=True)
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not ids or not all(
+            isinstance(movie_id, int) and not isinstance(movie_id, bool) for movie_id in ids):
+        return jsonify({'error': 'ids must be a non-empty list of integers'}), 400
+    if len(ids) > SIMILAR_MOVIES_BATCH_LIMIT:
+        return jsonify({'error': f'At most {SIMILAR_MOVIES_BATCH_LIMIT} movies per request'}), 400
+    ids = list(dict.fromkeys(ids))
+    
     try:
         conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute(
-            "SELECT * FROM similar_movies WHERE user_id = ?",
-            (user_id,)
+            f"SELECT id FROM similar_movies WHERE user_id = ? AND id IN ({', '.join('?' * len(ids))})",
+            [user_id] + ids
         )
-        movies = cursor.fetchall()
+        found = {row['id'] for row in cursor.fetchall()}
+        if found:
+            cursor.executemany(
+                "DELETE FROM similar_movies WHERE id = ? AND user_id = ?",
+                [(movie_id, user_id) for movie_id in ids if movie_id in found]
+            )
+            conn.commit()
+            request_feed_refresh(user_id)
         
-        # Преобразуем Row объекты в словари
-        movies_list = [dict(movie) for movie in movies]
+        return jsonify({
+            'deleted': len(found),
+            'not_found': [movie_id for movie_id in ids if movie_id not in found],
+        }), 200
+    except sqlite3.Error as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def request_feed_refresh(user_id):
+    """Ставит ленту в очередь на пересчет; планировщик запускается при первой необходимости"""
+    feed_scheduler.request(user_id)
+    if app.config['FEED_SCHEDULER']:
+        feed_scheduler.start()
+
+@app.route('/api/users/<int:user_id>/feed', methods=['GET'])
+def get_user_feed(user_id):
+    """
+    Готовая лента рекомендаций пользователя (см. services/feeds.py).
+    
+    Лента читается одним запросом; stale = true, если профиль или каталог
+    изменились после расчета - пересчет уже запрошен, клиент показывает то, что есть.
+    """
+    try:
+        conn = get_db()
+        feed = read_feed(conn, user_id)
+        if feed is None:
+            if not conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone():
+                return jsonify({'error': 'User not found'}), 404
+            request_feed_refresh(user_id)
+            response = jsonify({'error': 'Feed is not ready yet'})
+            response.headers['Retry-After'] = '1'
+            return response, 404
+    except sqlite3.Error as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if 'conn' in locals():
+            conn.close()
+    
+    items, refreshed_at, stale = feed
+    if stale:
+        request_feed_refresh(user_id)
+    # items уже сериализованы - вставляются в тело без разбора
+    body = (f'{{"user_id": {user_id}, "refreshed_at": {json.dumps(refreshed_at)}, '
+            f'"stale": {json.dumps(stale)}, "items": {items}}}')
+    return app.response_class(body, status=200, mimetype='application/json')
+
+# Поля списка похожих фильмов (колонки view user_similar_movies)
+SIMILAR_MOVIE_FIELDS = (
+    'id', 'user_id', 'movie_id', 'title', 'date_x', 'score', 'genre', 'overview', 'crew',
+    'orig_title', 'status', 'orig_lang', 'budget_x', 'revenue', 'country', 'added_at',
+)
+# По умолчанию без описания и crew - они составляют основную часть ответа
+SIMILAR_MOVIE_SUMMARY_FIELDS = (
+    'id', 'movie_id', 'title', 'date_x', 'score', 'genre', 'orig_title', 'added_at',
+)
+SIMILAR_MOVIES_PAGE_SIZE = 50
+SIMILAR_MOVIES_MAX_LIMIT = 500
+
+@app.route('/api/users/<int:user_id>/similar_movies', methods=['GET'])
+def get_similar_movies(user_id):
+    """
+    Страница похожих фильмов пользователя.
+    
+    Параметры: limit (до SIMILAR_MOVIES_MAX_LIMIT), after_id - курсор keyset-пагинации,
+    since - только добавленные начиная с этого момента (added_at, ISO 8601),
+    fields - 'summary' (по умолчанию), 'full' или список полей через запятую.
+    Если есть следующая страница, ее курсор отдается в X-Next-After-Id и Link.
+    """
+    try:
+        limit = int(request.args.get('limit', SIMILAR_MOVIES_PAGE_SIZE))
+        after_id = int(request.args.get('after_id', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and after_id must be integers'}), 400
+    if not 1 <= limit <= SIMILAR_MOVIES_MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {SIMILAR_MOVIES_MAX_LIMIT}'}), 400
+    
+    fields = request.args.get('fields', 'summary')
+    if fields == 'summary':
+        columns = SIMILAR_MOVIE_SUMMARY_FIELDS
+    elif fields == 'full':
+        columns = SIMILAR_MOVIE_FIELDS
+    else:
+        columns = tuple(dict.fromkeys(['id'] + [f.strip() for f in fields.split(',') if f.strip()]))
+        unknown = [f for f in columns if f not in SIMILAR_MOVIE_FIELDS]
+        if unknown:
+            return jsonify({'error': f'Unknown fields: {", ".join(unknown)}'}), 400
+    
+    query = f"SELECT {', '.join(columns)} FROM user_similar_movies WHERE user_id = ? AND id > ?"
+    params = [user_id, after_id]
+    if request.args.get('since'):
+        query += " AND added_at >= ?"
+        params.append(request.args['since'])
+    query += " ORDER BY id LIMIT ?"
+    params.append(limit)
+    
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        movies = [dict(zip(columns, row)) for row in cursor.fetchall()]
         
-        return jsonify(movies_list), 200
+        response = jsonify(movies)
+        if len(movies) == limit:
+            next_args = dict(request.args, after_id=movies[-1]['id'])
+            response.headers['X-Next-After-Id'] = str(movies[-1]['id'])
+            response.headers['Link'] = f'<{url_for("get_similar_movies", user_id=user_id, **next_args)}>; rel="next"'
+        return response
     except sqlite3.Error as e:
         return jsonify({'error': str(e)}), 500
     finally:
@@ -484,4 +1154,10 @@ def add_feedback():
 
 
 if __name__ == '__main__':
+    migrate_database()
+    # Сервер загружает модель до первого запроса, импорт app (тесты, скрипты) - нет
+    if isinstance(model, LazyEncoder):
+        model.load()
+    if app.config['FEED_SCHEDULER']:
+        feed_scheduler.start()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""
+Сжатие ответов API по Accept-Encoding.
+
+Сжимаются только JSON-ответы больше порога: на маленьких ответах время
+сжатия больше выигрыша. Brotli используется, если установлен пакет brotli
+и клиент его принимает, иначе gzip.
+"""
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def choose_encoding(accept_encodings):
+    """'br', 'gzip' или None по заголовку Accept-Encoding (werkzeug MIMEAccept)."""
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response, accept_encodings, min_size=MIN_SIZE):
+    """Сжимает ответ на месте, если это выгодно и клиент это принимает."""
+    if (response.direct_passthrough
+            or response.status_code != 200
+            or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # Сжатое представление отличается побайтно - ETag становится слабым
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
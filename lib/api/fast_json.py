@@ -0,0 +1,61 @@
+"""
+Сериализация JSON для ответов API.
+
+OrjsonProvider подключается как app.json, так что через него идут jsonify и
+app.json.dumps. Использует orjson, если он установлен (в несколько раз
+быстрее стандартного json), иначе - стандартный модуль json. Оба варианта
+понимают скаляры и массивы NumPy и строки sqlite3.Row.
+"""
+import json
+import sqlite3
+
+from flask.json.provider import JSONProvider, _default as flask_default
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    """Типы, которых нет в JSON: NumPy, sqlite3.Row, затем все, что понимает Flask."""
+    if isinstance(obj, sqlite3.Row):
+        return dict(obj)
+    if np is not None:
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+    return flask_default(obj)
+
+
+def dumps(obj):
+    """JSON в виде bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON-провайдер Flask поверх dumps()."""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        # Аргументы стандартного json (indent, sort_keys) не поддерживаются и игнорируются
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
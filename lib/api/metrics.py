@@ -0,0 +1,276 @@
+"""
+Легковесные метрики в формате Prometheus и замеры этапов запросов.
+
+span() замеряет участок кода, пишет длительность в гистограмму и в тайминги
+текущего запроса (из них собирается заголовок Server-Timing).
+TimedConnection замеряет все обращения к SQLite.
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=()):
+        return _format_labels(list(zip(self.labelnames, key)) + list(extra))
+
+
+class Counter(_Metric):
+    """Монотонный счетчик с метками."""
+
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{self._labels(key)} {value}'
+
+
+class Gauge(_Metric):
+    """Текущее значение с метками (может уменьшаться)."""
+
+    type_name = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{self._labels(key)} {value}'
+
+
+class Histogram(_Metric):
+    """Гистограмма с кумулятивными бакетами, как у prometheus_client."""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state['count'] if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, dict(state, buckets=list(state['buckets'])))
+                           for key, state in self._values.items())
+        for key, state in items:
+            for bound, count in zip(self.buckets, state['buckets']):
+                yield f'{self.name}_bucket{self._labels(key, [("le", repr(float(bound)))])} {count}'
+            yield f'{self.name}_bucket{self._labels(key, [("le", "+Inf")])} {state["count"]}'
+            yield f'{self.name}_sum{self._labels(key)} {state["sum"]}'
+            yield f'{self.name}_count{self._labels(key)} {state["count"]}'
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их вывод в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUESTS_TOTAL = registry.counter(
+    'http_requests_total', 'HTTP requests by endpoint, method and status',
+    ['endpoint', 'method', 'status'])
+REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ['endpoint'])
+STAGE_SECONDS = registry.histogram(
+    'recommendation_stage_seconds', 'Latency of get_ml_recommendations stages', ['stage'])
+DB_SECONDS = registry.histogram(
+    'db_operation_seconds', 'Time spent in SQLite execute/fetch calls', ['operation'])
+DB_QUERIES_TOTAL = registry.counter(
+    'db_queries_total', 'SQLite statements executed')
+OMDB_REQUESTS_TOTAL = registry.counter(
+    'omdb_requests_total', 'OMDb proxy requests by cache result', ['result'])
+INFERENCE_FALLBACK_TOTAL = registry.counter(
+    'inference_fallback_total', 'Recommendations ranked lexically because the inference worker failed',
+    ['reason'])
+ADMISSION_IN_FLIGHT = registry.gauge(
+    'admission_in_flight', 'Requests holding an admission slot', ['endpoint'])
+ADMISSION_QUEUED = registry.gauge(
+    'admission_queued', 'Requests waiting for an admission slot', ['endpoint'])
+ADMISSION_WAIT_SECONDS = registry.histogram(
+    'admission_wait_seconds', 'Time spent waiting for an admission slot', ['endpoint'])
+ADMISSION_SHED_TOTAL = registry.counter(
+    'admission_shed_total', 'Requests not admitted, by reason and how they were answered',
+    ['endpoint', 'reason', 'action'])
+
+SEARCH_SHARD_FAILURES_TOTAL = registry.counter(
+    'search_shard_failures_total', 'Shards that did not answer a sharded search (shard="all" - none did)',
+    ['shard', 'reason'])
+
+
+def request_timings():
+    """Тайминги текущего запроса {имя: секунды}."""
+    return g.get('server_timings', {}) if has_request_context() else {}
+
+
+def record_timing(name, seconds):
+    """Добавляет длительность к таймингам текущего запроса (для Server-Timing)."""
+    if not has_request_context():
+        return
+    timings = g.setdefault('server_timings', {})
+    timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def span(name, histogram=STAGE_SECONDS, label='stage'):
+    """Замеряет блок кода: гистограмма + тайминг запроса."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, **{label: name})
+        record_timing(name, elapsed)
+
+
+def server_timing_header(timings):
+    """Значение заголовка Server-Timing из {имя: секунды}."""
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items())
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Курсор, замеряющий execute и fetch (сканирование идет во время fetch)."""
+
+    def _timed(self, operation, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_SECONDS.observe(elapsed, operation=operation)
+            record_timing('db', elapsed)
+
+    def execute(self, sql, parameters=()):
+        DB_QUERIES_TOTAL.inc()
+        return self._timed('execute', super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        DB_QUERIES_TOTAL.inc()
+        return self._timed('execute', super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        DB_QUERIES_TOTAL.inc()
+        return self._timed('execute', super().executescript, sql_script)
+
+    def fetchone(self):
+        return self._timed('fetch', super().fetchone)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            return self._timed('fetch', super().fetchmany)
+        return self._timed('fetch', super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed('fetch', super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого - TimedCursor, в том числе у conn.execute*."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Встроенные execute* создают обычный курсор в обход cursor(), поэтому переопределены
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
@@ -0,0 +1,159 @@
+"""
+Профилирование работающего сервера без передеплоя.
+
+StackSampler - сэмплирующий профайлер по сигналу: таймер ITIMER_PROF шлет
+SIGPROF каждые interval секунд процессорного времени, обработчик снимает
+стеки всех потоков (sys._current_frames) и копит их в формате collapsed
+stacks ("поток;кадр;кадр N"), который понимают flamegraph.pl и speedscope.
+Пока таймер не запущен, накладных расходов нет.
+
+AllocationTracer - снимки tracemalloc до и после запроса и разница по строкам
+кода. tracemalloc включается только на время трассируемых запросов; он общий
+для процесса, поэтому при параллельных запросах в разницу попадают и их
+аллокации.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+
+DEFAULT_INTERVAL = 0.005
+MAX_SECONDS = 60.0
+
+
+class ProfilerUnavailable(Exception):
+    """Сэмплер нельзя запустить: нет SIGPROF, обработчик не установлен или он уже работает."""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler:
+    """Сэмплер стеков по SIGPROF; обработчик ставит install() из главного потока."""
+
+    def __init__(self, max_seconds=MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self.samples = Counter()
+        self.started_at = None
+        self.installed = False
+        self._main_ident = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def install(self):
+        """Ставит обработчик SIGPROF (signal.signal работает только в главном потоке)."""
+        if not hasattr(signal, 'SIGPROF'):
+            raise ProfilerUnavailable("SIGPROF is not supported on this platform")
+        if threading.current_thread() is not threading.main_thread():
+            raise ProfilerUnavailable("install() must be called from the main thread")
+        self._main_ident = threading.get_ident()
+        signal.signal(signal.SIGPROF, self._sample)
+        self.installed = True
+
+    @property
+    def running(self):
+        return self.started_at is not None
+
+    def start(self, interval=DEFAULT_INTERVAL):
+        """Запускает сэмплирование; через max_seconds оно останавливается само."""
+        with self._lock:
+            if not self.installed:
+                raise ProfilerUnavailable("Profiler is not installed")
+            if self.running:
+                raise ProfilerUnavailable("Profiler is already running")
+            self.samples = Counter()
+            self.started_at = time.time()
+            signal.setitimer(signal.ITIMER_PROF, interval, interval)
+            self._timer = threading.Timer(self.max_seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def stop(self):
+        """Останавливает таймер; возвращает collapsed stacks."""
+        with self._lock:
+            if self.running:
+                signal.setitimer(signal.ITIMER_PROF, 0, 0)
+                self.started_at = None
+                self._timer.cancel()
+        return self.collapsed()
+
+    def collapsed(self):
+        """Стеки в формате flamegraph.pl: от корня к листу через ';', в конце число сэмплов."""
+        # Копия одной операцией: обработчик может дописывать сэмплы во время чтения
+        samples = dict(self.samples)
+        # Имена потоков - здесь, а не в обработчике: threading.enumerate() берет блокировку
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        merged = Counter()
+        for (ident, stack), count in samples.items():
+            merged[f"{names.get(ident, ident)};{stack}"] += count
+        return ''.join(f"{stack} {count}\n"
+                       for stack, count in sorted(merged.items(), key=lambda item: -item[1]))
+
+    def _sample(self, signum, frame):
+        # Обработчик может прервать поток, держащий блокировки threading, поэтому
+        # здесь только sys._current_frames и никаких вызовов, которые их берут
+        for ident, top in sys._current_frames().items():
+            # Кадр самого обработчика не нужен - берем прерванный
+            if ident == self._main_ident:
+                top = frame
+            stack = []
+            while top is not None:
+                stack.append(_frame_name(top))
+                top = top.f_back
+            self.samples[(ident, ';'.join(reversed(stack)))] += 1
+
+
+class AllocationTracer:
+    """Разница снимков tracemalloc по запросам; последние limit записей хранятся в памяти."""
+
+    def __init__(self, limit=20, top=15, nframes=10):
+        self.top = top
+        self.nframes = nframes
+        self.records = deque(maxlen=limit)
+        self._active = 0
+        self._started = False
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Включает tracemalloc (если нужно) и возвращает снимок до запроса."""
+        with self._lock:
+            # tracemalloc, включенный не нами (PYTHONTRACEMALLOC), не выключаем
+            if self._active == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.nframes)
+                self._started = True
+            self._active += 1
+            tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot(), time.perf_counter()
+
+    def end(self, state, **info):
+        """Запоминает разницу снимков с info (метод, путь и т.п.); последний запрос выключает tracemalloc."""
+        before, started = state
+        try:
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            exclude = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            stats = after.filter_traces(exclude).compare_to(before.filter_traces(exclude), 'lineno')
+            record = dict(
+                info,
+                duration_ms=round((time.perf_counter() - started) * 1000, 3),
+                size_diff=sum(stat.size_diff for stat in stats),
+                peak=peak,
+                top=[{
+                    'location': str(stat.traceback[0]),
+                    'size_diff': stat.size_diff,
+                    'count_diff': stat.count_diff,
+                } for stat in stats[:self.top]],
+            )
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._active == 0 and self._started:
+                    tracemalloc.stop()
+                    self._started = False
+        self.records.append(record)
+        return record
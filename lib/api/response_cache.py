@@ -0,0 +1,134 @@
+"""
+Кэш ответов /api/ml/recommendations.
+
+Ключ строится из нормализованного запроса и версий данных из SQLite:
+user_profile_version пользователя и catalog_version (их меняют триггеры на
+similar_movies и movies). Версии общие для всех воркеров, поэтому лайк в
+одном воркере сразу делает недостижимыми записи во всех остальных, а не по
+истечении TTL. ETag выводится из ключа, так что любой воркер отвечает 304
+на ETag, выданный другим, не вычисляя ответ.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def data_versions(conn, user_id):
+    """(версия профиля пользователя, версия каталога) одним запросом."""
+    row = conn.execute("""
+        SELECT (SELECT version FROM user_profile_version WHERE user_id = ?),
+               (SELECT version FROM catalog_version WHERE id = 1)
+    """, (user_id,)).fetchone()
+    return row[0] or '', row[1] or ''
+
+
+class MemoryBackend:
+    """Потокобезопасный LRU-кэш в памяти процесса с TTL."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """Бэкенд поверх Redis-совместимого сервера (общий для всех воркеров)."""
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='movie_helper:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class RecommendationCache:
+    """Кэш готовых тел ответов рекомендаций с ETag."""
+
+    def __init__(self, backend, ttl=300):
+        self.backend = backend
+        self.ttl = ttl
+
+    def make_key(self, versions, user_id, description, genres, options=None):
+        """Ключ запроса; versions - результат data_versions для пользователя."""
+        profile_version, catalog_version = versions
+        normalized = {
+            'user_id': str(user_id),
+            'profile_version': profile_version,
+            'catalog_version': catalog_version,
+            'description': ' '.join(description.split()),
+            'genres': [g for g in genres if g],
+        }
+        # Параметры, меняющие ответ при тех же входных данных (например, diversity)
+        if options:
+            normalized['options'] = options
+        payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return 'recommendations:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def etag(key):
+        """ETag ответа по ключу: те же запрос и версии данных дают тот же ответ."""
+        return key.rsplit(':', 1)[-1][:32]
+
+    def get(self, key):
+        """Возвращает (body, etag) или None."""
+        body = self.backend.get(key)
+        if body is None:
+            return None
+        return body, self.etag(key)
+
+    def set(self, key, body):
+        """Сохраняет тело ответа (str) и возвращает его ETag."""
+        self.backend.set(key, body, ttl=self.ttl)
+        return self.etag(key)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def create_cache(config):
+    """Создает кэш по настройкам приложения или None, если кэш выключен."""
+    backend = config.get('RECOMMENDATION_CACHE', 'memory')
+    if backend == 'memory':
+        return RecommendationCache(MemoryBackend(), ttl=config.get('RECOMMENDATION_CACHE_TTL', 300))
+    if backend == 'redis':
+        return RecommendationCache(RedisBackend(config['REDIS_URL']),
+                                   ttl=config.get('RECOMMENDATION_CACHE_TTL', 300))
+    if backend in (None, 'none'):
+        return None
+    raise ValueError(f"Unknown recommendation cache backend: {backend}")
@@ -1,8 +1,25 @@
 import unittest
 import sqlite3
 import json
+import threading
+import gzip
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from app import app
+import app as app_module
+from app import (
+    app, recommendation_cache, omdb_client, ingestion_worker, embedding_store, recommendation_admission,
+)
+from inference import InferenceClient
+from metrics import DB_QUERIES_TOTAL
+from response_cache import data_versions
+from shards import ShardServer, ShardedSearch, shard_ranges
+from admission import AdmissionController, AdmissionRejected, Deadline
 
 class BaseTestCase(unittest.TestCase):
     @classmethod
@@ -10,6 +27,10 @@ class BaseTestCase(unittest.TestCase):
         # Настройка тестового приложения
         app.config['TESTING'] = True
         app.config['DATABASE'] = Path(__file__).parent / "test_movies.db"
+        # Ленты пересчитываются тестами явно, без фонового потока
+        app.config['FEED_SCHEDULER'] = False
+        # Тесты меняют каталог между запросами - снимки каталога перестраиваются синхронно
+        app_module.catalog_index.connect = app_module.actor_index.connect = None
         
         cls.client = app.test_client()
         
@@ -64,6 +85,8 @@ class BaseTestCase(unittest.TestCase):
         finally:
             if conn:
                 conn.close()
+        # Миграции применяются при старте приложения, а не в get_db
+        app_module.migrate_database()
 
     @classmethod
     def tearDownClass(cls):
@@ -329,6 +352,144 @@ class TestSimilarMoviesAPI(BaseTestCase):
         
         self.assertEqual(count_before, count_after)
 
+    def test_similar_movies_pagination(self):
+        """Keyset-пагинация: курсор следующей страницы в заголовках, по умолчанию без overview"""
+        for i in range(5):
+            self.client.post('/api/users/1/similar_movies', json={
+                "title": f"Movie {i}", "date_x": "2010-07-16", "score": 8.0,
+                "genre": "Drama", "overview": "Long overview text"
+            })
+
+        first = self.client.get('/api/users/1/similar_movies?limit=2')
+        self.assertEqual([m['title'] for m in first.get_json()], ["Movie 0", "Movie 1"])
+        self.assertNotIn('overview', first.get_json()[0])
+        self.assertIn('rel="next"', first.headers['Link'])
+
+        after_id = first.headers['X-Next-After-Id']
+        rest = self.client.get(f'/api/users/1/similar_movies?limit=10&after_id={after_id}&fields=title,overview')
+        self.assertEqual([m['title'] for m in rest.get_json()], ["Movie 2", "Movie 3", "Movie 4"])
+        self.assertEqual(set(rest.get_json()[0]), {'id', 'title', 'overview'})
+        self.assertNotIn('X-Next-After-Id', rest.headers)
+
+        since = rest.get_json()[-1]['id']
+        added_at = self.client.get(f'/api/users/1/similar_movies?after_id={since - 1}').get_json()[0]['added_at']
+        synced = self.client.get(f'/api/users/1/similar_movies?since={added_at}').get_json()
+        self.assertEqual([m['title'] for m in synced], ["Movie 4"])
+
+        self.assertEqual(self.client.get('/api/users/1/similar_movies?fields=password').status_code, 400)
+        self.assertEqual(self.client.get('/api/users/1/similar_movies?limit=0').status_code, 400)
+
+    def test_add_catalog_movie_by_id(self):
+        """Фильм из каталога сохраняется ссылкой, а список отдает данные из каталога"""
+        conn = None
+        try:
+            conn = sqlite3.connect(app.config['DATABASE'])
+            cursor = conn.execute(
+                "INSERT INTO movies (title, date_x, score, genre, overview) VALUES (?, ?, ?, ?, ?)",
+                ("Interstellar", "2014-11-07", 8.6, "Sci-Fi", "Space travel to save humanity")
+            )
+            catalog_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            if conn:
+                conn.close()
+
+        response = self.client.post('/api/users/1/similar_movies', json={'movie_id': catalog_id})
+        self.assertEqual(response.status_code, 201)
+
+        conn = None
+        try:
+            conn = sqlite3.connect(app.config['DATABASE'])
+            stored = conn.execute("SELECT movie_id, overview FROM similar_movies WHERE user_id = 1").fetchone()
+        finally:
+            if conn:
+                conn.close()
+        self.assertEqual(stored, (catalog_id, None))
+
+        movies = self.client.get('/api/users/1/similar_movies?fields=full').get_json()
+        self.assertEqual(len(movies), 1)
+        self.assertEqual(movies[0]['movie_id'], catalog_id)
+        self.assertEqual(movies[0]['overview'], "Space travel to save humanity")
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        conn.execute("DELETE FROM movies WHERE id = ?", (catalog_id,))
+        conn.commit()
+        conn.close()
+
+    def test_add_unknown_catalog_movie(self):
+        """Неизвестный movie_id без полного описания - 404, с описанием - сохраняется копия"""
+        response = self.client.post('/api/users/1/similar_movies', json={'movie_id': 999999})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post('/api/users/1/similar_movies', json={
+            "movie_id": 999999,
+            "title": "Inception",
+            "date_x": "2010-07-16",
+            "score": 8.8,
+            "genre": "Sci-Fi, Action",
+            "overview": "A thief who steals corporate secrets..."
+        })
+        self.assertEqual(response.status_code, 201)
+        movies = self.client.get('/api/users/1/similar_movies').get_json()
+        self.assertEqual([m['title'] for m in movies], ["Inception"])
+        self.assertIsNone(movies[0]['movie_id'])
+
+    def test_batch_add_similar_movies(self):
+        """Batch-добавление одной транзакцией: ошибка в любом элементе отменяет весь список"""
+        conn = sqlite3.connect(app.config['DATABASE'])
+        catalog_id = conn.execute(
+            "INSERT INTO movies (title, date_x, score, genre, overview) VALUES (?, ?, ?, ?, ?)",
+            ("Interstellar", "2014-11-07", 8.6, "Sci-Fi", "Space travel to save humanity")
+        ).lastrowid
+        conn.commit()
+        conn.close()
+        self.addCleanup(self._delete_movie, catalog_id)
+        inception = {
+            "title": "Inception", "date_x": "2010-07-16", "score": 8.8,
+            "genre": "Sci-Fi, Action", "overview": "A thief who steals corporate secrets..."
+        }
+
+        response = self.client.post('/api/users/1/similar_movies/batch',
+                                    json={'movies': [{'movie_id': catalog_id}, {'title': 'Solaris'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['index'], 1)
+        response = self.client.post('/api/users/1/similar_movies/batch',
+                                    json={'movies': [inception, {'movie_id': 999999}]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.get_json()['index'], 1)
+        self.assertEqual(self.client.get('/api/users/1/similar_movies').get_json(), [])
+
+        response = self.client.post('/api/users/1/similar_movies/batch',
+                                    json={'movies': [{'movie_id': catalog_id}, inception]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json()['added'], 2)
+        movies = self.client.get('/api/users/1/similar_movies').get_json()
+        self.assertEqual([(m['movie_id'], m['title']) for m in movies],
+                         [(catalog_id, "Interstellar"), (None, "Inception")])
+        self.assertEqual(self.client.post('/api/users/999/similar_movies/batch',
+                                          json={'movies': [inception]}).status_code, 404)
+
+    def _delete_movie(self, movie_id):
+        conn = sqlite3.connect(app.config['DATABASE'])
+        conn.execute("DELETE FROM similar_movies WHERE movie_id = ?", (movie_id,))
+        conn.execute("DELETE FROM movies WHERE id = ?", (movie_id,))
+        conn.commit()
+        conn.close()
+
+    def test_batch_delete_similar_movies(self):
+        """Batch-удаление: удаляются только записи пользователя, остальные id - в not_found"""
+        self.client.post('/api/users/1/similar_movies/batch', json={'movies': [
+            {"title": f"Movie {i}", "date_x": "2010-07-16", "score": 8.0, "genre": "Drama", "overview": "Text"}
+            for i in range(3)
+        ]})
+        ids = [m['id'] for m in self.client.get('/api/users/1/similar_movies').get_json()]
+
+        response = self.client.delete('/api/users/1/similar_movies/batch', json={'ids': ids[:2] + [999999]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {'deleted': 2, 'not_found': [999999]})
+        self.assertEqual([m['id'] for m in self.client.get('/api/users/1/similar_movies').get_json()], ids[2:])
+        self.assertEqual(self.client.delete('/api/users/1/similar_movies/batch', json={'ids': 'all'}).status_code, 400)
+
 class TestMLRecommendations(BaseTestCase):
     def setUp(self):
         # Очистка таблиц и добавление тестовых данных
@@ -372,6 +533,9 @@ class TestMLRecommendations(BaseTestCase):
         finally:
             if conn:
                 conn.close()
+        
+        # Каталог меняется в обход API, поэтому сбрасываем кэш ответов
+        recommendation_cache.clear()
 
     def test_ml_recommendations_with_actors(self):
         """Test recommendation system with actor matching from crew field"""
@@ -466,6 +630,484 @@ class TestMLRecommendations(BaseTestCase):
                 self.assertTrue({'Leonardo DiCaprio', 'Ellen Page'}.issubset(matched),
                               "Both actors should be matched")
 
+    def test_actor_names_without_with(self):
+        """Имена актеров находятся в любой формулировке и регистре"""
+        response = self.client.post('/api/ml/recommendations', json={
+            "user_id": 1,
+            "description": "something dark starring keanu reeves",
+            "genres": "Sci-Fi"
+        })
+
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual([movie['title'] for movie in data], ['The Matrix'])
+        self.assertEqual(data[0]['matched_actors'], ['Keanu Reeves'])
+
+class TestRecommendationCache(BaseTestCase):
+    request_data = {
+        "user_id": 1,
+        "description": "A movie about space",
+        "genres": "Sci-Fi"
+    }
+
+    def setUp(self):
+        conn = None
+        try:
+            conn = sqlite3.connect(app.config['DATABASE'])
+            conn.execute("DELETE FROM movies")
+            conn.execute("DELETE FROM similar_movies")
+            conn.execute("DELETE FROM users")
+            conn.execute(
+                "INSERT INTO users (user_id, login, password) VALUES (?, ?, ?)",
+                (1, "test_user", "testpass")
+            )
+            conn.executemany(
+                "INSERT INTO movies (title, genre, overview, score) VALUES (?, ?, ?, ?)",
+                [
+                    ("Interstellar", "Sci-Fi", "Space travel to save humanity", 8.6),
+                    ("Gravity", "Sci-Fi, Drama", "A story about space survival", 7.7)
+                ]
+            )
+            conn.commit()
+        finally:
+            if conn:
+                conn.close()
+        recommendation_cache.clear()
+
+    def test_repeated_request_revalidates_with_etag(self):
+        """Повторный запрос с If-None-Match получает 304 без тела"""
+        first = self.client.post('/api/ml/recommendations', json=self.request_data)
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers.get('ETag')
+        self.assertIsNotNone(etag)
+
+        second = self.client.post('/api/ml/recommendations', json=self.request_data)
+        self.assertEqual(second.get_json(), first.get_json())
+        self.assertEqual(second.headers.get('ETag'), etag)
+
+        revalidated = self.client.post('/api/ml/recommendations', json=self.request_data,
+                                       headers={'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.data, b'')
+
+    def test_similar_movie_changes_invalidate_cache(self):
+        """Добавление похожего фильма меняет версию профиля в базе и ключ кэша"""
+        first = self.client.post('/api/ml/recommendations', json=self.request_data)
+        etag = first.headers.get('ETag')
+
+        response = self.client.post('/api/users/1/similar_movies', json={
+            "title": "Gravity",
+            "date_x": "2013-10-04",
+            "score": 7.7,
+            "genre": "Sci-Fi",
+            "overview": "A story about space survival"
+        })
+        self.assertEqual(response.status_code, 201)
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        try:
+            key = recommendation_cache.make_key(data_versions(conn, 1), 1,
+                                                self.request_data['description'], ['Sci-Fi'])
+        finally:
+            conn.close()
+        self.assertIsNone(recommendation_cache.get(key))
+        second = self.client.post('/api/ml/recommendations', json=self.request_data,
+                                  headers={'If-None-Match': etag})
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers.get('ETag'), etag)
+
+    def test_writes_from_other_processes_invalidate_cache(self):
+        """Версии берутся из базы: изменения в обход этого процесса тоже сбрасывают кэш"""
+        first = self.client.post('/api/ml/recommendations', json=self.request_data)
+        etag = first.headers.get('ETag')
+
+        # Другой воркер с пустым кэшем подтверждает тот же ETag без пересчета
+        recommendation_cache.clear()
+        revalidated = self.client.post('/api/ml/recommendations', json=self.request_data,
+                                       headers={'If-None-Match': etag})
+        self.assertEqual(revalidated.status_code, 304)
+
+        for statement in (
+            "INSERT INTO similar_movies (user_id, title, genre, overview) "
+            "VALUES (1, 'Gravity', 'Sci-Fi', 'A story about space survival')",
+            "UPDATE movies SET score = 9.0 WHERE title = 'Gravity'",
+        ):
+            conn = sqlite3.connect(app.config['DATABASE'])
+            try:
+                conn.execute(statement)
+                conn.commit()
+            finally:
+                conn.close()
+            response = self.client.post('/api/ml/recommendations', json=self.request_data,
+                                        headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers.get('ETag'), etag)
+            etag = response.headers.get('ETag')
+
+    def test_diversity_option(self):
+        """diversity включает MMR и входит в ключ кэша; значения вне [0, 1] - 400"""
+        plain = self.client.post('/api/ml/recommendations', json=self.request_data)
+        diverse = self.client.post('/api/ml/recommendations', json=dict(self.request_data, diversity=0.5))
+        self.assertEqual(diverse.status_code, 200)
+        versions = ('', '')
+        self.assertNotEqual(recommendation_cache.make_key(versions, 1, 'a', ['b']),
+                            recommendation_cache.make_key(versions, 1, 'a', ['b'], {'diversity': 0.5}))
+        self.assertEqual({m['id'] for m in diverse.get_json()}, {m['id'] for m in plain.get_json()})
+
+        invalid = self.client.post('/api/ml/recommendations', json=dict(self.request_data, diversity=2))
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_lexical_fallback_when_inference_unavailable(self):
+        """Без воркера инференса ранжирование идет по словам, ответ не кэшируется"""
+        client = InferenceClient(Path(__file__).parent / "no-inference.sock", timeout=0.1)
+        original = app_module.model
+        app_module.model = embedding_store.encoder = client
+        limit = app.config['LEXICAL_MAX_CANDIDATES']
+        try:
+            response = self.client.post('/api/ml/recommendations', json=self.request_data)
+            # Запасное ранжирование видит только кандидатов с лучшей оценкой
+            app.config['LEXICAL_MAX_CANDIDATES'] = 1
+            capped = self.client.post('/api/ml/recommendations', json=self.request_data)
+        finally:
+            app.config['LEXICAL_MAX_CANDIDATES'] = limit
+            app_module.model = embedding_store.encoder = original
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('X-Ranking'), 'lexical')
+        self.assertNotIn('ETag', response.headers)
+        # "space" есть в обоих описаниях, но "A story about space survival" ближе к запросу
+        self.assertEqual([m['title'] for m in response.get_json()], ['Gravity', 'Interstellar'])
+        self.assertEqual([m['title'] for m in capped.get_json()], ['Interstellar'])
+
+        recovered = self.client.post('/api/ml/recommendations', json=self.request_data)
+        self.assertNotIn('X-Ranking', recovered.headers)
+
+    def start_shards(self, count):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        conn = sqlite3.connect(app.config['DATABASE'])
+        ranges = shard_ranges(conn, count)
+        conn.close()
+        addresses = []
+        for shard, id_range in enumerate(ranges):
+            server = ShardServer(app.config['DATABASE'], Path(tmp.name) / f"shard-{shard}.sock", id_range)
+            ready = threading.Event()
+            threading.Thread(target=server.serve_forever, args=(ready,), daemon=True).start()
+            ready.wait()
+            self.addCleanup(server.close)
+            addresses.append(server.address)
+        return addresses
+
+    def assertRecommendationsEqual(self, actual, expected):
+        # Матрицы сходства считаются разными BLAS-вызовами, скоры совпадают с точностью до округления
+        self.assertEqual([{k: v for k, v in m.items() if k != 'similarity_score'} for m in actual],
+                         [{k: v for k, v in m.items() if k != 'similarity_score'} for m in expected])
+        for a, e in zip(actual, expected):
+            self.assertAlmostEqual(a['similarity_score'], e['similarity_score'], places=6)
+
+    def test_sharded_search_matches_local(self):
+        """Шарды по диапазонам id дают тот же ответ, что и поиск в одном процессе"""
+        local = self.client.post('/api/ml/recommendations', json=self.request_data).get_json()
+        recommendation_cache.clear()
+        addresses = self.start_shards(2)
+        app_module.shard_search = ShardedSearch(addresses, timeout=5)
+        try:
+            sharded = self.client.post('/api/ml/recommendations', json=self.request_data)
+            self.assertRecommendationsEqual(sharded.get_json(), local)
+            self.assertIn('ETag', sharded.headers)
+
+            # Один шард недоступен - частичный ответ без кэширования
+            recommendation_cache.clear()
+            app_module.shard_search = ShardedSearch([addresses[0], addresses[1] + '.down'], timeout=5)
+            partial = self.client.post('/api/ml/recommendations', json=self.request_data)
+        finally:
+            app_module.shard_search = None
+
+        self.assertEqual(partial.status_code, 200)
+        self.assertEqual(partial.headers.get('X-Search-Shards'), '1/2')
+        self.assertNotIn('ETag', partial.headers)
+        self.assertEqual([m['title'] for m in partial.get_json()], ['Interstellar'])
+
+class TestUserFeed(BaseTestCase):
+    def setUp(self):
+        TestRecommendationCache.setUp(self)
+        conn = app_module.get_db()
+        conn.execute("DELETE FROM user_feeds")
+        interstellar_id = conn.execute("SELECT id FROM movies WHERE title = 'Interstellar'").fetchone()[0]
+        conn.commit()
+        conn.close()
+        self.client.post('/api/users/1/similar_movies', json={'movie_id': interstellar_id})
+
+    def test_feed_is_served_from_storage(self):
+        """Лента отдается из user_feeds и помечается устаревшей после изменения профиля"""
+        missing = self.client.get('/api/users/1/feed')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing.get_json()['error'], 'Feed is not ready yet')
+        self.assertEqual(self.client.get('/api/users/999/feed').get_json()['error'], 'User not found')
+
+        conn = app_module.get_db()
+        try:
+            app_module.feed_scheduler.refresh(conn, 1)
+        finally:
+            conn.close()
+        feed = self.client.get('/api/users/1/feed')
+        self.assertEqual(feed.status_code, 200)
+        body = feed.get_json()
+        self.assertFalse(body['stale'])
+        self.assertEqual([m['title'] for m in body['items']], ['Gravity'])
+
+        self.client.post('/api/users/1/similar_movies', json={
+            'title': 'Solaris', 'date_x': '1972', 'score': 8.0, 'genre': 'Sci-Fi', 'overview': 'A planet ocean'
+        })
+        self.assertTrue(self.client.get('/api/users/1/feed').get_json()['stale'])
+
+    def test_recommendations_use_taste_clusters(self):
+        """Кластеры вкусов не меняют ответ на маленьком каталоге; выключенные - не строятся"""
+        # По умолчанию (TASTE_CLUSTER_PROBES=0) планировщик кластеры не обновляет
+        self.assertIsNone(app_module.feed_scheduler.cluster_index)
+        request_data = TestRecommendationCache.request_data
+        expected = self.client.post('/api/ml/recommendations', json=request_data).get_json()
+        recommendation_cache.clear()
+        conn = app_module.get_db()
+        app.config['TASTE_CLUSTER_PROBES'] = 2
+        try:
+            app_module.cluster_index.update(conn, embedding_store, app_module.catalog_index)
+            self.assertIsNotNone(app_module.cluster_index.get(conn))
+            response = self.client.post('/api/ml/recommendations', json=request_data)
+        finally:
+            app.config['TASTE_CLUSTER_PROBES'] = 0
+            conn.execute("DELETE FROM taste_clusters")
+            conn.execute("DELETE FROM user_taste_clusters")
+            conn.commit()
+            conn.close()
+        self.assertEqual([m['id'] for m in response.get_json()], [m['id'] for m in expected])
+        self.assertIn('recommendation_stage_seconds_count{stage="taste_clusters"}',
+                      self.client.get('/metrics').get_data(as_text=True))
+
+class TestMetrics(BaseTestCase):
+    request_data = TestRecommendationCache.request_data
+
+    def setUp(self):
+        TestRecommendationCache.setUp(self)
+
+    def tearDown(self):
+        app.config['SERVER_TIMING'] = False
+
+    def test_metrics_endpoint_reports_stages(self):
+        """/metrics отдает гистограммы этапов рекомендаций и обращений к БД"""
+        self.client.post('/api/ml/recommendations', json=self.request_data)
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data(as_text=True)
+        self.assertIn('recommendation_stage_seconds_count{stage="encode_candidates"}', body)
+        self.assertIn('db_operation_seconds_count{operation="fetch"}', body)
+        self.assertIn('http_requests_total{endpoint="/api/ml/recommendations",method="POST",status="200"}', body)
+
+    def test_connection_execute_is_counted(self):
+        """conn.execute/executemany проходят через TimedCursor так же, как cursor().execute"""
+        before = DB_QUERIES_TOTAL.value()
+        conn = app_module.get_db()
+        try:
+            conn.execute("SELECT 1").fetchone()
+            conn.executemany("UPDATE users SET login = login WHERE user_id = ?", [(1,)])
+        finally:
+            conn.close()
+        self.assertEqual(DB_QUERIES_TOTAL.value(), before + 2)
+
+    def test_server_timing_header_is_opt_in(self):
+        """Server-Timing добавляется только при включенной настройке"""
+        response = self.client.post('/api/ml/recommendations', json=self.request_data)
+        self.assertNotIn('Server-Timing', response.headers)
+        
+        recommendation_cache.clear()
+        app.config['SERVER_TIMING'] = True
+        response = self.client.post('/api/ml/recommendations', json=self.request_data)
+        timing = response.headers.get('Server-Timing', '')
+        for name in ('genre_filter', 'encode_candidates', 'scoring', 'db', 'total'):
+            self.assertIn(f'{name};dur=', timing)
+
+class TestProfiling(BaseTestCase):
+    request_data = TestRecommendationCache.request_data
+    admin = {'Authorization': 'Bearer secret'}
+
+    def setUp(self):
+        TestRecommendationCache.setUp(self)
+        app.config['ADMIN_TOKEN'] = 'secret'
+        app_module.allocation_tracer.records.clear()
+
+    def tearDown(self):
+        app_module.stack_sampler.stop()
+        app.config['ADMIN_TOKEN'] = None
+
+    def test_admin_endpoints_require_token(self):
+        """Без ADMIN_TOKEN админских эндпоинтов нет, с неверным токеном - 403"""
+        self.assertEqual(self.client.get('/admin/allocations').status_code, 403)
+        wrong = {'Authorization': 'Bearer guess'}
+        self.assertEqual(self.client.post('/admin/profiler/start', headers=wrong).status_code, 403)
+        self.assertEqual(self.client.get('/admin/allocations', headers=self.admin).status_code, 200)
+        app.config['ADMIN_TOKEN'] = None
+        self.assertEqual(self.client.get('/admin/allocations', headers=self.admin).status_code, 404)
+
+    def test_sampling_profiler_collects_request_stacks(self):
+        """Сэмплы содержат стек обработчика рекомендаций в формате collapsed stacks"""
+        app_module.stack_sampler.install()
+        response = self.client.post('/admin/profiler/start?interval=0.001', headers=self.admin)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.post('/admin/profiler/start', headers=self.admin).status_code, 409)
+
+        for i in range(200):
+            recommendation_cache.clear()
+            self.client.post('/api/ml/recommendations',
+                             json=dict(self.request_data, description=f"A movie about space {i}"))
+            if 'app.py:get_ml_recommendations' in app_module.stack_sampler.collapsed():
+                break
+        self.assertEqual(self.client.get('/admin/profiler', headers=self.admin).headers['X-Profiler-Running'], '1')
+        profile = self.client.post('/admin/profiler/stop', headers=self.admin).get_data(as_text=True)
+
+        stack, count = next(line for line in profile.splitlines()
+                            if 'app.py:get_ml_recommendations' in line).rsplit(' ', 1)
+        self.assertTrue(stack.startswith('MainThread;'))
+        self.assertGreater(int(count), 0)
+        self.assertFalse(app_module.stack_sampler.running)
+
+    def test_allocation_trace_by_header(self):
+        """Снимок tracemalloc снимается по заголовку только для админа"""
+        self.client.post('/api/ml/recommendations', json=self.request_data,
+                         headers={'X-Trace-Allocations': '1'})
+        self.assertEqual(self.client.get('/admin/allocations', headers=self.admin).get_json(), [])
+
+        recommendation_cache.clear()
+        before = datetime.now(timezone.utc)
+        self.client.post('/api/ml/recommendations', json=self.request_data,
+                         headers=dict(self.admin, **{'X-Trace-Allocations': '1'}))
+        after = datetime.now(timezone.utc)
+        records = self.client.get('/admin/allocations', headers=self.admin).get_json()
+        self.assertEqual([r['path'] for r in records], ['/api/ml/recommendations'])
+        # started_at - начало запроса: вместе с длительностью не выходит за его конец
+        started_at = datetime.strptime(records[0]['started_at'], '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+        self.assertLessEqual(before, started_at)
+        self.assertLessEqual(started_at + timedelta(milliseconds=records[0]['duration_ms']), after)
+        self.assertGreater(records[0]['peak'], 0)
+        self.assertTrue(records[0]['top'])
+
+class TestSnapshots(BaseTestCase):
+    admin = TestProfiling.admin
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        app.config['ADMIN_TOKEN'] = 'secret'
+        app.config['SNAPSHOT_DIR'] = Path(tmp.name)
+
+    def tearDown(self):
+        app.config['ADMIN_TOKEN'] = None
+
+    def test_snapshot_endpoint(self):
+        """Снимок пишется в фоне и появляется в списке; в нем те же пользователи, что в базе"""
+        self.assertEqual(self.client.post('/admin/snapshots').status_code, 403)
+        response = self.client.post('/admin/snapshots', headers=self.admin)
+        self.assertEqual(response.status_code, 202)
+        name = response.get_json()['snapshot']
+
+        for _ in range(100):
+            listing = self.client.get('/admin/snapshots', headers=self.admin).get_json()
+            if listing['running'] is None:
+                break
+            time.sleep(0.05)
+        self.assertNotIn('error', listing['last'])
+        self.assertEqual([s['name'] for s in listing['snapshots']], [name])
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        expected = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        conn.close()
+        conn = sqlite3.connect(app.config['SNAPSHOT_DIR'] / name)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0], expected)
+        conn.close()
+
+class TestAdmission(BaseTestCase):
+    request_data = TestRecommendationCache.request_data
+
+    def setUp(self):
+        TestRecommendationCache.setUp(self)
+        self.limits = (recommendation_admission.max_queue, recommendation_admission.max_wait)
+        # Единственный слот занят "другим" запросом
+        self.original_concurrency = recommendation_admission.max_concurrent
+        recommendation_admission.max_concurrent = 1
+        recommendation_admission.acquire()
+
+    def tearDown(self):
+        recommendation_admission.release()
+        recommendation_admission.max_concurrent = self.original_concurrency
+        recommendation_admission.max_queue, recommendation_admission.max_wait = self.limits
+
+    def test_queue_then_reject(self):
+        """Ожидающие сверх max_queue отклоняются сразу, остальные получают слот после release"""
+        controller = AdmissionController('/test', max_concurrent=1, max_queue=1, max_wait=5)
+        controller.acquire()
+        waiter = threading.Thread(target=controller.acquire)
+        waiter.start()
+        while controller.queued == 0:
+            threading.Event().wait(0.005)
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.acquire()
+        self.assertEqual(rejected.exception.reason, 'queue_full')
+        controller.release()
+        waiter.join(1)
+        self.assertEqual((controller.in_flight, controller.queued), (1, 0))
+
+        with self.assertRaises(AdmissionRejected) as timeout:
+            controller.acquire(Deadline(0.01))
+        self.assertEqual(timeout.exception.reason, 'timeout')
+
+        # Истекший дедлайн не получает и свободный слот
+        controller.release()
+        deadline = Deadline(0.001)
+        time.sleep(0.002)
+        with self.assertRaises(AdmissionRejected) as expired:
+            controller.acquire(deadline)
+        self.assertEqual(expired.exception.reason, 'timeout')
+        self.assertEqual(controller.in_flight, 0)
+
+    def test_full_queue_returns_503(self):
+        recommendation_admission.max_queue = 0
+        response = self.client.post('/api/ml/recommendations', json=self.request_data)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertIn('admission_shed_total{endpoint="/api/ml/recommendations",reason="queue_full",'
+                      'action="rejected"}', self.client.get('/metrics').get_data(as_text=True))
+
+    def test_wait_timeout_returns_503(self):
+        """Не дождавшись слота за max_wait или до дедлайна, запрос получает 503 с Retry-After"""
+        recommendation_admission.max_wait = 0.02
+        response = self.client.post('/api/ml/recommendations', json=self.request_data)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertIn('admission_shed_total{endpoint="/api/ml/recommendations",reason="timeout",'
+                      'action="rejected"}', self.client.get('/metrics').get_data(as_text=True))
+
+        recommendation_admission.max_wait = 1
+        expired = self.client.post('/api/ml/recommendations', json=self.request_data,
+                                   headers={'X-Request-Timeout': '20'})
+        self.assertEqual(expired.status_code, 503)
+
+        invalid = self.client.post('/api/ml/recommendations', json=self.request_data,
+                                   headers={'X-Request-Timeout': 'soon'})
+        self.assertEqual(invalid.status_code, 400)
+
+class TestStartup(unittest.TestCase):
+    def test_import_does_not_load_ml_dependencies(self):
+        """Импорт app не загружает модель и тяжелые ML-библиотеки"""
+        code = ("import sys, app; "
+                "print(','.join(m for m in ('torch', 'sentence_transformers', 'sklearn', 'onnxruntime') "
+                "if m in sys.modules)); print(app.model.loaded)")
+        result = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, check=True)
+        heavy, loaded = result.stdout.splitlines()[-2:]
+        self.assertEqual(heavy, '')
+        self.assertEqual(loaded, 'False')
+
 class FeedbackAPITestCase(unittest.TestCase):
     def setUp(self):
         """Initialize test DB and client"""
@@ -608,5 +1250,124 @@ class FeedbackAPITestCase(unittest.TestCase):
             self.assertEqual(grade, 5)
             self.assertEqual(text, "Changed my mind, these are great!")
 
+class TestJsonResponses(BaseTestCase):
+    def setUp(self):
+        TestSimilarMoviesAPI.setUp(self)
+
+    def test_provider_serializes_numpy_and_rows(self):
+        """app.json понимает скаляры и массивы NumPy и sqlite3.Row"""
+        conn = sqlite3.connect(":memory:")
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT 1 AS id, 'Alien' AS title").fetchone()
+        conn.close()
+
+        body = app.json.dumps({'score': np.float32(0.25), 'vector': np.arange(3), 'movie': row})
+        self.assertEqual(json.loads(body), {'score': 0.25, 'vector': [0, 1, 2], 'movie': {'id': 1, 'title': 'Alien'}})
+
+    def test_large_json_is_gzipped(self):
+        """Большой JSON сжимается по Accept-Encoding, маленький - нет"""
+        for i in range(20):
+            self.client.post('/api/users/1/similar_movies', json={
+                "title": f"Movie {i}", "date_x": "2010-07-16", "score": 8.0,
+                "genre": "Drama", "overview": "A long overview of the plot " * 10
+            })
+
+        plain = self.client.get('/api/users/1/similar_movies?fields=full')
+        compressed = self.client.get('/api/users/1/similar_movies?fields=full',
+                                     headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(compressed.data)), plain.get_json())
+        self.assertLess(len(compressed.data), len(plain.data))
+
+        small = self.client.get('/api/users/1/similar_movies?limit=1', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', small.headers)
+
+class TestOmdbProxy(BaseTestCase):
+    def setUp(self):
+        self.upstream_calls = 0
+        test = self
+
+        class FakeOmdbHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                test.upstream_calls += 1
+                if 'i=' in self.path:
+                    body = json.dumps({"Response": "True", "Type": "movie", "imdbID": "tt0078748",
+                                       "Title": "Alien", "Genre": "Horror, Sci-Fi",
+                                       "Plot": "A deadly lifeform aboard a spacecraft"}).encode()
+                else:
+                    body = json.dumps({"Response": "True", "Search": [{"Title": "Alien", "imdbID": "tt0078748"}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOmdbHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.original_url = omdb_client.base_url
+        omdb_client.base_url = f'http://127.0.0.1:{self.server.server_port}/'
+        self.original_flush_interval = ingestion_worker.flush_interval
+        ingestion_worker.flush_interval = 0.05
+
+    def tearDown(self):
+        omdb_client.base_url = self.original_url
+        ingestion_worker.flush_interval = self.original_flush_interval
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_search_is_cached(self):
+        """Повторный поиск отдается из кэша без обращения к OMDb"""
+        first = self.client.get('/api/omdb/search?s=Alien')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['X-Cache'], 'MISS')
+        self.assertEqual(first.get_json()['Search'][0]['imdbID'], 'tt0078748')
+
+        second = self.client.get('/api/omdb/search?s=alien')
+        self.assertEqual(second.headers['X-Cache'], 'HIT')
+        self.assertEqual(self.upstream_calls, 1)
+
+    def test_movie_details_are_ingested_into_catalog(self):
+        """Карточка фильма из OMDb в фоне попадает в каталог"""
+        response = self.client.get('/api/omdb/movie/tt0078748?plot=full')
+        self.assertEqual(response.status_code, 200)
+        ingestion_worker.queue.join()
+
+        conn = sqlite3.connect(app.config['DATABASE'])
+        try:
+            row = conn.execute("SELECT title, genre FROM movies WHERE imdb_id = 'tt0078748'").fetchone()
+            conn.execute("DELETE FROM movies WHERE imdb_id = 'tt0078748'")
+            conn.commit()
+        finally:
+            conn.close()
+        self.assertEqual(row, ("Alien", "Horror, Sci-Fi"))
+
+    def test_search_requires_query(self):
+        response = self.client.get('/api/omdb/search')
+        self.assertEqual(response.status_code, 400)
+
+class TestProcessStart(BaseTestCase):
+    def test_first_request_migrates_database(self):
+        """Без __main__ (под WSGI-сервером) миграции применяются перед первым запросом процесса"""
+        database = app.config['DATABASE']
+        with tempfile.TemporaryDirectory() as tmp:
+            app.config['DATABASE'] = Path(tmp) / "fresh.db"
+            app_module.process_state['started'] = False
+            try:
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+                self.assertTrue(app_module.process_state['started'])
+                conn = sqlite3.connect(app.config['DATABASE'])
+                try:
+                    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                finally:
+                    conn.close()
+            finally:
+                app.config['DATABASE'] = database
+        self.assertTrue({'users', 'catalog_version', 'user_feeds', 'feed_requests'} <= tables)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,7 +1,4 @@
 class MovieConstants {
-  static const String omdbApiKey = 'e49b8565';
-  static const String omdbApiUrl = 'https://www.omdbapi.com';
-
   static const Map<int, String> genres = {
     1: 'Action',
     2: 'Adventure',
@@ -4,6 +4,11 @@ class MlRecommendationsDataSource {
   final Dio _dio;
   final String _baseUrl;
 
+  // Последний ответ и его ETag для каждого запроса: сервер отвечает 304,
+  // если рекомендации не изменились, и тело не передается повторно.
+  final Map<String, ({String etag, List<Map<String, dynamic>> data})>
+      _etagCache = {};
+
   MlRecommendationsDataSource({
     Dio? dio,
     String? baseUrl,
@@ -25,6 +30,9 @@ class MlRecommendationsDataSource {
       final url = '$_baseUrl/ml/recommendations';
       log.d('Using URL: $url');
 
+      final cacheKey = '$userId|$description|${genres.join(',')}';
+      final cached = _etagCache[cacheKey];
+
       final response = await _dio.post(
         url,
         data: {
@@ -32,13 +40,29 @@ class MlRecommendationsDataSource {
           'description': description,
           'genres': genres.join(','),
         },
+        options: Options(
+          headers: {if (cached != null) 'If-None-Match': cached.etag},
+          validateStatus: (status) =>
+              status != null && (status == 304 || status < 300),
+        ),
       );
 
       log.d('ML API response status: ${response.statusCode}');
+
+      if (response.statusCode == 304 && cached != null) {
+        log.d('ML recommendations not modified, using cached response');
+        return cached.data;
+      }
+
       log.d('ML API response data: ${response.data}');
 
       if (response.statusCode == 200) {
-        return List<Map<String, dynamic>>.from(response.data);
+        final data = List<Map<String, dynamic>>.from(response.data);
+        final etag = response.headers.value('etag');
+        if (etag != null) {
+          _etagCache[cacheKey] = (etag: etag, data: data);
+        }
+        return data;
       } else {
         log.e('Failed to get ML recommendations: ${response.statusMessage}');
         throw Exception(
@@ -1,26 +1,22 @@
 // lib/features/movies/data/datasources/movie_remote_datasource.dart
 import 'package:dio/dio.dart';
-import 'package:movie_helper/core/constants/app_constants.dart';
-
 
+// Запросы к OMDb идут через прокси бэкенда (/api/omdb), который кэширует
+// ответы и хранит API-ключ у себя
 class MovieRemoteDataSource {
   final Dio _dio;
   final String _baseUrl;
-  final String _apiKey;
 
   MovieRemoteDataSource({
     Dio? dio,
     String? baseUrl,
-    String? apiKey,
   })  : _dio = dio ?? Dio(),
-        _baseUrl = baseUrl ?? MovieConstants.omdbApiUrl,
-        _apiKey = apiKey ?? MovieConstants.omdbApiKey;
+        _baseUrl = baseUrl ?? 'http://localhost:5000/api/omdb';
 
   Future<Map<String, dynamic>> searchMovies(String query) async {
     final response = await _dio.get(
-      _baseUrl,
+      '$_baseUrl/search',
       queryParameters: {
-        'apikey': _apiKey,
         's': query,
         'type': 'movie',
         'page': 1,
@@ -31,13 +27,11 @@ class MovieRemoteDataSource {
 
   Future<Map<String, dynamic>> getMovieDetails(String imdbId) async {
     final response = await _dio.get(
-      _baseUrl,
+      '$_baseUrl/movie/$imdbId',
       queryParameters: {
-        'apikey': _apiKey,
-        'i': imdbId,
         'plot': 'full',
       },
     );
     return response.data;
   }
-}
\ No newline at end of file
+}
@@ -11,9 +11,46 @@ class SimilarMoviesDataSource {
   })  : _dio = dio ?? Dio(),
         _baseUrl = baseUrl ?? 'http://localhost:5000/api';
 
-  Future<List<Map<String, dynamic>>> getUserSimilarMovies(int userId) async {
-    final response = await _dio.get('$_baseUrl/users/$userId/similar_movies');
-    return List<Map<String, dynamic>>.from(response.data);
+  // Уже загруженные похожие фильмы пользователей по id записи (в порядке id)
+  final Map<int, Map<int, Map<String, dynamic>>> _syncedMovies = {};
+
+  // Список отдается страницами (keyset по id), следующая страница - по X-Next-After-Id.
+  // Полностью он загружается один раз, дальше запрашиваются только записи с added_at
+  // не раньше последней уже полученной (since); refresh - загрузить заново целиком
+  Future<List<Map<String, dynamic>>> getUserSimilarMovies(int userId,
+      {int pageSize = 200, bool refresh = false}) async {
+    final synced = refresh ? null : _syncedMovies[userId];
+    final movies = <int, Map<String, dynamic>>{...?synced};
+    final since = synced == null ? null : _lastAddedAt(synced.values);
+    String? afterId;
+    do {
+      final response = await _dio.get(
+        '$_baseUrl/users/$userId/similar_movies',
+        queryParameters: {
+          'limit': pageSize,
+          if (afterId != null) 'after_id': afterId,
+          if (since != null) 'since': since,
+        },
+      );
+      for (final movie in List<Map<String, dynamic>>.from(response.data)) {
+        movies[movie['id'] as int] = movie;
+      }
+      afterId = response.headers.value('x-next-after-id');
+    } while (afterId != null);
+    _syncedMovies[userId] = movies;
+    return movies.values.toList();
+  }
+
+  // Метки added_at сервера в одном формате ISO 8601 и сравниваются как строки
+  String? _lastAddedAt(Iterable<Map<String, dynamic>> movies) {
+    String? last;
+    for (final movie in movies) {
+      final addedAt = movie['added_at'] as String?;
+      if (addedAt != null && (last == null || addedAt.compareTo(last) > 0)) {
+        last = addedAt;
+      }
+    }
+    return last;
   }
 
   Future<void> addSimilarMovie(
@@ -24,12 +61,31 @@ class SimilarMoviesDataSource {
     );
   }
 
+  // Несколько фильмов одним запросом и одной транзакцией на сервере (до 500 за раз)
+  Future<void> addSimilarMovies(
+      int userId, List<Map<String, dynamic>> movies) async {
+    await _dio.post(
+      '$_baseUrl/users/$userId/similar_movies/batch',
+      data: {'movies': movies},
+    );
+  }
+
+  Future<void> removeSimilarMovies(int userId, List<int> movieIds) async {
+    await _dio.delete(
+      '$_baseUrl/users/$userId/similar_movies/batch',
+      data: {'ids': movieIds},
+    );
+    // Удаления не видны через since - убираем их из загруженного списка сами
+    _syncedMovies[userId]?.removeWhere((id, _) => movieIds.contains(id));
+  }
+
   Future<void> removeSimilarMovie(int userId, int movieId) async {
     try {
       log.t('Removing movie with ID: $movieId for user: $userId');
       final response =
           await _dio.delete('$_baseUrl/users/$userId/similar_movies/$movieId');
       log.d('Delete response: ${response.statusCode}');
+      _syncedMovies[userId]?.remove(movieId);
     } catch (e) {
       log.e('Error removing movie: $e');
       if (e is DioException) {
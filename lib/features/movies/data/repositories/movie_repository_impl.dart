@@ -171,6 +171,8 @@ class MovieRepositoryImpl implements MovieRepository {
               'https://via.placeholder.com/300x450?text=No+Poster';
           String actors = '';
           String director = '';
+          // Список похожих фильмов приходит без описания, оно берется из OMDb
+          String overview = movieData['overview'] ?? '';
 
           final imdbId = movieData['imdb_id'] ?? movieData['orig_title'] ?? '';
 
@@ -184,6 +186,9 @@ class MovieRepositoryImpl implements MovieRepository {
                 actors = details['Actors'] != 'N/A' ? details['Actors'] : '';
                 director =
                     details['Director'] != 'N/A' ? details['Director'] : '';
+                if (overview.isEmpty && details['Plot'] != 'N/A') {
+                  overview = details['Plot'] ?? '';
+                }
               }
             } catch (e) {
               print('Error fetching movie details: $e');
@@ -196,7 +201,7 @@ class MovieRepositoryImpl implements MovieRepository {
             id: movieData['id'] ?? 0,
             imdbId: imdbId,
             title: movieData['title'] ?? '',
-            overview: movieData['overview'] ?? '',
+            overview: overview,
             posterPath: posterPath,
             genres: movieData['genre']?.toString().split(',') ?? [],
             voteAverage: movieData['score']?.toDouble() ?? 0.0,